@@ -1,7 +1,46 @@
 # alpaca_client.py
-import requests
+#
+# Every call goes through the shared http_pool (keep-alive, HTTP/2, per-host limits).
+# Each operation has an async form (`*_async`) for event-loop callers and a sync
+# wrapper of the same name without the suffix for the threadpool routes.
+#
+# Trading calls additionally go through trading_guard: a per-token rate budget
+# fed by Alpaca's X-RateLimit-* headers, a circuit breaker per endpoint, and
+# jittered retries of 429/5xx/transport failures.
+import asyncio
+import logging
+import random
+import uuid
+from datetime import date, datetime
 from decimal import Decimal
-from config import ALPACA_API_KEY, ALPACA_SECRET_KEY, ALPACA_BASE_URL
+
+import httpx
+from config import (
+    ALPACA_API_KEY,
+    ALPACA_SECRET_KEY,
+    ALPACA_BASE_URL,
+    ALPACA_DATA_URL,
+    ALPACA_CLIENT_ID,
+    ALPACA_CLIENT_SECRET,
+    ALPACA_REDIRECT_URI,
+    ALPACA_TOKEN_URL,
+    QUOTE_CACHE_TTL,
+    QUOTE_CACHE_STALE_TTL,
+    QUOTE_CACHE_MAX_SIZE,
+    QUOTE_FETCH_TIMEOUT,
+    QUOTE_BATCH_SIZE,
+    ALPACA_BUDGET_MAX_WAIT,
+    ALPACA_RETRY_ATTEMPTS,
+    ALPACA_RETRY_BASE_DELAY,
+    ALPACA_RETRY_MAX_DELAY,
+    ALPACA_BREAKER_FAILURES,
+    ALPACA_BREAKER_COOLDOWN,
+)
+from http_client import http_pool
+from quote_cache import QuoteCache
+from trading_guard import CircuitBreaker, RateBudgets, TradingAccessDenied, TradingUnavailable
+
+logger = logging.getLogger(__name__)
 
 # --- Static-key headers (market data only) ---
 
@@ -20,11 +59,11 @@ def _trading_headers(access_token: str) -> dict:
 # Market data — always uses static keys, no user token needed
 # ---------------------------------------------------------------------------
 
-def get_quote(symbol: str) -> Decimal | None:
-    """Get latest trade price for a symbol."""
-    url = f"https://data.alpaca.markets/v2/stocks/{symbol}/trades/latest"
-    resp = requests.get(url, headers=_STATIC_HEADERS, timeout=10)
-    if not resp.ok:
+async def _fetch_quote(symbol: str) -> Decimal | None:
+    """Fetch the latest trade price for a symbol straight from Alpaca."""
+    url = f"{ALPACA_DATA_URL}/v2/stocks/{symbol}/trades/latest"
+    resp = await http_pool.request("GET", url, headers=_STATIC_HEADERS, timeout=QUOTE_FETCH_TIMEOUT, endpoint="latest_trade")
+    if not resp.is_success:
         return None
     try:
         return Decimal(str(resp.json()["trade"]["p"]))
@@ -32,48 +71,334 @@ def get_quote(symbol: str) -> Decimal | None:
         return None
 
 
+async def _fetch_quotes(symbols: list[str]) -> dict[str, Decimal]:
+    """Fetch latest trade prices for many symbols in one multi-symbol request."""
+    url = f"{ALPACA_DATA_URL}/v2/stocks/trades/latest"
+    resp = await http_pool.request(
+        "GET",
+        url,
+        params={"symbols": ",".join(symbols)},
+        headers=_STATIC_HEADERS,
+        timeout=QUOTE_FETCH_TIMEOUT,
+        endpoint="latest_trades",
+    )
+    if not resp.is_success:
+        return {}
+    prices = {}
+    for symbol, trade in resp.json().get("trades", {}).items():
+        try:
+            prices[symbol] = Decimal(str(trade["p"]))
+        except Exception:
+            continue
+    return prices
+
+
+quote_cache = QuoteCache(
+    loader=lambda symbol: http_pool.submit(_fetch_quote(symbol)),
+    ttl=QUOTE_CACHE_TTL,
+    stale_ttl=QUOTE_CACHE_STALE_TTL,
+    max_size=QUOTE_CACHE_MAX_SIZE,
+    wait_timeout=QUOTE_FETCH_TIMEOUT,
+    batch_loader=lambda symbols: http_pool.submit(_fetch_quotes(symbols)),
+    batch_size=QUOTE_BATCH_SIZE,
+)
+
+
+def get_quote(symbol: str, allow_stale: bool = True) -> Decimal | None:
+    """
+    Get latest trade price for a symbol via the shared quote cache.
+    Pass allow_stale=False where a stale price would be wrong (e.g. sizing an order).
+    """
+    return quote_cache.get(symbol.upper(), allow_stale=allow_stale)
+
+
+def get_quotes(symbols: list[str], allow_stale: bool = True) -> dict[str, Decimal]:
+    """
+    Get latest trade prices for many symbols via the shared quote cache.
+    Cache misses are fetched in chunked multi-symbol requests (QUOTE_BATCH_SIZE each),
+    with the chunks running concurrently. Symbols that could not be priced are omitted.
+    """
+    return quote_cache.get_many([s.upper() for s in symbols], allow_stale=allow_stale)
+
+
+async def _fetch_bars_chunk(symbols: list[str], timeframe: str, start: date) -> dict[str, list[dict]]:
+    url = f"{ALPACA_DATA_URL}/v2/stocks/bars"
+    params = {
+        "symbols": ",".join(symbols),
+        "timeframe": timeframe,
+        "start": start.isoformat(),
+        "limit": 10000,
+        "adjustment": "raw",
+    }
+    bars: dict[str, list[dict]] = {}
+    while True:
+        resp = await http_pool.request("GET", url, params=params, headers=_STATIC_HEADERS, timeout=QUOTE_FETCH_TIMEOUT, endpoint="bars")
+        # Raise rather than return what we have: callers would take a 429/5xx as "no bars"
+        resp.raise_for_status()
+        data = resp.json()
+        for symbol, rows in (data.get("bars") or {}).items():
+            bars.setdefault(symbol, []).extend(rows)
+        token = data.get("next_page_token")
+        if not token:
+            break
+        params["page_token"] = token
+    return bars
+
+
+async def get_daily_bars_async(symbols: list[str], start: date) -> dict[str, list[dict]]:
+    """
+    Fetch daily bars since `start` for many symbols: one multi-symbol request per
+    QUOTE_BATCH_SIZE chunk (chunks run concurrently), following pagination.
+    """
+    symbols = [s.upper() for s in symbols]
+    chunks = [symbols[i:i + QUOTE_BATCH_SIZE] for i in range(0, len(symbols), QUOTE_BATCH_SIZE)]
+    bars: dict[str, list[dict]] = {}
+    for result in await asyncio.gather(*(_fetch_bars_chunk(chunk, "1Day", start) for chunk in chunks)):
+        bars.update(result)
+    return bars
+
+
+async def get_quote_async(symbol: str, allow_stale: bool = True) -> Decimal | None:
+    return await quote_cache.aget(symbol.upper(), allow_stale=allow_stale)
+
+
+async def get_quotes_async(symbols: list[str], allow_stale: bool = True) -> dict[str, Decimal]:
+    return await quote_cache.aget_many([s.upper() for s in symbols], allow_stale=allow_stale)
+
+
 # ---------------------------------------------------------------------------
 # Trading — requires a per-user Connect access token
 # ---------------------------------------------------------------------------
 
-def place_market_order(symbol: str, qty: float, side: str, access_token: str) -> dict | None:
+rate_budgets = RateBudgets(max_wait=ALPACA_BUDGET_MAX_WAIT)
+breakers = {
+    name: CircuitBreaker(name, ALPACA_BREAKER_FAILURES, ALPACA_BREAKER_COOLDOWN)
+    for name in ("orders", "account")
+}
+
+
+def trading_guard_stats() -> dict:
+    return {
+        "budgets": rate_budgets.stats(),
+        "breakers": {name: breaker.stats() for name, breaker in breakers.items()},
+    }
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: spread retries out instead of synchronizing them
+    return random.uniform(0, min(ALPACA_RETRY_MAX_DELAY, ALPACA_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def _trading_request(endpoint: str, method: str, url: str, access_token: str, **kwargs) -> httpx.Response:
+    """
+    One guarded trading call: spend from the token's rate budget, pass the
+    endpoint's breaker, and retry 429s, 5xx and transport errors with jittered
+    backoff. Only call this for requests that are safe to repeat.
+    Raises TradingUnavailable when shed, or the last transport error.
+    """
+    breaker = breakers[endpoint]
+    headers = _trading_headers(access_token)
+    for attempt in range(ALPACA_RETRY_ATTEMPTS):
+        await rate_budgets.acquire(access_token)
+        breaker.before()
+        try:
+            resp = await http_pool.request(method, url, headers=headers, endpoint=endpoint, **kwargs)
+        except httpx.TransportError as e:
+            breaker.failure()
+            if attempt + 1 == ALPACA_RETRY_ATTEMPTS:
+                raise
+            logger.warning(f"Alpaca {endpoint} transport error ({e!r}), retrying")
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        except Exception:
+            # Undecodable, pool loop gone: still an outcome, so a half-open probe can't stay pending
+            breaker.failure()
+            raise
+        except BaseException:
+            # Cancelled: says nothing about Alpaca, but a half-open probe must not stay pending
+            breaker.abandon()
+            raise
+
+        rate_budgets.update(access_token, resp.headers, resp.status_code)
+        if resp.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()  # 4xx (429 included) still means Alpaca is up
+        if (resp.status_code == 429 or resp.status_code >= 500) and attempt + 1 < ALPACA_RETRY_ATTEMPTS:
+            logger.warning(f"Alpaca {endpoint} returned {resp.status_code}, retrying")
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        return resp
+    return resp
+
+
+def _error_body(resp: httpx.Response) -> dict:
+    return resp.json() if "application/json" in resp.headers.get("content-type", "") else {}
+
+
+async def place_market_order_async(symbol: str, qty: Decimal, side: str, access_token: str) -> dict | None:
     """
     Place a market order on behalf of a connected user.
     Uses their OAuth access token so the order goes into their own Alpaca account.
+
+    Every order carries a client_order_id, which makes retries safe: if an
+    earlier attempt did reach Alpaca, the retry is refused as a duplicate and
+    the existing order is fetched instead. Returns None if the order failed;
+    raises TradingUnavailable if Alpaca is being shed.
     """
     url = f"{ALPACA_BASE_URL}/v2/orders"
+    client_order_id = uuid.uuid4().hex
     body = {
         "symbol": symbol.upper(),
-        "qty": qty,
+        "qty": str(qty),
         "side": side,
         "type": "market",
         "time_in_force": "day",
+        "client_order_id": client_order_id,
     }
 
-    resp = requests.post(url, json=body, headers=_trading_headers(access_token), timeout=10)
+    resp = await _trading_request("orders", "POST", url, access_token, json=body)
 
-    if not resp.ok:
-        error_data = resp.json() if "application/json" in resp.headers.get("content-type", "") else {}
+    if not resp.is_success:
+        error_data = _error_body(resp)
         error_code = error_data.get("code")
 
         if error_code == 40310000:
             raise ValueError("Order rejected: wash trade detected. Wait before trading the same stock again.")
+        if resp.status_code == 422 and "client_order_id" in str(error_data.get("message", "")):
+            return await _get_order_by_client_id(client_order_id, access_token)
         return None
 
     return resp.json()
 
 
-def cancel_all_orders(access_token: str) -> bool:
+async def _get_order_by_client_id(client_order_id: str, access_token: str) -> dict | None:
+    url = f"{ALPACA_BASE_URL}/v2/orders:by_client_order_id"
+    resp = await _trading_request("orders", "GET", url, access_token, params={"client_order_id": client_order_id})
+    return resp.json() if resp.is_success else None
+
+
+async def place_market_orders_async(
+    orders: list[tuple[str, Decimal, str]], access_token: str, concurrency: int
+) -> list[dict | None | Exception]:
+    """
+    Place several (symbol, qty, side) market orders concurrently, at most
+    `concurrency` in flight. Results line up with `orders`; a failed order
+    yields None or the exception it raised rather than failing the rest.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def place(symbol: str, qty: Decimal, side: str):
+        async with semaphore:
+            return await place_market_order_async(symbol, qty, side, access_token)
+
+    return await asyncio.gather(*(place(*order) for order in orders), return_exceptions=True)
+
+
+async def list_orders_async(access_token: str, after: datetime, symbols: list[str], limit: int = 500) -> list[dict] | None:
+    """
+    Orders (any status) submitted after `after` for the given symbols, oldest
+    first — how fills are tracked for many open orders in one call. Pages
+    forward on submitted_at until a short page. Returns None on failure.
+    """
+    url = f"{ALPACA_BASE_URL}/v2/orders"
+    orders: list[dict] = []
+    while True:
+        params = {
+            "status": "all",
+            "after": after.isoformat().replace("+00:00", "Z"),
+            "direction": "asc",
+            "limit": limit,
+            "symbols": ",".join(symbols),
+        }
+        resp = await _trading_request("orders", "GET", url, access_token, params=params)
+        if not resp.is_success:
+            return None
+        page = resp.json()
+        orders.extend(page)
+        if len(page) < limit:
+            return orders
+        after = datetime.fromisoformat(page[-1]["submitted_at"].replace("Z", "+00:00"))
+
+
+async def get_order_async(order_id: str, access_token: str) -> dict | None:
+    """
+    One order by id. None only when Alpaca says the order doesn't exist (404).
+    A refused token raises TradingAccessDenied — the order may well exist, just
+    not be visible to us — and any other failure raises TradingUnavailable, so
+    an outage isn't mistaken for a lost order.
+    """
+    url = f"{ALPACA_BASE_URL}/v2/orders/{order_id}"
+    resp = await _trading_request("orders", "GET", url, access_token)
+    if resp.is_success:
+        return resp.json()
+    if resp.status_code == 404:
+        return None
+    if resp.status_code in (401, 403):
+        raise TradingAccessDenied(f"Alpaca refused the token for order {order_id} ({resp.status_code})")
+    raise TradingUnavailable(f"Alpaca order lookup failed with {resp.status_code}")
+
+
+async def cancel_all_orders_async(access_token: str) -> bool:
     """Cancel all open orders for a connected user."""
     url = f"{ALPACA_BASE_URL}/v2/orders"
-    resp = requests.delete(url, headers=_trading_headers(access_token), timeout=10)
-    return resp.ok
+    resp = await _trading_request("orders", "DELETE", url, access_token)
+    return resp.is_success
 
 
-def get_alpaca_account(access_token: str) -> dict | None:
+async def get_alpaca_account_async(access_token: str) -> dict | None:
     """Fetch the Alpaca account details for a connected user (useful for health checks)."""
     url = f"{ALPACA_BASE_URL}/v2/account"
-    resp = requests.get(url, headers=_trading_headers(access_token), timeout=10)
-    if not resp.ok:
+    resp = await _trading_request("account", "GET", url, access_token)
+    if not resp.is_success:
         return None
-    return resp.json()
\ No newline at end of file
+    return resp.json()
+
+
+async def get_positions_async(access_token: str) -> list[dict] | None:
+    """All open positions in a connected user's Alpaca account, or None on failure."""
+    url = f"{ALPACA_BASE_URL}/v2/positions"
+    resp = await _trading_request("account", "GET", url, access_token)
+    if not resp.is_success:
+        return None
+    return resp.json()
+
+
+def place_market_order(symbol: str, qty: Decimal, side: str, access_token: str) -> dict | None:
+    return http_pool.run(place_market_order_async(symbol, qty, side, access_token))
+
+
+def place_market_orders(orders: list[tuple[str, Decimal, str]], access_token: str, concurrency: int) -> list:
+    return http_pool.run(place_market_orders_async(orders, access_token, concurrency))
+
+
+def cancel_all_orders(access_token: str) -> bool:
+    return http_pool.run(cancel_all_orders_async(access_token))
+
+
+def get_alpaca_account(access_token: str) -> dict | None:
+    return http_pool.run(get_alpaca_account_async(access_token))
+
+
+# ---------------------------------------------------------------------------
+# Alpaca Connect OAuth
+# ---------------------------------------------------------------------------
+
+def exchange_authorization_code(code: str) -> dict | None:
+    """Exchange an OAuth authorization code for a Connect token response, or None on failure."""
+    resp = http_pool.request_sync(
+        "POST",
+        ALPACA_TOKEN_URL,
+        data={
+            "grant_type": "authorization_code",
+            "code": code,
+            "client_id": ALPACA_CLIENT_ID,
+            "client_secret": ALPACA_CLIENT_SECRET,
+            "redirect_uri": ALPACA_REDIRECT_URI,
+        },
+        timeout=15,
+        endpoint="oauth_token",
+    )
+    if not resp.is_success:
+        return None
+    return resp.json()
@@ -1,16 +1,31 @@
 # auth_utils.py - Authentication utilities for Clau Trading Backend, including password hashing and JWT handling.
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
-from config import JWT_SECRET_KEY
+from config import (
+    JWT_SECRET_KEY,
+    JWT_CACHE_MAX_SIZE,
+    PASSWORD_HASH_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_PENDING,
+)
 
-# Password hashing - using pbkdf2_sha256 as fallback if bcrypt issues persist
+# Password hashing - using pbkdf2_sha256 as fallback if bcrypt issues persist.
+# Hashes that don't match the current scheme/rounds are flagged by needs_update
+# and replaced on the user's next successful login.
 pwd_context = CryptContext(
     schemes=["pbkdf2_sha256", "bcrypt"],
     deprecated="auto",
-    pbkdf2_sha256__rounds=30000
+    pbkdf2_sha256__rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS,
 )
 
 ALGORITHM = "HS256"
@@ -25,6 +40,56 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password[:72], hashed)
 
+def verify_and_update_password(password: str, hashed: str) -> tuple[bool, str | None]:
+    """(matches, replacement hash if the stored one uses outdated parameters)."""
+    return pwd_context.verify_and_update(password[:72], hashed)
+
+
+class PasswordHashPool:
+    """
+    Runs password hashing in a small process pool, off the event loop, the
+    threadpool and the GIL. At most `max_pending` hashes may be running or
+    queued; beyond that callers get an immediate 503 instead of waiting in an
+    ever-longer line. Only touched from the event loop.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many sign-ins in progress, please retry", headers={"Retry-After": "1"})
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "rejected": self.rejected}
+
+
+password_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(hash_password, password)
+
+async def verify_password_async(password: str, hashed: str) -> tuple[bool, str | None]:
+    return await password_pool.run(verify_and_update_password, password, hashed)
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=TOKEN_EXPIRE_MINUTES)
@@ -37,17 +102,81 @@ def create_refresh_token(data: dict) -> str:
     to_encode.update({"exp": expire, "type": "refresh"})
     return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+class VerifiedTokenCache:
+    """
+    LRU of access tokens that already passed full verification, keyed by their
+    SHA-256 digest (the raw token is never kept) and holding (user_id, exp).
+    An entry stops matching the instant its exp passes, exactly when jwt.decode
+    would start rejecting the token; only successes are cached, so a bad token
+    always takes the full decode path. Locked: besides the event loop, slowapi
+    reaches it from threadpool threads when keying sync routes by user.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> int | None:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user_id, exp = entry
+                if time.time() < exp:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user_id
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, user_id: int, exp: float):
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user_id, exp)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = VerifiedTokenCache(JWT_CACHE_MAX_SIZE)
+
+
+def verify_access_token(token: str) -> int:
+    """User id of a valid access token, from token_cache once verified. Raises ValueError."""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
-        if payload.get("type") != "access":
-            raise HTTPException(status_code=401, detail="Invalid token type")
-        user_id = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise ValueError("Invalid token")
+    if payload.get("type") != "access":
+        raise ValueError("Invalid token type")
+    user_id = payload.get("user_id")
+    if user_id is None:
+        raise ValueError("Invalid token")
+    if payload.get("exp") is not None:
+        token_cache.put(token, user_id, float(payload["exp"]))
+    return user_id
+
+
+# async so it runs on the event loop: async routes then never touch the threadpool
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    try:
+        return verify_access_token(token)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
 
 def get_user_id_from_refresh_token(token: str) -> int:
     try:
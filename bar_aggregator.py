@@ -0,0 +1,125 @@
+# bar_aggregator.py - In-process OHLCV bar aggregation for Clau Trading Backend: rolls price ticks into 1s/1m/5m bars held in fixed-size ring buffers.
+from array import array
+from collections import OrderedDict
+
+from config import BAR_HISTORY_1S, BAR_HISTORY_1M, BAR_HISTORY_5M, BAR_MAX_SYMBOLS
+
+# timeframe -> (bucket seconds, bars kept)
+TIMEFRAMES = {
+    "1s": (1, BAR_HISTORY_1S),
+    "1m": (60, BAR_HISTORY_1M),
+    "5m": (300, BAR_HISTORY_5M),
+}
+
+_FIELDS = 6  # start, open, high, low, close, volume
+
+
+class BarRing:
+    """
+    The last `capacity` bars of one timeframe, stored column-wise in flat float
+    arrays allocated once (48 bytes per slot). The newest slot is the bar still
+    being built; older ones are complete. Ticks older than the current bar are
+    ignored rather than rewriting history.
+    """
+
+    __slots__ = ("seconds", "capacity", "_t", "_o", "_h", "_l", "_c", "_v", "_head", "_count")
+
+    def __init__(self, seconds: int, capacity: int):
+        self.seconds = seconds
+        self.capacity = capacity
+        self._t = array("d", bytes(8 * capacity))
+        self._o = array("d", bytes(8 * capacity))
+        self._h = array("d", bytes(8 * capacity))
+        self._l = array("d", bytes(8 * capacity))
+        self._c = array("d", bytes(8 * capacity))
+        self._v = array("d", bytes(8 * capacity))
+        self._head = -1
+        self._count = 0
+
+    def add(self, ts: float, price: float, size: float) -> dict | None:
+        """Fold one tick in. Returns the bar it closed, if the tick opened a new bucket."""
+        start = float(int(ts // self.seconds) * self.seconds)
+        head = self._head
+        if self._count:
+            current = self._t[head]
+            if start == current:
+                if price > self._h[head]:
+                    self._h[head] = price
+                if price < self._l[head]:
+                    self._l[head] = price
+                self._c[head] = price
+                self._v[head] += size
+                return None
+            if start < current:
+                return None
+
+        closed = self._bar(head) if self._count else None
+        head = self._head = (head + 1) % self.capacity
+        self._t[head] = start
+        self._o[head] = self._h[head] = self._l[head] = self._c[head] = price
+        self._v[head] = size
+        self._count = min(self._count + 1, self.capacity)
+        return closed
+
+    def _bar(self, i: int) -> dict:
+        return {"t": self._t[i], "o": self._o[i], "h": self._h[i], "l": self._l[i], "c": self._c[i], "v": self._v[i]}
+
+    def bars(self, limit: int | None = None) -> list[dict]:
+        """Oldest first, ending with the bar in progress."""
+        n = self._count if limit is None else min(limit, self._count)
+        return [self._bar((self._head - k) % self.capacity) for k in range(n - 1, -1, -1)]
+
+
+class BarAggregator:
+    """
+    Per-symbol BarRings for every timeframe. Memory per symbol is fixed by the
+    ring capacities (see bytes_per_symbol); the number of symbols is capped at
+    `max_symbols`, evicting the one that has gone longest without a tick.
+    Runs on the event loop only, so no locking.
+    """
+
+    def __init__(self, timeframes: dict[str, tuple[int, int]], max_symbols: int):
+        self.timeframes = timeframes
+        self.max_symbols = max_symbols
+        self.evicted = 0
+        self._series: "OrderedDict[str, dict[str, BarRing]]" = OrderedDict()
+
+    @property
+    def bytes_per_symbol(self) -> int:
+        return sum(capacity for _, capacity in self.timeframes.values()) * _FIELDS * 8
+
+    def add_tick(self, symbol: str, price: float, size: float, ts: float) -> list[tuple[str, dict]]:
+        """Record a tick; returns (timeframe, bar) for each bar it completed."""
+        series = self._series.get(symbol)
+        if series is None:
+            series = {tf: BarRing(seconds, capacity) for tf, (seconds, capacity) in self.timeframes.items()}
+            self._series[symbol] = series
+            if len(self._series) > self.max_symbols:
+                self._series.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._series.move_to_end(symbol)
+
+        closed = []
+        for timeframe, ring in series.items():
+            bar = ring.add(ts, price, size)
+            if bar is not None:
+                closed.append((timeframe, bar))
+        return closed
+
+    def bars(self, symbol: str, timeframe: str, limit: int | None = None) -> list[dict] | None:
+        """Bars for a symbol, or None if no ticks have been seen for it."""
+        series = self._series.get(symbol)
+        if series is None:
+            return None
+        return series[timeframe].bars(limit)
+
+    def stats(self) -> dict:
+        return {
+            "symbols": len(self._series),
+            "evicted": self.evicted,
+            "bytes_per_symbol": self.bytes_per_symbol,
+        }
+
+
+bar_aggregator = BarAggregator(TIMEFRAMES, max_symbols=BAR_MAX_SYMBOLS)
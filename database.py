@@ -1,10 +1,30 @@
 # database.py - Database configuration and session management for Clau Trading Backend.
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from config import DATABASE_URL, ASYNC_DATABASE_URL
+import metrics
+
+
+def _timed_pool(base, name: str):
+    """`base` pool class whose checkouts are timed — the wait for a free connection included."""
+    class TimedPool(base):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                metrics.db_checkout.observe(time.perf_counter() - start, name)
+
+    return TimedPool
+
 
 engine = create_engine(
     DATABASE_URL,
+    poolclass=_timed_pool(QueuePool, "sync"),
     echo=False,
     pool_size=20,
     max_overflow=10,
@@ -14,12 +34,57 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_url(url: str) -> str:
+    """Swap the sync driver in DATABASE_URL for its asyncio counterpart."""
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+# Async engine for hot read endpoints — runs on the event loop, so these routes
+# aren't capped by the size of Starlette's threadpool. Its own pool, same sizing.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL or _async_url(DATABASE_URL),
+    poolclass=_timed_pool(AsyncAdaptedQueuePool, "async"),
+    echo=False,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 
+def _pool_state() -> dict:
+    state = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        state[(name, "in_use")] = pool.checkedout()
+        state[(name, "idle")] = pool.checkedin()
+        state[(name, "overflow")] = max(pool.overflow(), 0)  # negative until the base size is in use
+        state[(name, "size")] = pool.size()
+    return state
+
+
+metrics.registry.gauge("clau_db_pool_connections", "Pooled DB connections by state", _pool_state, ("pool", "state"))
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,348 @@
+# fake_alpaca.py - Local stand-ins for Alpaca APIs so Clau Trading Backend can be run and tested offline.
+#
+# Market data stream (point ALPACA_STREAM_URL at it):
+#   python fake_alpaca.py stream --port 8765 --rate 5 --drop-every 60
+# Market data REST — latest trades and daily bars (point ALPACA_DATA_URL at it):
+#   python fake_alpaca.py data --port 8766
+# Trading REST — orders that fill after a delay, positions, account (point ALPACA_BASE_URL at it):
+#   python fake_alpaca.py trading --port 8767 --fill-delay 0.5
+# The REST stand-ins take --latency-ms and --error-rate to model a slow or flaky upstream.
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time as clock
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import uvicorn
+import websockets
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+def _now_rfc3339() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def add_fault_injection(app: FastAPI, latency_ms: float = 0.0, error_rate: float = 0.0, error_body: dict | None = None):
+    """
+    Delay every response by about `latency_ms` (+/-20% jitter) and fail a
+    `error_rate` fraction of requests with a 503, as a congested upstream would.
+    """
+    if not latency_ms and not error_rate:
+        return
+
+    @app.middleware("http")
+    async def inject(request: Request, call_next):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000 * random.uniform(0.8, 1.2))
+        if error_rate and random.random() < error_rate:
+            return JSONResponse(error_body or {"message": "service unavailable"}, status_code=503)
+        return await call_next(request)
+
+
+class _RandomWalk:
+    """Deterministic-per-symbol random walk used to synthesize prices."""
+
+    def __init__(self, seed: int = 0):
+        self._seed = seed
+        self._prices: dict[str, float] = {}
+
+    def base(self, symbol: str) -> float:
+        return round(random.Random(f"{self._seed}:{symbol}").uniform(10, 500), 2)
+
+    def price(self, symbol: str) -> float:
+        if symbol not in self._prices:
+            self._prices[symbol] = self.base(symbol)
+        return self._prices[symbol]
+
+    def step(self, symbol: str) -> float:
+        price = self.price(symbol) * (1 + random.gauss(0, 0.0005))
+        self._prices[symbol] = round(max(price, 0.01), 2)
+        return self._prices[symbol]
+
+
+# ---------------------------------------------------------------------------
+# Market data REST
+# ---------------------------------------------------------------------------
+
+_MARKET_TZ = ZoneInfo("America/New_York")
+
+
+def _daily_bar(walk: _RandomWalk, symbol: str, day: date) -> dict:
+    """Bars are a pure function of (symbol, day), so any start date gives the same history."""
+    def close_on(d: date) -> float:
+        rng = random.Random(f"{walk._seed}:{symbol}:{d.isoformat()}")
+        return walk.base(symbol) * (1 + rng.uniform(-0.05, 0.05))
+
+    rng = random.Random(f"{walk._seed}:{symbol}:{day.isoformat()}:range")
+    o = close_on(day - timedelta(days=1)) * (1 + rng.gauss(0, 0.003))
+    c = close_on(day)
+    h = max(o, c) * (1 + rng.uniform(0, 0.01))
+    l = min(o, c) * (1 - rng.uniform(0, 0.01))
+    midnight = datetime.combine(day, time(0), _MARKET_TZ).astimezone(timezone.utc)
+    return {
+        "t": midnight.isoformat().replace("+00:00", "Z"),
+        "o": round(o, 2), "h": round(h, 2), "l": round(l, 2), "c": round(c, 2),
+        "v": rng.randint(100_000, 5_000_000), "n": rng.randint(1_000, 50_000), "vw": round((h + l + c) / 3, 2),
+    }
+
+
+def create_data_app(walk: _RandomWalk) -> FastAPI:
+    """REST stand-in for data.alpaca.markets: latest trades and 1Day bars on weekdays."""
+    app = FastAPI(title="Fake Alpaca Data")
+
+    def trade(symbol: str) -> dict:
+        return {"t": _now_rfc3339(), "x": "V", "p": walk.step(symbol), "s": random.randint(1, 500), "c": ["@"], "i": random.randint(1, 10**9), "z": "C"}
+
+    @app.get("/v2/stocks/trades/latest")
+    def latest_trades(symbols: str):
+        return {"trades": {s: trade(s) for s in symbols.split(",") if s}}
+
+    @app.get("/v2/stocks/{symbol}/trades/latest")
+    def latest_trade(symbol: str):
+        return {"symbol": symbol, "trade": trade(symbol)}
+
+    @app.get("/v2/stocks/bars")
+    def bars(symbols: str, start: str, timeframe: str = "1Day", limit: int = 1000, page_token: str | None = None):
+        first = date.fromisoformat(start[:10])
+        today = datetime.now(_MARKET_TZ).date()
+        days = [first + timedelta(days=i) for i in range((today - first).days + 1)]
+        rows = [
+            (symbol, _daily_bar(walk, symbol, day))
+            for symbol in symbols.split(",") if symbol
+            for day in days if day.weekday() < 5
+        ]
+        offset = int(page_token or 0)
+        page = rows[offset:offset + limit]
+        out: dict[str, list[dict]] = {}
+        for symbol, bar in page:
+            out.setdefault(symbol, []).append(bar)
+        next_token = str(offset + limit) if offset + limit < len(rows) else None
+        return {"bars": out, "next_page_token": next_token}
+
+    return app
+
+
+# ---------------------------------------------------------------------------
+# Trading REST
+# ---------------------------------------------------------------------------
+
+def create_trading_app(walk: _RandomWalk, fill_delay: float = 0.5) -> FastAPI:
+    """
+    REST stand-in for the trading API: market orders are accepted at once and
+    fill in full at the walk's price `fill_delay` seconds later (decided
+    lazily, whenever the order is next read). Any bearer token is accepted,
+    and each token is its own account: orders and positions are per token.
+    """
+    app = FastAPI(title="Fake Alpaca Trading")
+    orders: dict[str, dict] = {}
+    by_client_id: dict[str, str] = {}
+    by_account: dict[str, list[dict]] = {}  # so listings stay cheap as orders pile up under load
+
+    def account_of(request: Request) -> str:
+        return request.headers.get("authorization", "")
+
+    def advance(order: dict) -> dict:
+        if order["status"] == "accepted" and clock.time() - order["_submitted"] >= fill_delay:
+            order.update(
+                status="filled", filled_qty=order["qty"], filled_avg_price=str(walk.step(order["symbol"])),
+                filled_at=_now_rfc3339(), updated_at=_now_rfc3339(),
+            )
+        return {k: v for k, v in order.items() if not k.startswith("_")}
+
+    @app.post("/v2/orders")
+    async def submit(request: Request):
+        body = await request.json()
+        client_order_id = body.get("client_order_id") or uuid.uuid4().hex
+        if client_order_id in by_client_id:
+            return JSONResponse({"code": 40010001, "message": "client_order_id must be unique"}, status_code=422)
+        now = _now_rfc3339()
+        order = {
+            "_account": account_of(request),
+            "id": str(uuid.uuid4()), "client_order_id": client_order_id,
+            "symbol": body["symbol"], "side": body["side"], "qty": body["qty"],
+            "type": body.get("type", "market"), "time_in_force": body.get("time_in_force", "day"),
+            "status": "accepted", "filled_qty": "0", "filled_avg_price": None,
+            "created_at": now, "submitted_at": now, "updated_at": now, "filled_at": None,
+            "_submitted": clock.time(),
+        }
+        orders[order["id"]] = order
+        by_client_id[client_order_id] = order["id"]
+        by_account.setdefault(order["_account"], []).append(order)
+        return advance(order)
+
+    @app.get("/v2/orders")
+    def list_orders(request: Request, status: str = "open", after: str | None = None, symbols: str | None = None,
+                    direction: str = "desc", limit: int = 50):
+        wanted = set(symbols.split(",")) if symbols else None
+        rows = [advance(o) for o in by_account.get(account_of(request), [])]
+        rows = [
+            o for o in rows
+            if (wanted is None or o["symbol"] in wanted)
+            and (after is None or o["submitted_at"] > after)
+            and (status == "all" or (o["status"] == "accepted") == (status == "open"))
+        ]
+        rows.sort(key=lambda o: o["submitted_at"], reverse=direction == "desc")
+        return rows[:limit]
+
+    @app.get("/v2/orders:by_client_order_id")
+    def order_by_client_id(client_order_id: str):
+        order_id = by_client_id.get(client_order_id)
+        if order_id is None:
+            return JSONResponse({"message": "order not found"}, status_code=404)
+        return advance(orders[order_id])
+
+    @app.get("/v2/orders/{order_id}")
+    def get_order(order_id: str):
+        if order_id not in orders:
+            return JSONResponse({"message": "order not found"}, status_code=404)
+        return advance(orders[order_id])
+
+    @app.delete("/v2/orders")
+    def cancel_all(request: Request):
+        canceled = []
+        for order in by_account.get(account_of(request), []):
+            if advance(order)["status"] == "accepted":
+                order.update(status="canceled", canceled_at=_now_rfc3339())
+                canceled.append({"id": order["id"], "status": 200})
+        return JSONResponse(canceled, status_code=207)
+
+    @app.get("/v2/positions")
+    def positions(request: Request):
+        held: dict[str, list[float]] = {}  # symbol -> [qty, cost]
+        for order in by_account.get(account_of(request), []):
+            if advance(order)["status"] != "filled":
+                continue
+            qty, price = float(order["filled_qty"]), float(order["filled_avg_price"])
+            position = held.setdefault(order["symbol"], [0.0, 0.0])
+            if order["side"] == "buy":
+                position[0] += qty
+                position[1] += qty * price
+            elif position[0] > 0:
+                position[1] *= max(position[0] - qty, 0) / position[0]
+                position[0] -= qty
+        return [
+            {"symbol": symbol, "qty": str(round(qty, 9)), "avg_entry_price": str(round(cost / qty, 4)),
+             "side": "long", "asset_class": "us_equity", "market_value": str(round(qty * walk.price(symbol), 2))}
+            for symbol, (qty, cost) in held.items() if qty > 1e-9
+        ]
+
+    @app.get("/v2/account")
+    def account():
+        return {"id": "fake-account", "status": "ACTIVE", "currency": "USD", "buying_power": "1000000", "cash": "1000000"}
+
+    return app
+
+
+# ---------------------------------------------------------------------------
+# Market data stream
+# ---------------------------------------------------------------------------
+
+class FakeMarketStream:
+    """
+    Speaks the subset of Alpaca's data stream protocol the backend uses:
+    connected greeting, auth, subscribe/unsubscribe to trades, and "t" messages.
+    Each subscribed symbol gets `rate` trades per second. With drop_every set,
+    every connection is closed after that many seconds to exercise reconnects.
+    """
+
+    def __init__(self, rate: float = 5.0, drop_every: float | None = None, seed: int = 0):
+        self.rate = rate
+        self.drop_every = drop_every
+        self.walk = _RandomWalk(seed)
+        self.connections = 0
+
+    async def handler(self, ws, path=None):
+        self.connections += 1
+        subscribed: set[str] = set()
+        await ws.send(json.dumps([{"T": "success", "msg": "connected"}]))
+
+        auth = json.loads(await ws.recv())
+        if auth.get("action") != "auth":
+            await ws.send(json.dumps([{"T": "error", "code": 401, "msg": "not authenticated"}]))
+            return
+        await ws.send(json.dumps([{"T": "success", "msg": "authenticated"}]))
+
+        async def emit():
+            while True:
+                await asyncio.sleep(1 / self.rate)
+                if subscribed:
+                    await ws.send(json.dumps([
+                        {"T": "t", "S": s, "p": self.walk.step(s), "s": random.randint(1, 500), "t": _now_rfc3339()}
+                        for s in sorted(subscribed)
+                    ]))
+
+        async def drop():
+            await asyncio.sleep(self.drop_every)
+            await ws.close()
+
+        emitter = asyncio.create_task(emit())
+        dropper = asyncio.create_task(drop()) if self.drop_every else None
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                trades = set(msg.get("trades", []))
+                if msg.get("action") == "subscribe":
+                    subscribed |= trades
+                elif msg.get("action") == "unsubscribe":
+                    subscribed -= trades
+                await ws.send(json.dumps([{"T": "subscription", "trades": sorted(subscribed), "quotes": [], "bars": []}]))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            emitter.cancel()
+            if dropper:
+                dropper.cancel()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765):
+        async with websockets.serve(self.handler, host, port):
+            logger.info(f"Fake Alpaca market stream on ws://{host}:{port}")
+            await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Alpaca stand-ins")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    stream = sub.add_parser("stream", help="fake market data stream")
+    stream.add_argument("--host", default="127.0.0.1")
+    stream.add_argument("--port", type=int, default=8765)
+    stream.add_argument("--rate", type=float, default=5.0, help="trades per second per symbol")
+    stream.add_argument("--drop-every", type=float, default=None, help="close connections after N seconds")
+
+    data = sub.add_parser("data", help="fake market data REST API")
+    data.add_argument("--host", default="127.0.0.1")
+    data.add_argument("--port", type=int, default=8766)
+    data.add_argument("--latency-ms", type=float, default=0.0)
+    data.add_argument("--error-rate", type=float, default=0.0)
+
+    trading = sub.add_parser("trading", help="fake trading REST API")
+    trading.add_argument("--host", default="127.0.0.1")
+    trading.add_argument("--port", type=int, default=8767)
+    trading.add_argument("--fill-delay", type=float, default=0.5, help="seconds before an order fills")
+    trading.add_argument("--latency-ms", type=float, default=0.0)
+    trading.add_argument("--error-rate", type=float, default=0.0)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "stream":
+        asyncio.run(FakeMarketStream(args.rate, args.drop_every).serve(args.host, args.port))
+    elif args.command == "data":
+        app = create_data_app(_RandomWalk())
+        add_fault_injection(app, args.latency_ms, args.error_rate)
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    elif args.command == "trading":
+        app = create_trading_app(_RandomWalk(), args.fill_delay)
+        add_fault_injection(app, args.latency_ms, args.error_rate)
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
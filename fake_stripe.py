@@ -0,0 +1,127 @@
+# fake_stripe.py - Local stand-in for the Stripe API so Clau Trading Backend's payment flows can run offline.
+#
+# Covers what stripe_service calls: payment intents (create, confirm), connected
+# accounts and bank tokens, payouts and refunds. Point STRIPE_API_BASE at it:
+#   python fake_stripe.py --port 8768 --latency-ms 150 --error-rate 0.01
+# Intents are kept in memory; any payment method confirms successfully.
+import argparse
+import time
+import uuid
+from urllib.parse import parse_qsl
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from fake_alpaca import add_fault_injection
+
+
+def _id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def create_stripe_app() -> FastAPI:
+    app = FastAPI(title="fake stripe")
+    intents: dict[str, dict] = {}
+
+    async def form(request: Request) -> dict:
+        # The SDK sends form-encoded bodies; nested keys ("metadata[x]") are left flat.
+        # Parsed by hand: Starlette's request.form() needs python-multipart.
+        return dict(parse_qsl((await request.body()).decode()))
+
+    def not_found(kind: str, id: str) -> JSONResponse:
+        return JSONResponse(
+            {"error": {"type": "invalid_request_error", "code": "resource_missing", "message": f"No such {kind}: '{id}'"}},
+            status_code=404,
+        )
+
+    @app.post("/v1/payment_intents")
+    async def create_intent(request: Request):
+        body = await form(request)
+        intent_id = _id("pi")
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(body.get("amount", 0)),
+            "currency": body.get("currency", "usd"),
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:16]}",
+            "status": "requires_payment_method",
+            "created": int(time.time()),
+        }
+        intents[intent_id] = intent
+        return intent
+
+    @app.get("/v1/payment_intents/{intent_id}")
+    def get_intent(intent_id: str):
+        return intents.get(intent_id) or not_found("payment_intent", intent_id)
+
+    @app.post("/v1/payment_intents/{intent_id}/confirm")
+    async def confirm_intent(intent_id: str, request: Request):
+        body = await form(request)
+        intent = intents.get(intent_id)
+        if intent is None:
+            return not_found("payment_intent", intent_id)
+        if intent["status"] == "succeeded":
+            return JSONResponse(
+                {"error": {"type": "invalid_request_error", "code": "payment_intent_unexpected_state",
+                           "message": "This PaymentIntent has already succeeded."}},
+                status_code=400,
+            )
+        intent.update(status="succeeded", payment_method=body.get("payment_method"))
+        return intent
+
+    @app.post("/v1/accounts")
+    async def create_account(request: Request):
+        body = await form(request)
+        return {"id": _id("acct"), "object": "account", "type": body.get("type", "express"), "email": body.get("email")}
+
+    @app.post("/v1/accounts/{account_id}/external_accounts")
+    def create_external_account(account_id: str):
+        return {"id": _id("ba"), "object": "bank_account", "account": account_id, "status": "new"}
+
+    @app.post("/v1/tokens")
+    def create_token():
+        return {"id": _id("btok"), "object": "token", "type": "bank_account"}
+
+    @app.post("/v1/payouts")
+    async def create_payout(request: Request):
+        body = await form(request)
+        return {
+            "id": _id("po"),
+            "object": "payout",
+            "amount": int(body.get("amount", 0)),
+            "currency": body.get("currency", "usd"),
+            "status": "pending",
+            "arrival_date": int(time.time()) + 2 * 86400,
+        }
+
+    @app.post("/v1/refunds")
+    async def create_refund(request: Request):
+        body = await form(request)
+        intent = intents.get(body.get("payment_intent", ""))
+        if intent is None:
+            return not_found("payment_intent", body.get("payment_intent", ""))
+        amount = int(body.get("amount", intent["amount"]))
+        return {"id": _id("re"), "object": "refund", "amount": amount, "payment_intent": intent["id"], "status": "succeeded"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Stripe stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_stripe_app()
+    add_fault_injection(
+        app, args.latency_ms, args.error_rate,
+        error_body={"error": {"type": "api_error", "message": "Stripe is temporarily unavailable"}},
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# fill_tracker.py - Background fill tracking for Clau Trading Backend: polls Alpaca for the orders behind unsettled trades and settles them as they fill.
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+
+from sqlalchemy import or_, select, tuple_
+
+from alpaca_client import get_order_async, list_orders_async
+from config import (
+    FILL_POLL_INTERVAL, FILL_TRACKER_BATCH, FILL_TRACKER_CONCURRENCY, FILL_TRACKER_LOCK,
+    FILL_TRACKER_MAX_ATTEMPTS, FILL_TRACKER_MAX_BACKOFF,
+)
+from database import AsyncSessionLocal
+from models import Trade
+from price_feed import _try_acquire_leadership
+from tradin_service import TERMINAL_ORDER_STATUSES, alpaca_tokens, defer_trade, hold_trade, settle_trade, void_trade
+from trading_guard import TradingAccessDenied, TradingUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class FillTracker:
+    """
+    Each pass reads up to `batch` unsettled trades and polls Alpaca for their
+    orders: one batched order listing per user (their open trades' symbols,
+    since their oldest open trade), with a per-order lookup for any order the
+    listing didn't return. Users are polled `concurrency` at a time, each in its
+    own session, so one slow account doesn't hold up the rest.
+
+    Passes walk the unsettled trades in (user_id, id) order, each resuming
+    after the last trade the previous pass read, so a backlog of orders that
+    stay open (placed overnight, say) can't starve everyone behind it. A trade
+    whose order Alpaca says doesn't exist is retried with exponential backoff,
+    and after `max_attempts` voided with its reservation released. One whose
+    order we can't see at all — the user's token is gone or refused — may still
+    fill, so it is held for manual reconciliation instead: nothing is released.
+
+    Alpaca's trade_updates stream would push fills instead, but it is per
+    account — one connection per connected user — so polling is what scales here.
+    """
+
+    def __init__(self, interval: float, concurrency: int, batch: int, max_attempts: int, max_backoff: float):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._after: tuple[int, int] | None = None  # (user_id, id) where the next pass resumes
+        self.passes = 0
+        self.open = 0
+        self.settled = 0
+        self.deferred = 0
+        self.voided = 0
+        self.held = 0
+        self.errors = 0
+
+    async def _open_trades(self) -> list[Trade]:
+        query = select(Trade).where(
+            Trade.settled.is_(False),
+            Trade.order_id.is_not(None),
+            Trade.needs_review.is_(False),
+            or_(Trade.next_check_at.is_(None), Trade.next_check_at <= datetime.now(timezone.utc)),
+        )
+        if self._after is not None:
+            query = query.where(tuple_(Trade.user_id, Trade.id) > tuple_(*self._after))
+        async with AsyncSessionLocal() as db:
+            trades = (await db.scalars(query.order_by(Trade.user_id, Trade.id).limit(self.batch))).all()
+            # Detached, so a rollback in one user's settlement can't expire the rest
+            db.expunge_all()
+        # A short page reached the end; the next pass starts over
+        self._after = (trades[-1].user_id, trades[-1].id) if len(trades) == self.batch else None
+        return trades
+
+    async def _hold(self, db, trade: Trade, reason: str):
+        if await hold_trade(db, trade, reason):
+            self.held += 1
+
+    async def _unresolved(self, db, trade: Trade):
+        """Alpaca has no such order."""
+        if trade.filled_qty:
+            # It did reach Alpaca and partly fill, so voiding would hand back cash that was spent
+            await self._hold(db, trade, "Alpaca no longer returns a partly filled order")
+        elif trade.check_attempts + 1 >= self.max_attempts:
+            if await void_trade(db, trade):
+                self.voided += 1
+        else:
+            await defer_trade(db, trade, min(self.max_backoff, self.interval * 2 ** trade.check_attempts))
+            self.deferred += 1
+
+    async def _track_user(self, user_id: int, trades: list[Trade], semaphore: asyncio.Semaphore):
+        async with semaphore, AsyncSessionLocal() as db:
+            access_token = await alpaca_tokens.aget(db, user_id)
+            if access_token is None:
+                # Token gone with orders open: they may still fill, we just can't see them
+                for trade in trades:
+                    await self._hold(db, trade, "the user's Alpaca token is gone")
+                return
+            oldest = min(t.created_at for t in trades)
+            if oldest.tzinfo is None:
+                oldest = oldest.replace(tzinfo=timezone.utc)
+            listed = await list_orders_async(
+                access_token, after=oldest - timedelta(minutes=1), symbols=sorted({t.symbol for t in trades})
+            )
+            orders = {o["id"]: o for o in listed or []}
+            for i, trade in enumerate(trades):
+                try:
+                    order = orders.get(trade.order_id) or await get_order_async(trade.order_id, access_token)
+                except TradingAccessDenied as e:
+                    for held in trades[i:]:
+                        await self._hold(db, held, str(e))
+                    return
+                if order is None:
+                    await self._unresolved(db, trade)
+                    continue
+                if await settle_trade(db, trade, order) and order.get("status") in TERMINAL_ORDER_STATUSES:
+                    self.settled += 1
+
+    async def poll_once(self):
+        trades = await self._open_trades()
+        self.open = len(trades)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._track_user(user_id, list(group), semaphore) for user_id, group in groupby(trades, key=lambda t: t.user_id)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.errors += 1
+                if not isinstance(result, TradingUnavailable):
+                    logger.error(f"Fill tracking failed for a user: {result!r}")
+        self.passes += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Fill tracking pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes, "open": self.open, "settled": self.settled,
+            "deferred": self.deferred, "voided": self.voided, "held": self.held, "errors": self.errors,
+        }
+
+
+fill_tracker = FillTracker(
+    FILL_POLL_INTERVAL, FILL_TRACKER_CONCURRENCY, FILL_TRACKER_BATCH, FILL_TRACKER_MAX_ATTEMPTS, FILL_TRACKER_MAX_BACKOFF
+)
+
+
+async def run_fill_tracker():
+    """
+    Entry point started by main. Workers race for a host-wide lock and only the
+    holder polls; the rest retry in case it goes away. Across hosts, settlement's
+    version check keeps a fill from being applied twice.
+    """
+    while True:
+        lock_fd = _try_acquire_leadership(FILL_TRACKER_LOCK)
+        if lock_fd is not None:
+            try:
+                await fill_tracker.run()
+            finally:
+                os.close(lock_fd)
+        await asyncio.sleep(5)
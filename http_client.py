@@ -0,0 +1,146 @@
+# http_client.py - Shared connection-pooled HTTP client for Clau Trading Backend's upstream calls, usable from both async and sync code.
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Coroutine
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+from config import (
+    HTTP2_ENABLED,
+    HTTP_MAX_CONNECTIONS_PER_HOST,
+    HTTP_MAX_KEEPALIVE_PER_HOST,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPPool:
+    """
+    One keep-alive httpx.AsyncClient per upstream host, all owned by a dedicated
+    event loop thread.
+
+    Async code (the websocket updater) awaits `request`; sync code (FastAPI
+    threadpool routes, the quote cache loader) calls `request_sync` or hands a
+    coroutine to `submit`. Either way the request runs on the pool's loop, so
+    every caller shares the same connections and TLS sessions, and the
+    per-host connection limits hold process-wide.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Loop management
+    # ------------------------------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="http-pool", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def _client_for(self, url: str) -> httpx.AsyncClient:
+        """Return the pooled client for this URL's host. Only called on the pool loop."""
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(origin)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    connect=HTTP_CONNECT_TIMEOUT,
+                    read=HTTP_READ_TIMEOUT,
+                    write=HTTP_READ_TIMEOUT,
+                    pool=HTTP_POOL_TIMEOUT,
+                ),
+            )
+            self._clients[origin] = client
+        return client
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+
+    async def _request(self, method: str, url: str, endpoint: str = "other", **kwargs) -> httpx.Response:
+        client = self._client_for(url)
+        upstream = urlsplit(url).hostname
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except Exception:
+            metrics.upstream_requests.inc(upstream, endpoint, "error")
+            raise
+        finally:
+            metrics.upstream_latency.observe(time.perf_counter() - start, upstream, endpoint, method)
+        metrics.upstream_requests.inc(upstream, endpoint, metrics.status_class(resp.status_code))
+        return resp
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) -> Future:
+        """Schedule a coroutine on the pool loop; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """Run a coroutine on the pool loop and block for its result (sync callers only)."""
+        return self.submit(coro).result()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Async request from any event loop. `endpoint=` names the call in the upstream metrics."""
+        loop = self._ensure_loop()
+        if asyncio.get_running_loop() is loop:
+            return await self._request(method, url, **kwargs)
+        return await asyncio.wrap_future(self.submit(self._request(method, url, **kwargs)))
+
+    def request_sync(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Blocking request for sync callers (never call this from an event loop)."""
+        return self.run(self._request(method, url, **kwargs))
+
+    # ------------------------------------------------------------------
+    # Shutdown
+    # ------------------------------------------------------------------
+
+    async def _aclose_clients(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._aclose_clients(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Error closing HTTP pool: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+http_pool = HTTPPool()
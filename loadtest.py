@@ -0,0 +1,548 @@
+# loadtest.py - Reproducible load test for Clau Trading Backend, run entirely against local stand-ins.
+#
+# `run` starts the Alpaca and Stripe stand-ins (fake_alpaca.py, fake_stripe.py)
+# and the API under uvicorn, seeds a scratch database, then drives the API with
+# closed-loop virtual users (login, portfolio, trades, Stripe deposits) and
+# websocket clients on /ws/prices. Results are written as JSON tagged with the
+# commit, so runs can be compared across commits:
+#
+#   python loadtest.py run --users 2000 --ws-clients 1000 --duration 60 --workers 4
+#   python loadtest.py run --database-url postgresql+psycopg2://bench@localhost/clau_loadtest
+#   python loadtest.py compare loadtest-results/<before>.json loadtest-results/<after>.json
+#
+# The scenario is seeded (--seed): each virtual user draws its operations,
+# symbols and amounts from its own RNG, so every run issues the same per-user
+# request sequences. Websocket lag compares the server's event-loop clock with
+# ours, so the load generator must run on the same host as the API.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import websockets
+
+ROOT = Path(__file__).resolve().parent
+PASSWORD = "loadtest-password"
+DEFAULT_SYMBOLS = "AAPL,MSFT,NVDA,AMZN,GOOGL,META,TSLA,AMD,NFLX,INTC,JPM,V,KO,PEP,DIS,BA,XOM,WMT,COST,ORCL"
+DEFAULT_MIX = "portfolio=4,valuation=2,trade=3,login=1,deposit=1"
+
+
+# ---------------------------------------------------------------------------
+# Stack: stand-ins, database and API
+# ---------------------------------------------------------------------------
+
+def _configure_env(args, workdir: str):
+    """
+    Environment shared by the seeding step (this process) and the API it starts.
+    Credentials are always throwaway values, so real keys in the shell or .env
+    never reach the stand-ins.
+    """
+    from cryptography.fernet import Fernet
+
+    host = "127.0.0.1"
+    os.environ.update({
+        "DATABASE_URL": args.database_url or f"sqlite:///{workdir}/loadtest.db",
+        "ASYNC_DATABASE_URL": "",  # derived from DATABASE_URL
+        "JWT_SECRET_KEY": secrets.token_hex(32),
+        "TOKEN_ENCRYPTION_KEY": Fernet.generate_key().decode(),
+        "ALPACA_API_KEY": "loadtest",
+        "ALPACA_SECRET_KEY": "loadtest",
+        "STRIPE_SECRET_KEY": "sk_test_loadtest",
+        "ALPACA_DATA_URL": f"http://{host}:{args.port + 1}",
+        "ALPACA_BASE_URL": f"http://{host}:{args.port + 2}",
+        "ALPACA_STREAM_URL": f"ws://{host}:{args.port + 3}",
+        "STRIPE_API_BASE": f"http://{host}:{args.port + 4}",
+        "MARKET_DATA_MODE": args.market_data,
+        "PRICE_UPDATE_INTERVAL": str(args.price_interval),
+        # One elected upstream feed relayed to the other workers, as production runs with several
+        "PRICE_FEED_MODE": "shared" if args.workers > 1 else "local",
+        "RATE_LIMIT_ENABLED": "false",  # every virtual user shares one IP
+        # Locks and sockets of our own, so a dev server on this host isn't disturbed
+        "PRICE_FEED_SOCKET": f"{workdir}/price_feed.sock",
+        "PRICE_FEED_LOCK": f"{workdir}/price_feed.lock",
+        "FILL_TRACKER_LOCK": f"{workdir}/fill_tracker.lock",
+        "PYTHONPATH": str(ROOT),
+    })
+
+
+def _raise_fd_limit():
+    # Thousands of clients need more descriptors than the usual soft limit; children inherit this
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+
+
+class Stack:
+    """The API and its stand-ins as child processes, logging to the work directory and stopped together."""
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self.procs: list[tuple[str, subprocess.Popen]] = []
+
+    def start(self, name: str, *argv: str):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        proc = subprocess.Popen([sys.executable, *argv], cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        self.procs.append((name, proc))
+
+    def wait_for_port(self, name: str, port: int, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        proc = dict(self.procs)[name]
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{name} exited with {proc.returncode}; see {self.workdir}/{name}.log")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{name} did not listen on :{port} within {timeout:.0f}s; see {self.workdir}/{name}.log")
+
+    def stop(self):
+        for _, proc in self.procs:
+            proc.terminate()
+        for _, proc in self.procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def start_stack(args, workdir: str) -> Stack:
+    stack = Stack(workdir)
+    try:
+        _start(stack, args, workdir)
+    except BaseException:
+        stack.stop()
+        raise
+    return stack
+
+
+def _start(stack: Stack, args, workdir: str):
+    alpaca_faults = ("--latency-ms", str(args.alpaca_latency_ms), "--error-rate", str(args.alpaca_error_rate))
+    stack.start("alpaca-data", "fake_alpaca.py", "data", "--port", str(args.port + 1), *alpaca_faults)
+    stack.start("alpaca-trading", "fake_alpaca.py", "trading", "--port", str(args.port + 2),
+                "--fill-delay", str(args.fill_delay), *alpaca_faults)
+    if args.market_data == "stream":
+        stack.start("alpaca-stream", "fake_alpaca.py", "stream", "--port", str(args.port + 3), "--rate", str(args.stream_rate))
+    stack.start("stripe", "fake_stripe.py", "--port", str(args.port + 4),
+                "--latency-ms", str(args.stripe_latency_ms), "--error-rate", str(args.stripe_error_rate))
+    for name, port in (("alpaca-data", 1), ("alpaca-trading", 2), ("stripe", 4)):
+        stack.wait_for_port(name, args.port + port)
+    if args.market_data == "stream":
+        stack.wait_for_port("alpaca-stream", args.port + 3)
+
+    stack.start("api", "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+                "--workers", str(args.workers), "--log-level", "warning", "--no-access-log")
+    stack.wait_for_port("api", args.port, timeout=60)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/health", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API never became healthy; see {workdir}/api.log")
+
+
+def seed(args, symbols: list[str]):
+    """
+    Recreate the schema and insert `args.users` users, each with a funded
+    wallet, a connected Alpaca account and `args.positions` positions to sell from.
+    """
+    from sqlalchemy import insert
+
+    from auth_models import User
+    from auth_utils import hash_password
+    from crypto_utils import encrypt_token
+    from database import Base, engine
+    from models import AlpacaToken, Position, Wallet
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    password_hash = hash_password(PASSWORD)  # derived once; every login still verifies in full
+    rng = random.Random(args.seed)
+    with engine.begin() as conn:
+        for start in range(1, args.users + 1, 1000):
+            ids = range(start, min(start + 1000, args.users + 1))
+            conn.execute(insert(User), [{"id": i, "username": f"loadtest{i}", "password_hash": password_hash} for i in ids])
+            conn.execute(insert(Wallet), [{"user_id": i, "balance": args.balance} for i in ids])
+            conn.execute(insert(AlpacaToken), [{"user_id": i, "access_token": encrypt_token(f"loadtest-{i}")} for i in ids])
+            conn.execute(insert(Position), [
+                {"user_id": i, "symbol": symbol, "quantity": 1000, "avg_price": 100}
+                for i in ids for symbol in rng.sample(symbols, min(args.positions, len(symbols)))
+            ])
+    engine.dispose()
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {"p50_ms": at(0.50), "p90_ms": at(0.90), "p99_ms": at(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+def _outcome(response: httpx.Response | None) -> str:
+    if response is None or response.status_code == 429 or response.status_code >= 500:
+        return "errors"
+    return "rejected" if response.status_code >= 400 else "ok"
+
+
+class Recorder:
+    """Samples taken inside the measurement window; ramp-up and drain are left out."""
+
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+        self.latency: dict[str, list[float]] = {}
+        self.outcomes: dict[str, dict[str, int]] = {}
+        self.ws_lag: list[float] = []
+        self.ws_connected = 0
+        self.ws_failed = 0
+        self.loop_lag: list[float] = []
+
+    def measuring(self, at: float) -> bool:
+        return self.start <= at < self.end
+
+    def record(self, op: str, started: float, elapsed: float, outcome: str):
+        if self.measuring(started):
+            self.latency.setdefault(op, []).append(elapsed)
+            counts = self.outcomes.setdefault(op, {"ok": 0, "rejected": 0, "errors": 0})
+            counts[outcome] += 1
+
+    def http_results(self) -> dict:
+        window = self.end - self.start
+        results = {}
+        for op, samples in sorted(self.latency.items()):
+            counts = self.outcomes[op]
+            results[op] = {
+                "count": len(samples), **counts,
+                "per_second": round(len(samples) / window, 2),
+                "error_rate": round(counts["errors"] / len(samples), 4),
+                **_percentiles(samples),
+            }
+        everything = [s for samples in self.latency.values() for s in samples]
+        totals = {k: sum(c[k] for c in self.outcomes.values()) for k in ("ok", "rejected", "errors")}
+        results["all"] = {
+            "count": len(everything), **totals,
+            "per_second": round(len(everything) / window, 2),
+            "error_rate": round(totals["errors"] / len(everything), 4) if everything else 0,
+            **_percentiles(everything),
+        }
+        return results
+
+    def ws_results(self, clients: int) -> dict:
+        return {
+            "clients": clients,
+            "connected": self.ws_connected,
+            "failed": self.ws_failed,
+            "messages": len(self.ws_lag),
+            "per_second": round(len(self.ws_lag) / (self.end - self.start), 2),
+            **{f"lag_{k}": v for k, v in _percentiles(self.ws_lag).items()},
+        }
+
+
+class VirtualUser:
+    """One closed-loop client: log in, then pick weighted operations back to back with think time between."""
+
+    def __init__(self, n: int, client: httpx.AsyncClient, args, symbols: list[str], recorder: Recorder):
+        self.rng = random.Random(f"{args.seed}:{n}")
+        self.username = f"loadtest{n}"
+        self.client = client
+        self.args = args
+        self.symbols = symbols
+        self.recorder = recorder
+        self.headers: dict[str, str] = {}
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response | None:
+        try:
+            return await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            return None
+
+    async def login(self):
+        response = await self._send("POST", "/auth/login", json={"username": self.username, "password": PASSWORD})
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return response
+
+    async def portfolio(self):
+        return await self._send("GET", "/portfolio")
+
+    async def valuation(self):
+        return await self._send("GET", "/portfolio", params={"valuation": "true"})
+
+    async def trade(self):
+        side = "sell" if self.rng.random() < self.args.sell_ratio else "buy"
+        body = {"symbol": self.rng.choice(self.symbols), "amount": round(self.rng.uniform(10, 200), 2), "side": side}
+        return await self._send("POST", "/trades", json=body)
+
+    async def deposit(self):
+        """The client's side of a Stripe deposit: create the intent, then confirm it with a card."""
+        response = await self._send("POST", "/stripe/create-payment-intent", json={"amount": round(self.rng.uniform(20, 500), 2)})
+        if response is None or response.status_code != 200:
+            return response
+        if "payment_intent_id" not in response.json():
+            return None  # the API reports Stripe failures as a 200 with an error body
+        return await self._send("POST", "/stripe/confirm-payment", json={
+            "payment_intent_id": response.json()["payment_intent_id"], "payment_method_id": "pm_card_visa",
+        })
+
+    async def step(self, op: str):
+        started = time.monotonic()
+        response = await getattr(self, op)()
+        self.recorder.record(op, started, time.monotonic() - started, _outcome(response))
+
+    async def run(self, start_at: float, ops: list[str], weights: list[float]):
+        await asyncio.sleep(max(start_at - time.monotonic(), 0))
+        while not self.headers and time.monotonic() < self.recorder.end:
+            await self.step("login")
+            if not self.headers:
+                await asyncio.sleep(1)
+        while time.monotonic() < self.recorder.end:
+            await self.step(self.rng.choices(ops, weights)[0])
+            if self.args.think_ms:
+                await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+
+
+async def ws_client(n: int, url: str, args, symbols: list[str], recorder: Recorder, start_at: float):
+    """Subscribes to a few symbols and records, for every price update, how long after the server stamped it it arrived."""
+    rng = random.Random(f"{args.seed}:ws:{n}")
+    await asyncio.sleep(max(start_at - time.monotonic(), 0))
+    try:
+        async with websockets.connect(url, open_timeout=30, max_queue=None) as ws:
+            recorder.ws_connected += 1
+            for symbol in rng.sample(symbols, min(args.ws_symbols, len(symbols))):
+                await ws.send(json.dumps({"type": "subscribe", "symbol": symbol, "batch": args.ws_batch}))
+            while (remaining := recorder.end - time.monotonic()) > 0:
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                now = time.monotonic()
+                if not recorder.measuring(now):
+                    continue
+                message = json.loads(raw)
+                updates = message["updates"] if message.get("type") == "price_batch" else [message]
+                # The server stamps updates with loop.time(): the same monotonic clock as ours on one host
+                recorder.ws_lag.extend(now - u["timestamp"] for u in updates if u.get("type") == "price_update")
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+        recorder.ws_failed += 1
+
+
+async def _watch_loop_lag(recorder: Recorder, interval: float = 0.1):
+    """How late our own timers fire: when this is high the generator, not the API, is the bottleneck."""
+    while time.monotonic() < recorder.end:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        if recorder.measuring(expected):
+            recorder.loop_lag.append(time.monotonic() - expected)
+
+
+def _parse_mix(mix: str) -> tuple[list[str], list[float]]:
+    ops, weights = [], []
+    for part in mix.split(","):
+        op, _, weight = part.partition("=")
+        if op not in ("login", "portfolio", "valuation", "trade", "deposit"):
+            raise ValueError(f"Unknown operation in --mix: {op}")
+        ops.append(op)
+        weights.append(float(weight or 1))
+    return ops, weights
+
+
+async def drive(args, symbols: list[str]) -> tuple[Recorder, dict]:
+    ops, weights = _parse_mix(args.mix)
+    now = time.monotonic()
+    recorder = Recorder(now + args.ramp, now + args.ramp + args.duration)
+    base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        tasks = [asyncio.create_task(_watch_loop_lag(recorder))]
+        # Arrivals are spread evenly over the ramp so logins don't all land at once
+        for n in range(1, args.users + 1):
+            start_at = now + args.ramp * (n - 1) / args.users
+            tasks.append(asyncio.create_task(VirtualUser(n, client, args, symbols, recorder).run(start_at, ops, weights)))
+        for n in range(args.ws_clients):
+            start_at = now + args.ramp * n / max(args.ws_clients, 1)
+            tasks.append(asyncio.create_task(ws_client(n, f"ws://127.0.0.1:{args.port}/ws/prices", args, symbols, recorder, start_at)))
+        await asyncio.gather(*tasks)
+        health = (await client.get("/health")).json()
+    return recorder, health
+
+
+# ---------------------------------------------------------------------------
+# Results
+# ---------------------------------------------------------------------------
+
+def _git(*argv: str) -> str:
+    try:
+        return subprocess.run(["git", *argv], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _meta(args) -> dict:
+    params = {k: v for k, v in vars(args).items() if k not in ("command", "func", "results_dir", "database_url")}
+    params["database"] = (args.database_url or "sqlite").split(":", 1)[0]
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "params": params,
+    }
+
+
+def _print_results(results: dict):
+    print(f"\n{'operation':<12}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'errors':>9}{'4xx':>8}")
+    for op, r in results["http"].items():
+        print(f"{op:<12}{r['per_second']:>10}{r.get('p50_ms', '-'):>10}{r.get('p90_ms', '-'):>10}"
+              f"{r.get('p99_ms', '-'):>10}{r['errors']:>9}{r['rejected']:>8}")
+    ws = results["ws"]
+    print(f"\nwebsocket: {ws['connected']}/{ws['clients']} connected · {ws['per_second']} updates/s · "
+          f"lag p50 {ws.get('lag_p50_ms', '-')} ms · p99 {ws.get('lag_p99_ms', '-')} ms")
+    gen = results["generator"]
+    print(f"generator loop lag: p99 {gen.get('p99_ms', '-')} ms (high values mean the numbers above are capped by the generator)")
+
+
+def run(args):
+    symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()]
+    workdir = tempfile.mkdtemp(prefix="clau-loadtest-")
+    _raise_fd_limit()
+    _configure_env(args, workdir)
+    meta = _meta(args)
+    print(f"Seeding {args.users} users… (logs in {workdir})", file=sys.stderr)
+    seed(args, symbols)
+    stack = start_stack(args, workdir)
+    try:
+        print(f"Driving {args.users} users and {args.ws_clients} websocket clients for "
+              f"{args.ramp:.0f}s ramp + {args.duration:.0f}s…", file=sys.stderr)
+        recorder, health = asyncio.run(drive(args, symbols))
+    finally:
+        stack.stop()
+
+    results = {
+        "meta": meta,
+        "http": recorder.http_results(),
+        "ws": recorder.ws_results(args.ws_clients),
+        "generator": {"loop_lag_samples": len(recorder.loop_lag), **_percentiles(recorder.loop_lag)},
+        "server": health,
+    }
+    _print_results(results)
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.results_dir, f"{stamp}-{(meta['commit'] or 'nogit')[:12]}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nResults written to {path}", file=sys.stderr)
+
+
+def _delta(before, after) -> str:
+    if before is None or after is None:
+        return "—"
+    if not before:
+        return f"{after}"
+    return f"{after} ({(after - before) / before * 100:+.1f}%)"
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"before: {before['meta']['commit'][:12]}{' (dirty)' if before['meta']['dirty'] else ''}  "
+          f"after: {after['meta']['commit'][:12]}{' (dirty)' if after['meta']['dirty'] else ''}")
+    changed = {k for k in before["meta"]["params"].keys() | after["meta"]["params"].keys()
+               if before["meta"]["params"].get(k) != after["meta"]["params"].get(k)}
+    if changed:
+        print(f"warning: runs used different parameters ({', '.join(sorted(changed))}); deltas are not like for like")
+
+    regressions = []
+    print(f"\n{'operation':<12}{'req/s':>22}{'p50 ms':>22}{'p99 ms':>22}{'error rate':>22}")
+    for op in sorted(before["http"].keys() | after["http"].keys()):
+        b, a = before["http"].get(op, {}), after["http"].get(op, {})
+        print(f"{op:<12}" + "".join(f"{_delta(b.get(k), a.get(k)):>22}" for k in ("per_second", "p50_ms", "p99_ms", "error_rate")))
+        if not (a and b):
+            continue  # only in one run's mix
+        if b.get("per_second") and a.get("per_second", 0) < b["per_second"] * (1 - args.threshold):
+            regressions.append(f"{op} throughput")
+        if b.get("p99_ms") and a.get("p99_ms", 0) > b["p99_ms"] * (1 + args.threshold):
+            regressions.append(f"{op} p99")
+
+    b, a = before["ws"], after["ws"]
+    print(f"\n{'websocket':<12}{'updates/s':>22}{'lag p50 ms':>22}{'lag p99 ms':>22}")
+    print(f"{'':<12}" + "".join(f"{_delta(b.get(k), a.get(k)):>22}" for k in ("per_second", "lag_p50_ms", "lag_p99_ms")))
+    if b.get("lag_p99_ms") and a.get("lag_p99_ms", 0) > b["lag_p99_ms"] * (1 + args.threshold):
+        regressions.append("websocket lag p99")
+
+    if regressions:
+        print(f"\nRegressed beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test Clau Trading Backend against local stand-ins")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="start the stack, drive it and write a results file")
+    r.add_argument("--users", type=int, default=1000, help="closed-loop HTTP virtual users")
+    r.add_argument("--ws-clients", type=int, default=500, help="websocket clients on /ws/prices")
+    r.add_argument("--duration", type=float, default=60, help="seconds measured, after the ramp")
+    r.add_argument("--ramp", type=float, default=10, help="seconds over which clients arrive; not measured")
+    r.add_argument("--think-ms", type=float, default=500, help="mean pause between a user's requests (exponential)")
+    r.add_argument("--mix", default=DEFAULT_MIX, help="operation weights: login, portfolio, valuation, trade, deposit")
+    r.add_argument("--sell-ratio", type=float, default=0.3, help="fraction of trades that are sells")
+    r.add_argument("--symbols", default=DEFAULT_SYMBOLS)
+    r.add_argument("--positions", type=int, default=5, help="seeded positions per user")
+    r.add_argument("--balance", type=float, default=1_000_000, help="seeded wallet balance per user")
+    r.add_argument("--ws-symbols", type=int, default=5, help="symbols each websocket client subscribes to")
+    r.add_argument("--ws-batch", action="store_true", help="subscribe in batch mode")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--timeout", type=float, default=30, help="client-side request timeout, seconds")
+    r.add_argument("--workers", type=int, default=2, help="uvicorn workers")
+    r.add_argument("--port", type=int, default=18000, help="API port; the stand-ins take the next four")
+    r.add_argument("--database-url", default=None,
+                   help="scratch database whose tables are dropped and recreated (default: SQLite in a temp dir)")
+    r.add_argument("--market-data", choices=("poll", "stream"), default="poll")
+    r.add_argument("--price-interval", type=float, default=1, help="PRICE_UPDATE_INTERVAL for the API, seconds")
+    r.add_argument("--stream-rate", type=float, default=5, help="stream stand-in trades per second per symbol")
+    r.add_argument("--alpaca-latency-ms", type=float, default=20)
+    r.add_argument("--alpaca-error-rate", type=float, default=0.0)
+    r.add_argument("--fill-delay", type=float, default=0.5, help="seconds before a stand-in order fills")
+    r.add_argument("--stripe-latency-ms", type=float, default=100)
+    r.add_argument("--stripe-error-rate", type=float, default=0.0)
+    r.add_argument("--results-dir", default="loadtest-results")
+    r.set_defaults(func=run)
+
+    c = sub.add_parser("compare", help="compare two results files")
+    c.add_argument("before")
+    c.add_argument("after")
+    c.add_argument("--threshold", type=float, default=0.10, help="relative change treated as a regression (exit 1)")
+    c.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
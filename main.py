@@ -2,64 +2,114 @@
 import logging
 import json
 import asyncio
-import requests
+from typing import Literal
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import RedirectResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from sqlalchemy import text
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from database import Base, engine, get_db
+from database import Base, engine, async_engine, AsyncSessionLocal, get_db, get_async_db
 from schemas import (
     DepositRequest,
     WithdrawRequest,
     TradeRequest,
+    BatchTradeRequest,
+    BatchTradeResponse,
+    TradeLegResult,
     WalletResponse,
+    TradeSubmittedResponse,
     PortfolioResponse,
     PositionResponse,
     StripeDepositRequest,
     ConfirmPaymentRequest,
+    TradeResponse,
+    TradeHistoryResponse,
 )
 from auth_schemas import LoginRequest, SignupRequest, LoginResponse, SignupResponse, RefreshTokenRequest, RefreshTokenResponse
 from auth_models import User
-from auth_utils import hash_password, verify_password, create_access_token, create_refresh_token, get_current_user_id, get_user_id_from_refresh_token
-from tradin_service import deposit, withdraw, get_portfolio, execute_trade
+from auth_utils import (
+    hash_password_async,
+    verify_password_async,
+    password_pool,
+    create_access_token,
+    create_refresh_token,
+    get_current_user_id,
+    get_user_id_from_refresh_token,
+    token_cache,
+)
+from tradin_service import deposit, withdraw, get_portfolio, value_positions, execute_trade, execute_batch, get_trade_history, alpaca_tokens
 from stripe_service import create_payment_intent, confirm_payment, create_payout_to_user
-from websocket_service import manager, price_updater
-from models import AlpacaToken
+from export_service import stream_export, MEDIA_TYPES
+from websocket_service import manager
+from price_feed import run_price_feed
+from fill_tracker import fill_tracker, run_fill_tracker
+from models import AlpacaToken, Trade
+from alpaca_client import quote_cache, exchange_authorization_code, get_quote_async, get_quotes_async, trading_guard_stats
+from trading_guard import TradingUnavailable
+from reference_data import reference_store
+from bar_aggregator import bar_aggregator, TIMEFRAMES
+from http_client import http_pool
 from crypto_utils import encrypt_token
-from config import ALPACA_CLIENT_ID, ALPACA_CLIENT_SECRET, ALPACA_REDIRECT_URI, ALPACA_TOKEN_URL
+from rate_limit import limiter
+import metrics
 
 logger = logging.getLogger(__name__)
 
-limiter = Limiter(key_func=get_remote_address)
 app = FastAPI(title="Clau Trading Backend", docs_url=None, redoc_url=None)  # disable docs in prod
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_middleware(metrics.RouteMetricsMiddleware)
 
 Base.metadata.create_all(bind=engine)
 
-_price_updater_task = None
+_background_tasks: list[asyncio.Task] = []
+
+# Served on /health and, flattened into gauges, on /metrics
+COMPONENT_STATS = {
+    "quote_cache": quote_cache.stats,
+    "bars": bar_aggregator.stats,
+    "token_cache": token_cache.stats,
+    "password_pool": password_pool.stats,
+    "alpaca_tokens": alpaca_tokens.stats,
+    "alpaca_trading": trading_guard_stats,
+    "fill_tracker": fill_tracker.stats,
+}
+for _name, _stats in COMPONENT_STATS.items():
+    metrics.registry.stats(_name, _stats)
+
+
+async def _reference_universe() -> list[str]:
+    """Symbols worth preloading reference data for: everything held plus everything watched."""
+    from models import Position
+    async with AsyncSessionLocal() as db:
+        held = (await db.scalars(select(Position.symbol).distinct())).all()
+    return list({*held, *manager.symbol_subscribers})
 
 
 @app.on_event("startup")
 async def startup_event():
-    global _price_updater_task
-    _price_updater_task = asyncio.create_task(price_updater())
+    _background_tasks.append(asyncio.create_task(run_price_feed()))
+    _background_tasks.append(asyncio.create_task(reference_store.run(_reference_universe)))
+    _background_tasks.append(asyncio.create_task(run_fill_tracker()))
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    if _price_updater_task:
-        _price_updater_task.cancel()
+    for task in _background_tasks:
+        task.cancel()
         try:
-            await _price_updater_task
+            await task
         except asyncio.CancelledError:
             pass
+    http_pool.close()
+    password_pool.shutdown()
+    await async_engine.dispose()
     logger.info("Server shutdown complete")
 
 
@@ -68,15 +118,21 @@ async def shutdown_event():
 # ---------------------------------------------------------------------------
 
 @app.get("/health")
-def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         db_status = "ok"
     except Exception:
         db_status = "error"
 
     status = "ok" if db_status == "ok" else "degraded"
-    return {"status": status, "db": db_status}
+    return {"status": status, "db": db_status, **{name: stats() for name, stats in COMPONENT_STATS.items()}}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text format; per worker, like the counters behind it."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 
 # ---------------------------------------------------------------------------
@@ -117,23 +173,11 @@ def alpaca_connect(
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    resp = requests.post(
-        ALPACA_TOKEN_URL,
-        data={
-            "grant_type": "authorization_code",
-            "code": body.code,
-            "client_id": ALPACA_CLIENT_ID,
-            "client_secret": ALPACA_CLIENT_SECRET,
-            "redirect_uri": ALPACA_REDIRECT_URI,
-        },
-        timeout=15,
-    )
-
-    if not resp.ok:
-        logger.error("Alpaca token exchange failed: status=%s", resp.status_code)
+    token_data = exchange_authorization_code(body.code)
+    if token_data is None:
+        logger.error("Alpaca token exchange failed for user_id=%s", user_id)
         raise HTTPException(status_code=400, detail="Failed to exchange Alpaca authorization code")
 
-    token_data = resp.json()
     access_token = token_data.get("access_token")
     if not access_token:
         raise HTTPException(status_code=400, detail="No access token in Alpaca response")
@@ -141,8 +185,14 @@ def alpaca_connect(
     record = db.query(AlpacaToken).filter(AlpacaToken.user_id == user_id).first()
     encrypted = encrypt_token(access_token)
     if record:
+        # The new token may be for another Alpaca account, where the open orders would look
+        # unknown and be voided: hold them for manual reconciliation instead
+        db.query(Trade).filter(Trade.user_id == user_id, Trade.settled.is_(False)).update(
+            {Trade.needs_review: True}, synchronize_session=False
+        )
         record.access_token = encrypted
         record.refresh_token = token_data.get("refresh_token")
+        record.version = (record.version or 0) + 1
     else:
         record = AlpacaToken(
             user_id=user_id,
@@ -152,16 +202,17 @@ def alpaca_connect(
         db.add(record)
 
     db.commit()
+    alpaca_tokens.invalidate(user_id)
     return {"message": "Alpaca account connected successfully"}
 
 
 @app.get("/alpaca/status", response_model=AlpacaConnectStatus)
-def alpaca_status(
+async def alpaca_status(
     user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    record = db.query(AlpacaToken).filter(AlpacaToken.user_id == user_id).first()
-    return AlpacaConnectStatus(connected=record is not None)
+    token = await alpaca_tokens.aget(db, user_id)
+    return AlpacaConnectStatus(connected=token is not None)
 
 
 @app.delete("/alpaca/disconnect")
@@ -169,10 +220,14 @@ def alpaca_disconnect(
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
+    if db.query(Trade.id).filter(Trade.user_id == user_id, Trade.settled.is_(False)).first():
+        # Their fills can only be tracked through this token
+        raise HTTPException(status_code=400, detail="Trades are still settling; disconnect once they have filled")
     record = db.query(AlpacaToken).filter(AlpacaToken.user_id == user_id).first()
     if record:
         db.delete(record)
         db.commit()
+    alpaca_tokens.invalidate(user_id)
     return {"message": "Alpaca account disconnected"}
 
 
@@ -183,8 +238,8 @@ def alpaca_disconnect(
 @app.post("/wallet/deposit", response_model=WalletResponse)
 @limiter.limit("10/minute")
 def deposit_money(request: Request, body: DepositRequest, user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
-    wallet = deposit(db, user_id, body.amount)
-    return WalletResponse(balance=wallet.balance)
+    balance = deposit(db, user_id, body.amount)
+    return WalletResponse(balance=balance)
 
 
 @app.post("/stripe/create-payment-intent")
@@ -205,8 +260,8 @@ def confirm_stripe_payment(
     payment_result = confirm_payment(body.payment_intent_id, body.payment_method_id)
     if payment_result.get("status") == "succeeded":
         amount = payment_result.get("amount", 0)
-        wallet = deposit(db, user_id, amount)
-        return WalletResponse(balance=wallet.balance)
+        balance = deposit(db, user_id, amount)
+        return WalletResponse(balance=balance)
     raise HTTPException(status_code=400, detail="Payment not successful")
 
 
@@ -215,68 +270,144 @@ def confirm_stripe_payment(
 def withdraw_money(request: Request, body: WithdrawRequest, user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
     from models import Wallet
 
-    wallet = db.query(Wallet).filter(Wallet.user_id == user_id).first()
-    if not wallet or wallet.balance < body.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-
-    if not wallet.stripe_account_id:
+    stripe_account_id = db.scalar(select(Wallet.stripe_account_id).where(Wallet.user_id == user_id))
+    if not stripe_account_id:
         raise HTTPException(
             status_code=400,
             detail="No payout account linked. Please connect a bank account before withdrawing."
         )
 
-    try:
-        payout_result = create_payout_to_user(wallet.stripe_account_id, body.amount)
+    # Debit first (atomic, conditional) so two concurrent withdrawals can't both pay out
+    balance = withdraw(db, user_id, body.amount)
+    if balance is None:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
 
+    try:
+        payout_result = create_payout_to_user(stripe_account_id, body.amount)
         if payout_result.get("status") in ["paid", "pending"]:
-            wallet.balance -= body.amount
-            db.commit()
-            return WalletResponse(balance=wallet.balance)
-
-        raise HTTPException(status_code=400, detail="Payout could not be completed")
-
-    except HTTPException:
-        raise
+            return WalletResponse(balance=balance)
+        payout_error = HTTPException(status_code=400, detail="Payout could not be completed")
     except Exception:
         logger.exception("Unexpected error during withdrawal for user_id=%s", user_id)
-        raise HTTPException(status_code=500, detail="Withdrawal failed. Please try again later.")
+        payout_error = HTTPException(status_code=500, detail="Withdrawal failed. Please try again later.")
+
+    # The payout didn't go out — give the money back
+    deposit(db, user_id, body.amount)
+    raise payout_error
 
 
 # ---------------------------------------------------------------------------
 # Portfolio & Trading
 # ---------------------------------------------------------------------------
 
-@app.get("/portfolio", response_model=PortfolioResponse)
-def get_user_portfolio(user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
-    wallet, positions = get_portfolio(db, user_id)
+@app.get("/portfolio", response_model=PortfolioResponse, response_model_exclude_none=True)
+async def get_user_portfolio(
+    valuation: bool = False,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+):
+    wallet, positions = await get_portfolio(db, user_id)
+    if not valuation:
+        return PortfolioResponse(
+            balance=wallet.balance,
+            positions=[
+                PositionResponse(symbol=p.symbol, quantity=p.quantity, avg_price=p.avg_price)
+                for p in positions
+            ],
+        )
+
+    # One batched quote fetch prices every holding
+    prices = await get_quotes_async([p.symbol for p in positions])
+    rows, totals = value_positions(positions, prices)
     return PortfolioResponse(
         balance=wallet.balance,
-        positions=[
-            PositionResponse(symbol=p.symbol, quantity=p.quantity, avg_price=p.avg_price)
-            for p in positions
-        ],
+        positions=[PositionResponse(**row) for row in rows],
+        **totals,
     )
 
 
-@app.post("/trades", response_model=WalletResponse)
+@app.post("/trades", response_model=TradeSubmittedResponse)
 @limiter.limit("20/minute")
-def place_trade(request: Request, body: TradeRequest, user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
+async def place_trade(request: Request, body: TradeRequest, user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_async_db)):
+    """Returns once Alpaca accepts the order; the position and proceeds follow when it fills."""
     try:
-        wallet = execute_trade(
+        balance, trade = await execute_trade(
             db,
             user_id=user_id,
             symbol=body.symbol,
             amount=body.amount,
             side=body.side,
         )
-        return WalletResponse(balance=wallet.balance)
+        return TradeSubmittedResponse(
+            balance=balance, trade_id=trade.id, order_id=trade.order_id, status=trade.status, qty=trade.qty, price=trade.price
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except TradingUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception:
         logger.exception("Unexpected error during trade for user_id=%s", user_id)
         raise HTTPException(status_code=500, detail="Trade could not be executed. Please try again.")
 
 
+@app.post("/trades/batch", response_model=BatchTradeResponse, response_model_exclude_none=True)
+@limiter.limit("10/minute")
+def place_trade_batch(request: Request, body: BatchTradeRequest, user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    try:
+        balance, legs = execute_batch(db, user_id=user_id, legs=body.legs)
+        return BatchTradeResponse(balance=balance, legs=[TradeLegResult(**leg) for leg in legs])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Unexpected error during batch trade for user_id=%s", user_id)
+        raise HTTPException(status_code=500, detail="Batch could not be executed. Please try again.")
+
+
+@app.get("/trades", response_model=TradeHistoryResponse)
+@limiter.limit("60/minute")
+async def list_trades(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    symbol: str | None = None,
+    side: Literal["buy", "sell"] | None = None,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        trades, next_cursor = await get_trade_history(db, user_id, limit, cursor=cursor, symbol=symbol, side=side)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return TradeHistoryResponse(
+        trades=[TradeResponse.model_validate(t, from_attributes=True) for t in trades],
+        next_cursor=next_cursor,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+@app.get("/export/{kind}")
+@limiter.limit("5/minute")
+def export_records(
+    request: Request,
+    kind: Literal["trades", "payments"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_id: int = Depends(get_current_user_id),
+):
+    """Full history as a streamed download, gzipped when the client accepts it."""
+    gzip = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"Content-Disposition": f'attachment; filename="{kind}.{format}"', "Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        stream_export(kind, user_id, format, gzip),
+        media_type=MEDIA_TYPES[format],
+        headers=headers,
+    )
+
+
 # ---------------------------------------------------------------------------
 # Prices
 # ---------------------------------------------------------------------------
@@ -293,22 +424,46 @@ def get_current_price(request: Request, symbol: str):
 
 @app.get("/prices/{symbol}/daily")
 @limiter.limit("60/minute")
-def get_daily_price_data(request: Request, symbol: str):
-    from alpaca_client import get_quote
-    import random
-    current_price = get_quote(symbol)
-    if current_price:
-        previous_close = current_price * (0.95 + random.random() * 0.1)
-        daily_change = current_price - previous_close
-        daily_change_percent = (daily_change / previous_close) * 100
-        return {
-            "symbol": symbol.upper(),
-            "current_price": current_price,
-            "previous_close": previous_close,
-            "daily_change": daily_change,
-            "daily_change_percent": daily_change_percent,
-        }
-    raise HTTPException(status_code=404, detail="Price not found")
+async def get_daily_price_data(request: Request, symbol: str):
+    symbol = symbol.upper()
+    current_price = await get_quote_async(symbol)
+    if not current_price:
+        raise HTTPException(status_code=404, detail="Price not found")
+
+    reference_store.observe(symbol, current_price)
+    ref = await reference_store.get(symbol)
+    if ref is None or ref.previous_close is None:
+        raise HTTPException(status_code=404, detail="Previous close not available")
+
+    daily_change = current_price - ref.previous_close
+    daily_change_percent = (daily_change / ref.previous_close) * 100
+    return {
+        "symbol": symbol,
+        "current_price": current_price,
+        "previous_close": ref.previous_close,
+        "open": ref.open,
+        "high": ref.high,
+        "low": ref.low,
+        "daily_change": daily_change,
+        "daily_change_percent": daily_change_percent,
+    }
+
+
+@app.get("/prices/{symbol}/bars")
+@limiter.limit("60/minute")
+async def get_price_bars(
+    request: Request,
+    symbol: str,
+    timeframe: str = "1m",
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """OHLCV bars built in-process from the live feed, oldest first; the last bar is still forming."""
+    if timeframe not in TIMEFRAMES:
+        raise HTTPException(status_code=400, detail=f"timeframe must be one of {', '.join(TIMEFRAMES)}")
+    bars = bar_aggregator.bars(symbol.upper(), timeframe, limit)
+    if bars is None:
+        raise HTTPException(status_code=404, detail="No bars for this symbol — subscribe to it on /ws/prices first")
+    return {"symbol": symbol.upper(), "timeframe": timeframe, "bars": bars}
 
 
 # ---------------------------------------------------------------------------
@@ -325,9 +480,11 @@ async def websocket_endpoint(websocket: WebSocket):
 
             if message["type"] == "subscribe":
                 symbol = message["symbol"]
-                manager.subscribe_symbol(websocket, symbol)
+                batch = bool(message.get("batch", False))
+                bars = bool(message.get("bars", False))
+                manager.subscribe_symbol(websocket, symbol, batch=batch, bars=bars)
                 await manager.send_personal_message(
-                    json.dumps({"type": "subscribed", "symbol": symbol.upper()}),
+                    json.dumps({"type": "subscribed", "symbol": symbol.upper(), "batch": batch, "bars": bars}),
                     websocket,
                 )
             elif message["type"] == "unsubscribe":
@@ -338,6 +495,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     websocket,
                 )
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
@@ -347,10 +506,17 @@ async def websocket_endpoint(websocket: WebSocket):
 
 @app.post("/auth/login", response_model=LoginResponse)
 @limiter.limit("5/minute")
-def login(request: Request, body: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == body.username).first()
-    if not user or not verify_password(body.password, user.password_hash):
+async def login(request: Request, body: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.username == body.username))
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_password_async(body.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash predates the current parameters — upgrade it now we know the password
+        user.password_hash = new_hash
+        await db.commit()
     access_token = create_access_token({"user_id": user.id})
     refresh_token = create_refresh_token({"user_id": user.id})
     return LoginResponse(access_token=access_token, refresh_token=refresh_token, user_id=user.id, message="Login successful")
@@ -358,19 +524,24 @@ def login(request: Request, body: LoginRequest, db: Session = Depends(get_db)):
 
 @app.post("/auth/signup", response_model=SignupResponse)
 @limiter.limit("3/minute")
-def signup(request: Request, body: SignupRequest, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == body.username).first():
+async def signup(request: Request, body: SignupRequest, db: AsyncSession = Depends(get_async_db)):
+    if await db.scalar(select(User.id).where(User.username == body.username)):
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    user = User(username=body.username, email=body.email, password_hash=hash_password(body.password))
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    password_hash = await hash_password_async(body.password)
 
     from models import Wallet
-    if not db.query(Wallet).filter(Wallet.user_id == user.id).first():
-        db.add(Wallet(user_id=user.id, balance=0.0))
-        db.commit()
+    user = User(username=body.username, email=body.email, password_hash=password_hash)
+    db.add(user)
+    try:
+        # The INSERT runs at flush, so a duplicate username surfaces here rather than at commit
+        await db.flush()
+        db.add(Wallet(user_id=user.id, balance=0))
+        await db.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent signup for the same username
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Username already exists")
 
     return SignupResponse(message="User created successfully")
 
@@ -0,0 +1,137 @@
+# market_stream.py - Persistent upstream market-data stream for Clau Trading Backend, speaking Alpaca's data stream protocol.
+import asyncio
+import json
+import logging
+import random
+from decimal import Decimal
+from typing import Awaitable, Callable
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+TradeHandler = Callable[[str, Decimal, dict], Awaitable[None]]
+
+
+class MarketDataStream:
+    """
+    One websocket to Alpaca's market-data stream, shared by every client of this process.
+
+    The set of wanted symbols is driven by symbol_added/symbol_removed (called by
+    ConnectionManager as the first subscriber arrives / the last one leaves); the
+    difference against what is currently subscribed upstream is sent as
+    subscribe/unsubscribe actions. On reconnect the full wanted set is resubscribed.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        secret: str,
+        on_trade: TradeHandler,
+        max_reconnect_delay: float = 30.0,
+    ):
+        self.url = url
+        self._key = key
+        self._secret = secret
+        self._on_trade = on_trade
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._wanted: set[str] = set()
+        self._subscribed: set[str] = set()
+        self._changed = asyncio.Event()
+        self.connected = False
+        self.reconnects = 0
+
+    # ------------------------------------------------------------------
+    # Subscription management (sync, safe to call from ConnectionManager)
+    # ------------------------------------------------------------------
+
+    def symbol_added(self, symbol: str):
+        self._wanted.add(symbol)
+        self._changed.set()
+
+    def symbol_removed(self, symbol: str):
+        self._wanted.discard(symbol)
+        self._changed.set()
+
+    # ------------------------------------------------------------------
+    # Connection lifecycle
+    # ------------------------------------------------------------------
+
+    async def run(self):
+        """Connect, authenticate and pump trades forever, reconnecting with backoff."""
+        delay = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=20, ping_timeout=20) as ws:
+                    await self._authenticate(ws)
+                    logger.info(f"Market data stream connected to {self.url}")
+                    self.connected = True
+                    delay = 1.0
+                    # Nothing is subscribed on a fresh connection — resync the full set
+                    self._subscribed = set()
+                    self._changed.set()
+                    await self._pump(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Market data stream error: {e}")
+            finally:
+                self.connected = False
+
+            self.reconnects += 1
+            wait = delay + random.uniform(0, delay / 2)
+            logger.info(f"Reconnecting market data stream in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _authenticate(self, ws):
+        greeting = json.loads(await ws.recv())
+        if not any(m.get("T") == "success" and m.get("msg") == "connected" for m in greeting):
+            raise ConnectionError(f"Unexpected stream greeting: {greeting}")
+
+        await ws.send(json.dumps({"action": "auth", "key": self._key, "secret": self._secret}))
+        reply = json.loads(await ws.recv())
+        if not any(m.get("T") == "success" and m.get("msg") == "authenticated" for m in reply):
+            raise ConnectionError(f"Stream authentication failed: {reply}")
+
+    async def _pump(self, ws):
+        reader = asyncio.create_task(self._read(ws))
+        syncer = asyncio.create_task(self._sync_subscriptions(ws))
+        try:
+            done, _ = await asyncio.wait({reader, syncer}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # re-raise whatever ended the connection
+        finally:
+            reader.cancel()
+            syncer.cancel()
+
+    async def _sync_subscriptions(self, ws):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+
+            wanted = set(self._wanted)
+            to_add = sorted(wanted - self._subscribed)
+            to_remove = sorted(self._subscribed - wanted)
+            if to_add:
+                await ws.send(json.dumps({"action": "subscribe", "trades": to_add}))
+            if to_remove:
+                await ws.send(json.dumps({"action": "unsubscribe", "trades": to_remove}))
+            self._subscribed = wanted
+
+    async def _read(self, ws):
+        async for raw in ws:
+            for msg in json.loads(raw):
+                kind = msg.get("T")
+                if kind == "t":
+                    try:
+                        await self._on_trade(msg["S"], Decimal(str(msg["p"])), msg)
+                    except Exception as e:
+                        logger.error(f"Error handling trade for {msg.get('S')}: {e}")
+                elif kind == "subscription":
+                    logger.info(f"Upstream trade subscriptions: {len(msg.get('trades', []))} symbols")
+                elif kind == "error":
+                    raise ConnectionError(f"Stream error {msg.get('code')}: {msg.get('msg')}")
+        raise ConnectionError("Stream closed by server")
@@ -0,0 +1,260 @@
+# metrics.py - In-process metrics for Clau Trading Backend, rendered in the Prometheus text format on /metrics.
+#
+# Counters and histograms are updated inline on the hot paths: a dict lookup,
+# a bisect over the bucket bounds and a few additions under an uncontended
+# lock — well under a microsecond. Gauges are callbacks read only when scraped.
+# Every worker keeps its own registry, so scrape each worker (or sum them).
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+# Seconds. Routes and upstream calls span sub-millisecond cache hits to multi-second timeouts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Fan-out work is expected to stay in the microsecond-to-millisecond range
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Fixed buckets; per label set a non-cumulative count per bucket plus sum and count."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]!r}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}"
+
+
+class Gauge:
+    """
+    Read at scrape time from `read`, which returns a number, or a dict of
+    label-value tuples to numbers for a labelled gauge.
+    """
+
+    def __init__(self, name: str, help: str, read: Callable, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.read = read
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            if value is not None:
+                yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+def _flatten(stats: dict, prefix: str = ""):
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}_")
+        elif isinstance(value, bool):
+            yield name, None, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, None, value
+        elif isinstance(value, str):
+            yield name, value, 1  # e.g. a breaker state, as a label
+
+
+class StatsCollector:
+    """Exposes a component's existing stats() dict as gauges: clau_<component>_<key>."""
+
+    def __init__(self, component: str, stats: Callable[[], dict]):
+        self.component = component
+        self.stats = stats
+
+    def render(self) -> Iterable[str]:
+        for key, label, value in _flatten(self.stats()):
+            name = f"clau_{self.component}_{key}"
+            yield f"# TYPE {name} gauge"
+            yield f'{name}{{value="{_escape(label)}"}} 1' if label is not None else f"{name} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, read, labels))
+
+    def stats(self, component: str, stats: Callable[[], dict]):
+        return self.register(StatsCollector(component, stats))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# error collecting {getattr(metric, 'name', getattr(metric, 'component', '?'))}: {e!r}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Routes ---
+route_latency = registry.histogram(
+    "clau_http_request_duration_seconds", "Request latency by route template", ("method", "route", "status")
+)
+
+# --- Upstream calls ---
+upstream_latency = registry.histogram(
+    "clau_upstream_request_duration_seconds", "Upstream call latency", ("upstream", "endpoint", "method")
+)
+upstream_requests = registry.counter(
+    "clau_upstream_requests_total", "Upstream calls by outcome (status class, or error)", ("upstream", "endpoint", "outcome")
+)
+
+# --- Database ---
+db_checkout = registry.histogram(
+    "clau_db_pool_checkout_seconds", "Time to get a connection from the pool, waits included", ("pool",)
+)
+
+# --- Market data fan-out ---
+price_cycle = registry.histogram(
+    "clau_price_updater_cycle_seconds", "One price_updater pass: fetch, encode and publish", buckets=LATENCY_BUCKETS
+)
+broadcast = registry.histogram(
+    "clau_ws_broadcast_seconds", "Fanning one batch of updates out to subscriber queues", buckets=FAST_BUCKETS
+)
+send_lag = registry.histogram(
+    "clau_ws_send_lag_seconds", "From the oldest queued update to its flush to the client", buckets=FAST_BUCKETS
+)
+
+
+def status_class(status: int) -> str:
+    return f"{status // 100}xx"
+
+
+@contextmanager
+def track_upstream(upstream: str, endpoint: str, method: str = "POST"):
+    """Time a call made through a client other than http_pool (e.g. the Stripe SDK)."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        upstream_latency.observe(time.perf_counter() - start, upstream, endpoint, method)
+        upstream_requests.inc(upstream, endpoint, outcome)
+
+
+class RouteMetricsMiddleware:
+    """
+    Pure ASGI middleware timing each HTTP request under its route template
+    ("/prices/{symbol}"), so cardinality stays bounded by the route table.
+    Unmatched paths share one "unmatched" series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_latency.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status_class(status),
+            )
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, Boolean, ForeignKey, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -18,6 +18,10 @@ class Wallet(Base):
 
 class Position(Base):
     __tablename__ = "positions"
+    # One row per holding — fills are applied with INSERT ... ON CONFLICT on this
+    __table_args__ = (
+        Index("uq_positions_user_symbol", "user_id", "symbol", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
@@ -30,16 +34,35 @@ class Position(Base):
 
 class Trade(Base):
     __tablename__ = "trades"
+    __table_args__ = (
+        # Keyset pagination for trade history: newest first (by id) per user, optionally per symbol
+        Index("ix_trades_user_id_id", "user_id", "id"),
+        Index("ix_trades_user_symbol_id", "user_id", "symbol", "id"),
+        # The fill tracker's work queue: only trades still waiting on their order
+        Index("ix_trades_unsettled", "user_id", postgresql_where=text("NOT settled"), sqlite_where=text("NOT settled")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
     symbol = Column(String, index=True)
     side = Column(String)  # "buy" or "sell"
-    qty = Column(Numeric(18, 8))
-    price = Column(Numeric(18, 8))
+    qty = Column(Numeric(18, 8))    # as ordered; filled_qty is what actually executed
+    price = Column(Numeric(18, 8))  # quote used to size the order, replaced by the average fill price
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     order_id = Column(String, nullable=True)
-    status = Column(String, default="filled")
+    status = Column(String, default="filled")  # Alpaca order status
+    # Fill tracking — a trade is unsettled until its order completes and the
+    # fill is applied to the position and wallet (see fill_tracker.py)
+    settled = Column(Boolean, nullable=False, default=True, server_default=text("true"))
+    reserved_amount = Column(Numeric(18, 2), nullable=True)  # cash held back for a buy until it settles
+    filled_qty = Column(Numeric(18, 8), nullable=True)
+    filled_at = Column(DateTime(timezone=True), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # optimistic concurrency for settlement
+    # Polls in a row where Alpaca didn't know the order; the tracker backs off and finally voids the trade
+    check_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_check_at = Column(DateTime(timezone=True), nullable=True)
+    # Order no longer visible through the user's token: left unsettled (reservation held) for manual reconciliation
+    needs_review = Column(Boolean, nullable=False, default=False, server_default=text("false"))
 
 
 class Payment(Base):
@@ -63,6 +86,8 @@ class AlpacaToken(Base):
     # Alpaca Connect tokens don't expire by default, but store refresh_token
     # and expires_at for future-proofing if Alpaca adds rotation.
     refresh_token = Column(String, nullable=True)
+    # Bumped whenever access_token changes; workers compare it to revalidate cached tokens
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     expires_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
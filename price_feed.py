@@ -0,0 +1,180 @@
+# price_feed.py - Price feed orchestration for Clau Trading Backend: a per-worker feed, or one elected feed per host shared by every uvicorn worker over a Unix socket.
+#
+# Shared-mode wire protocol (newline-delimited text):
+#   worker -> feed   "+SYM1,SYM2"  start watching symbols
+#                    "-SYM1"       stop watching symbols
+#   feed -> worker   "SYM\t<payload>"  one pre-encoded price_update, relayed as-is
+import asyncio
+import json
+import logging
+import os
+import random
+
+from config import (
+    PRICE_FEED_MODE,
+    PRICE_FEED_SOCKET,
+    PRICE_FEED_LOCK,
+    PRICE_FEED_MAX_BUFFER,
+)
+from websocket_service import manager, market_data_feed, record_ticks, SymbolDemand
+
+logger = logging.getLogger(__name__)
+
+
+def _try_acquire_leadership(lock_path: str) -> int | None:
+    """Take the host-wide feed lock without blocking. Returns the held fd, or None."""
+    import fcntl  # Unix only; shared mode isn't supported elsewhere
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class FeedLeader:
+    """
+    The one process on the host that talks to Alpaca. Demand is the union of its
+    own clients' symbols and every connected worker's; each tick is published
+    locally and relayed to the workers that asked for those symbols.
+    """
+
+    def __init__(self, demand: SymbolDemand, socket_path: str):
+        self.demand = demand
+        self.socket_path = socket_path
+        self.dropped = 0
+        self._workers: dict[asyncio.StreamWriter, set[str]] = {}
+
+    async def serve(self):
+        # Holding the lock means any socket file left behind is from a dead leader
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_worker, path=self.socket_path)
+        logger.info(f"Price feed leader (pid {os.getpid()}) serving {self.socket_path}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        symbols: set[str] = set()
+        self._workers[writer] = symbols
+        try:
+            async for raw in reader:
+                line = raw.decode().strip()
+                if not line:
+                    continue
+                op, names = line[0], [n for n in line[1:].split(",") if n]
+                for symbol in names:
+                    if op == "+" and symbol not in symbols:
+                        symbols.add(symbol)
+                        self.demand.symbol_added(symbol)
+                    elif op == "-" and symbol in symbols:
+                        symbols.discard(symbol)
+                        self.demand.symbol_removed(symbol)
+        except ConnectionError:
+            pass
+        finally:
+            del self._workers[writer]
+            for symbol in symbols:
+                self.demand.symbol_removed(symbol)
+            writer.close()
+
+    def publish(self, updates: dict[str, str]):
+        manager.publish_updates(updates)
+        for writer, symbols in self._workers.items():
+            lines = [f"{symbol}\t{payload}\n" for symbol, payload in updates.items() if symbol in symbols]
+            if not lines:
+                continue
+            # Ticks are superseded by the next one — drop rather than buffer for a stuck worker
+            if writer.transport.get_write_buffer_size() > PRICE_FEED_MAX_BUFFER:
+                self.dropped += 1
+                continue
+            writer.write("".join(lines).encode())
+
+
+class FeedFollower:
+    """
+    A worker without the lock: forwards its clients' symbol demand to the leader
+    and relays the leader's ticks into the local ConnectionManager.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._writer: asyncio.StreamWriter | None = None
+
+    def symbol_added(self, symbol: str):
+        if self._writer is not None:
+            self._writer.write(f"+{symbol}\n".encode())
+
+    def symbol_removed(self, symbol: str):
+        if self._writer is not None:
+            self._writer.write(f"-{symbol}\n".encode())
+
+    async def run(self):
+        """Relay ticks until the leader goes away."""
+        reader, writer = await asyncio.open_unix_connection(path=self.socket_path)
+        self._writer = writer
+        logger.info(f"Price feed follower (pid {os.getpid()}) attached to {self.socket_path}")
+        try:
+            symbols = list(manager.symbol_subscribers)
+            if symbols:
+                writer.write(("+" + ",".join(symbols) + "\n").encode())
+            async for raw in reader:
+                symbol, _, payload = raw.decode().rstrip("\n").partition("\t")
+                if payload:
+                    manager.publish_updates({symbol: payload})
+                    # Bars are built per worker, from the same ticks the leader relays
+                    update = json.loads(payload)
+                    record_ticks({symbol: (update["price"], update.get("size", 0))})
+        finally:
+            self._writer = None
+            writer.close()
+
+
+async def run_price_feed():
+    """
+    Entry point started by main. In "local" mode every worker runs its own feed.
+    In "shared" mode workers race for a host-wide lock: the winner runs the only
+    upstream feed and serves the rest, the others follow it and retry the
+    election whenever the leader disappears.
+    """
+    demand = SymbolDemand()
+    manager.symbol_listeners.append(demand)
+    for symbol in manager.symbol_subscribers:
+        demand.symbol_added(symbol)
+
+    if PRICE_FEED_MODE != "shared":
+        await market_data_feed(demand, manager.publish_updates)
+        return
+
+    while True:
+        lock_fd = _try_acquire_leadership(PRICE_FEED_LOCK)
+        if lock_fd is not None:
+            leader = FeedLeader(demand, PRICE_FEED_SOCKET)
+            tasks = [
+                asyncio.create_task(leader.serve()),
+                asyncio.create_task(market_data_feed(demand, leader.publish)),
+            ]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception():
+                        logger.error(f"Price feed leader stopped: {task.exception()}")
+            finally:
+                for task in tasks:
+                    task.cancel()
+                os.close(lock_fd)
+            await asyncio.sleep(1)
+            continue
+
+        follower = FeedFollower(PRICE_FEED_SOCKET)
+        manager.symbol_listeners.append(follower)
+        try:
+            await follower.run()
+            logger.warning("Price feed leader went away")
+        except OSError as e:
+            logger.info(f"Price feed leader not reachable yet: {e}")
+        finally:
+            manager.symbol_listeners.remove(follower)
+        await asyncio.sleep(0.5 + random.random())
@@ -0,0 +1,272 @@
+# quote_cache.py - Process-wide latest-price cache for Clau Trading Backend, with TTL, LRU eviction and single-flight loading.
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from decimal import Decimal
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteCache:
+    """
+    Bounded LRU cache of symbol -> latest price.
+
+    - Entries younger than `ttl` are served directly (hit).
+    - Entries younger than `ttl + stale_ttl` are served immediately while one
+      background refresh runs (stale-while-revalidate). If that refresh fails or
+      is slow, callers keep getting the stale value until the window closes.
+    - Misses are coalesced: concurrent callers for the same symbol wait on the
+      same in-flight load, so N misses cost one upstream request.
+
+    `loader(symbol)` must start the upstream fetch and return a Future that
+    resolves to a Decimal price, or None if the symbol could not be priced.
+    `batch_loader(symbols)`, if given, does the same for a list of symbols and
+    resolves to {symbol: price}; `get_many` uses it in chunks of `batch_size`.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Future],
+        ttl: float,
+        stale_ttl: float,
+        max_size: int,
+        wait_timeout: float,
+        batch_loader: Callable[[list[str]], Future] | None = None,
+        batch_size: int = 100,
+    ):
+        self._loader = loader
+        self._batch_loader = batch_loader
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+
+        self._entries: "OrderedDict[str, tuple[Decimal, float]]" = OrderedDict()
+        self._inflight: dict[str, Future] = {}
+        # Re-entrant: a loader may hand back an already-completed future, in which
+        # case its done-callback runs synchronously while we still hold the lock.
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def get(self, symbol: str, allow_stale: bool = True) -> Decimal | None:
+        """Return the price for `symbol`, loading it upstream on a miss."""
+        price, future = self._lookup(symbol, allow_stale)
+        if future is None:
+            return price
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except Exception as e:
+            logger.warning(f"Quote load for {symbol} failed or timed out: {e}")
+            return None
+
+    def get_many(self, symbols: list[str], allow_stale: bool = True) -> dict[str, Decimal]:
+        """
+        Return {symbol: price} for every symbol that could be priced.
+        Misses and stale entries are loaded together in chunked batch requests.
+        """
+        prices, waiting = self._lookup_many(symbols, allow_stale)
+        deadline = time.monotonic() + self.wait_timeout
+        for symbol, future in waiting.items():
+            try:
+                price = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                logger.warning(f"Quote load for {symbol} failed or timed out: {e}")
+                continue
+            if price is not None:
+                prices[symbol] = price
+        return prices
+
+    async def aget(self, symbol: str, allow_stale: bool = True) -> Decimal | None:
+        """Async form of `get` — waits on the load without blocking the event loop."""
+        price, future = self._lookup(symbol, allow_stale)
+        if future is None:
+            return price
+        try:
+            # Shielded: a timed-out waiter must not cancel the load other callers share
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.wait_timeout)
+        except Exception as e:
+            logger.warning(f"Quote load for {symbol} failed or timed out: {e}")
+            return None
+
+    async def aget_many(self, symbols: list[str], allow_stale: bool = True) -> dict[str, Decimal]:
+        """Async form of `get_many`."""
+        prices, waiting = self._lookup_many(symbols, allow_stale)
+        if not waiting:
+            return prices
+        wrapped = {symbol: asyncio.wrap_future(future) for symbol, future in waiting.items()}
+        done, _ = await asyncio.wait(wrapped.values(), timeout=self.wait_timeout)
+        for symbol, task in wrapped.items():
+            if task in done and task.exception() is None and task.result() is not None:
+                prices[symbol] = task.result()
+        return prices
+
+    def _lookup_many(
+        self, symbols: list[str], allow_stale: bool
+    ) -> tuple[dict[str, Decimal], dict[str, Future]]:
+        now = time.monotonic()
+        prices: dict[str, Decimal] = {}
+        waiting: dict[str, Future] = {}
+        to_load: list[str] = []
+        with self._lock:
+            for symbol in dict.fromkeys(symbols):
+                entry = self._entries.get(symbol)
+                if entry is not None:
+                    price, fetched_at = entry
+                    age = now - fetched_at
+                    if age < self.ttl:
+                        self._entries.move_to_end(symbol)
+                        self.hits += 1
+                        prices[symbol] = price
+                        continue
+                    if allow_stale and age < self.ttl + self.stale_ttl:
+                        self._entries.move_to_end(symbol)
+                        self.stale_hits += 1
+                        prices[symbol] = price
+                        if symbol not in self._inflight:
+                            to_load.append(symbol)
+                        continue
+
+                self.misses += 1
+                future = self._inflight.get(symbol)
+                if future is not None:
+                    self.coalesced += 1
+                    waiting[symbol] = future
+                else:
+                    to_load.append(symbol)
+
+            started = self._start_batch_load(to_load)
+            for symbol, future in started.items():
+                if symbol not in prices:
+                    waiting[symbol] = future
+        return prices, waiting
+
+    def _lookup(self, symbol: str, allow_stale: bool) -> tuple[Decimal | None, Future | None]:
+        """Return (price, None) when the cache can answer, else (None, future to wait on)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None:
+                price, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(symbol)
+                    self.hits += 1
+                    return price, None
+                if allow_stale and age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(symbol)
+                    self.stale_hits += 1
+                    self._start_load(symbol)
+                    return price, None
+
+            self.misses += 1
+            if symbol in self._inflight:
+                self.coalesced += 1
+            return None, self._start_load(symbol)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def put(self, symbol: str, price: Decimal):
+        """Store a price obtained elsewhere (e.g. a batched fetch or a stream)."""
+        with self._lock:
+            self._entries[symbol] = (price, time.monotonic())
+            self._entries.move_to_end(symbol)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _start_load(self, symbol: str) -> Future:
+        """Start (or join) the single in-flight load for `symbol`. Caller holds the lock."""
+        future = self._inflight.get(symbol)
+        if future is not None:
+            return future
+        future = self._loader(symbol)
+        self._inflight[symbol] = future
+        future.add_done_callback(lambda f, s=symbol: self._on_loaded(s, f))
+        return future
+
+    def _start_batch_load(self, symbols: list[str]) -> dict[str, Future]:
+        """Start loads for `symbols`, one batch request per chunk. Caller holds the lock."""
+        if self._batch_loader is None:
+            return {symbol: self._start_load(symbol) for symbol in symbols}
+
+        started: dict[str, Future] = {}
+        for i in range(0, len(symbols), self.batch_size):
+            chunk = symbols[i:i + self.batch_size]
+            futures = {}
+            for symbol in chunk:
+                future = Future()
+                self._inflight[symbol] = future
+                future.add_done_callback(lambda f, s=symbol: self._on_loaded(s, f))
+                futures[symbol] = future
+            started.update(futures)
+
+            def resolve(batch_future: Future, futures=futures):
+                try:
+                    result = batch_future.result() or {}
+                except Exception as e:
+                    logger.error(f"Batched quote load failed: {e}")
+                    result = {}
+                for symbol, future in futures.items():
+                    future.set_result(result.get(symbol))
+
+            try:
+                batch = self._batch_loader(chunk)
+            except Exception as e:
+                # Never submitted (e.g. the pool's loop is gone): fail the chunk now, or its
+                # in-flight entries would strand every later caller until their timeout
+                logger.error(f"Batched quote load could not start: {e}")
+                for future in futures.values():
+                    future.set_exception(e)
+                continue
+            batch.add_done_callback(resolve)
+        return started
+
+    def _on_loaded(self, symbol: str, future: Future):
+        try:
+            price = future.result()
+        except Exception as e:
+            logger.error(f"Error loading quote for {symbol}: {e}")
+            price = None
+
+        with self._lock:
+            if self._inflight.get(symbol) is future:
+                del self._inflight[symbol]
+            if price is None:
+                self.errors += 1
+                return
+            self.put(symbol, price)
+
+    # ------------------------------------------------------------------
+    # Introspection
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "inflight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale_hits,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+            }
@@ -0,0 +1,46 @@
+# rate_limit.py - Request rate limiting for Clau Trading Backend: slowapi limits keyed by user or IP, with counters in a shared store.
+from fastapi import Request
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from auth_utils import verify_access_token
+from config import RATE_LIMIT_ENABLED, RATE_LIMIT_STORAGE_URI, RATE_LIMIT_STORAGE_TIMEOUT, RATE_LIMIT_STRATEGY
+
+
+def rate_limit_key(request: Request) -> str:
+    """
+    Bucket per authenticated user, so users behind one carrier NAT don't share
+    a limit; per client IP for anonymous requests (login, signup) and bad tokens.
+    Tokens are verified through the same cache as get_current_user_id.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{verify_access_token(token)}"
+        except ValueError:
+            pass
+    return f"ip:{get_remote_address(request)}"
+
+
+class FailOpenLimiter(Limiter):
+    """
+    With swallow_errors, slowapi lets a request through when the store can't be
+    reached, but then trips over the rate-limit state it never recorded for
+    that request. Recording "no limit applied" up front makes the failure open.
+    """
+
+    def _check_request_limit(self, request: Request, endpoint_func, in_middleware: bool = True):
+        request.state.view_rate_limit = None
+        super()._check_request_limit(request, endpoint_func, in_middleware)
+
+
+# One counter update per check (a single script call on Redis); a store that is
+# down or slower than RATE_LIMIT_STORAGE_TIMEOUT skips the check
+limiter = FailOpenLimiter(
+    key_func=rate_limit_key,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    storage_options={"socket_connect_timeout": RATE_LIMIT_STORAGE_TIMEOUT, "socket_timeout": RATE_LIMIT_STORAGE_TIMEOUT},
+    strategy=RATE_LIMIT_STRATEGY,
+    swallow_errors=True,
+    enabled=RATE_LIMIT_ENABLED,
+)
@@ -0,0 +1,214 @@
+# reconcile.py - Bulk reconciliation of local positions against Alpaca for Clau Trading Backend.
+# Walks every connected user in chunks, fetches their broker positions with a
+# bounded fan-out, and writes every discrepancy to an NDJSON report. With
+# --apply, local positions are corrected to match the broker.
+#
+#   python reconcile.py                       # report only
+#   python reconcile.py --apply --report drift.ndjson
+#
+# Runs as its own process, so its HTTP pool and DB connections are separate
+# from the API's; --concurrency bounds how hard it leans on Alpaca.
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import delete, select, update
+
+from alpaca_client import get_positions_async
+from config import RECONCILE_CHUNK_SIZE, RECONCILE_CONCURRENCY, RECONCILE_TOLERANCE
+from crypto_utils import decrypt_token
+from database import AsyncSessionLocal, async_engine
+from http_client import http_pool
+from models import AlpacaToken, Position, Trade
+import auth_models  # noqa: F401  (User, for the foreign keys)
+from tradin_service import _insert
+
+
+# Checked in order, so "ETHUSDT" splits as ETH/USDT rather than ETHUSD/T
+CRYPTO_QUOTE_CURRENCIES = ("USDT", "USDC", "USD", "BTC")
+
+
+def _key(symbol: str) -> str:
+    # Alpaca reports crypto positions without the slash ("BTCUSD" for "BTC/USD")
+    return symbol.replace("/", "").upper()
+
+
+def _app_symbol(position: dict) -> str:
+    """A broker position's symbol as the app trades it: crypto pairs get their slash back."""
+    symbol = position["symbol"]
+    if position.get("asset_class") != "crypto" or "/" in symbol:
+        return symbol
+    for quote in CRYPTO_QUOTE_CURRENCIES:
+        if symbol.endswith(quote) and len(symbol) > len(quote):
+            return f"{symbol[:-len(quote)]}/{quote}"
+    return symbol
+
+
+async def _chunks(size: int):
+    """(user_id, access_token) for every connected user, `size` at a time, by user_id."""
+    after = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(AlpacaToken.user_id, AlpacaToken.access_token)
+                .where(AlpacaToken.user_id > after)
+                .order_by(AlpacaToken.user_id)
+                .limit(size)
+            )).all()
+        if not rows:
+            return
+        after = rows[-1][0]
+        yield [(user_id, decrypt_token(token)) for user_id, token in rows]
+
+
+async def _local_state(user_ids: list[int]):
+    """Positions and symbols with unsettled trades for a chunk of users, in two queries."""
+    async with AsyncSessionLocal() as db:
+        positions = (await db.execute(
+            select(Position.user_id, Position.symbol, Position.quantity).where(Position.user_id.in_(user_ids))
+        )).all()
+        unsettled = (await db.execute(
+            select(Trade.user_id, Trade.symbol)
+            .where(Trade.user_id.in_(user_ids), Trade.settled.is_(False))
+            .distinct()
+        )).all()
+    local: dict[int, dict[str, tuple[str, Decimal]]] = {}
+    for user_id, symbol, qty in positions:
+        local.setdefault(user_id, {})[_key(symbol)] = (symbol, qty)
+    pending = {(user_id, _key(symbol)) for user_id, symbol in unsettled}
+    return local, pending
+
+
+async def _broker_positions(users: list[tuple[int, str]], semaphore: asyncio.Semaphore) -> dict[int, list | Exception | None]:
+    async def fetch(token: str):
+        async with semaphore:
+            return await get_positions_async(token)
+
+    results = await asyncio.gather(*(fetch(token) for _, token in users), return_exceptions=True)
+    return {user_id: result for (user_id, _), result in zip(users, results)}
+
+
+def diff_user(user_id: int, local: dict, broker: list[dict], pending: set, tolerance: Decimal) -> list[dict]:
+    """One user's discrepancies. Symbols with unsettled trades are expected to differ and are skipped."""
+    found = []
+    remote = {_key(p["symbol"]): p for p in broker}
+    for key in local.keys() | remote.keys():
+        if (user_id, key) in pending:
+            continue
+        symbol, local_qty = local.get(key, (None, Decimal("0")))
+        position = remote.get(key)
+        broker_qty = Decimal(str(position["qty"])) if position else Decimal("0")
+        if abs(local_qty - broker_qty) <= tolerance:
+            continue
+        kind = "missing_local" if symbol is None else "missing_broker" if position is None else "quantity"
+        found.append({
+            "user_id": user_id,
+            "symbol": symbol or _app_symbol(position),
+            "kind": kind,
+            "local_qty": str(local_qty),
+            "broker_qty": str(broker_qty),
+            "broker_avg_price": position.get("avg_entry_price") if position else None,
+        })
+    return found
+
+
+async def apply_corrections(discrepancies: list[dict]) -> int:
+    """
+    Set each local position to the broker's quantity, in one transaction per
+    chunk; returns how many were applied. Each symbol is re-checked for
+    unsettled trades, and each write is a compare-and-set on the quantity the
+    diff saw. A row that fails either check changed under us: it is skipped
+    and left for the next run.
+    """
+    applied = 0
+    if not discrepancies:
+        return applied
+    async with AsyncSessionLocal() as db:
+        for d in discrepancies:
+            user_id, symbol = d["user_id"], d["symbol"]
+            unsettled = (await db.scalars(
+                select(Trade.symbol).where(Trade.user_id == user_id, Trade.settled.is_(False)).distinct()
+            )).all()
+            if _key(symbol) in {_key(s) for s in unsettled}:
+                continue
+            local_qty, broker_qty = Decimal(d["local_qty"]), Decimal(d["broker_qty"])
+            same = (Position.user_id == user_id, Position.symbol == symbol, Position.quantity == local_qty)
+            if d["kind"] == "missing_local":
+                stmt = _insert(db)(Position).values(
+                    user_id=user_id, symbol=symbol, quantity=broker_qty, avg_price=Decimal(str(d["broker_avg_price"]))
+                ).on_conflict_do_nothing(index_elements=[Position.user_id, Position.symbol])
+            elif broker_qty <= 0:
+                stmt = delete(Position).where(*same)
+            else:
+                stmt = update(Position).where(*same).values(quantity=broker_qty)  # keep our cost basis
+            applied += (await db.execute(stmt)).rowcount
+        await db.commit()
+    return applied
+
+
+async def run(report, apply: bool, chunk_size: int, concurrency: int, tolerance: Decimal):
+    semaphore = asyncio.Semaphore(concurrency)
+    users = drifted = failed = corrected = skipped = 0
+    started = time.monotonic()
+    try:
+        async for chunk in _chunks(chunk_size):
+            user_ids = [user_id for user_id, _ in chunk]
+            (local, pending), broker = await asyncio.gather(
+                _local_state(user_ids), _broker_positions(chunk, semaphore)
+            )
+
+            found = []
+            for user_id in user_ids:
+                result = broker[user_id]
+                if result is None or isinstance(result, Exception):
+                    failed += 1
+                    error = "request failed" if result is None else str(result) or repr(result)
+                    report.write(json.dumps({"user_id": user_id, "kind": "error", "error": error}) + "\n")
+                    continue
+                found.extend(diff_user(user_id, local.get(user_id, {}), result, pending, tolerance))
+
+            for d in found:
+                report.write(json.dumps(d) + "\n")
+            drifted += len({d["user_id"] for d in found})
+            if apply:
+                applied = await apply_corrections(found)
+                corrected += applied
+                skipped += len(found) - applied
+            users += len(chunk)
+            print(f"  {users} users · {drifted} with drift · {failed} failed · {time.monotonic() - started:.0f}s", file=sys.stderr)
+    finally:
+        http_pool.close()
+        await async_engine.dispose()
+
+    print(
+        f"\n{users} users checked · {drifted} with drift · {corrected} positions corrected"
+        f" ({skipped} changed since read, skipped) · {failed} failed",
+        file=sys.stderr,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile local positions against Alpaca")
+    parser.add_argument("--report", default=None, help="NDJSON report path (default: reconcile-<utc timestamp>.ndjson, '-' for stdout)")
+    parser.add_argument("--apply", action="store_true", help="correct local positions to the broker's quantities")
+    parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    parser.add_argument("--tolerance", default=RECONCILE_TOLERANCE)
+    args = parser.parse_args()
+
+    path = args.report or f"reconcile-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.ndjson"
+    report = sys.stdout if path == "-" else open(path, "w")
+    try:
+        asyncio.run(run(report, args.apply, args.chunk_size, args.concurrency, Decimal(args.tolerance)))
+    finally:
+        if report is not sys.stdout:
+            report.close()
+            print(f"Report written to {path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# reference_data.py - Per-session reference prices (previous close, today's open/high/low) for Clau Trading Backend, loaded once per trading day from daily bars.
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from alpaca_client import get_daily_bars_async
+from config import REFERENCE_LOOKBACK_DAYS, REFERENCE_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+BarFetcher = Callable[[list[str], date], Awaitable[dict[str, list[dict]]]]
+
+
+@dataclass
+class SessionReference:
+    session_date: date
+    previous_close: Decimal | None
+    open: Decimal | None
+    high: Decimal | None
+    low: Decimal | None
+
+
+def current_session_date() -> date:
+    return datetime.now(MARKET_TZ).date()
+
+
+def _bar_date(bar: dict) -> date:
+    # Daily bar timestamps are midnight New York time, expressed in UTC
+    return datetime.fromisoformat(bar["t"].replace("Z", "+00:00")).astimezone(MARKET_TZ).date()
+
+
+def _price(value) -> Decimal:
+    return Decimal(str(value))
+
+
+def reference_from_bars(bars: list[dict], session: date) -> SessionReference | None:
+    """Previous close from the last bar before `session`; open/high/low from the session's own bar, if any."""
+    dated = sorted(((_bar_date(b), b) for b in bars), key=lambda item: item[0])
+    prior = [b for d, b in dated if d < session]
+    today = next((b for d, b in dated if d == session), None)
+    if not prior and today is None:
+        return None
+    return SessionReference(
+        session_date=session,
+        previous_close=_price(prior[-1]["c"]) if prior else None,
+        open=_price(today["o"]) if today else None,
+        high=_price(today["h"]) if today else None,
+        low=_price(today["l"]) if today else None,
+    )
+
+
+class ReferenceDataStore:
+    """
+    In-memory reference data for the current trading session.
+
+    Symbols are loaded on first use in one batched daily-bars request (concurrent
+    requests for the same symbols share the load) and kept until the session date
+    rolls over. Symbols with no daily bars (crypto, new listings) are remembered
+    as such for the session too, so they aren't refetched on every request.
+    Intraday high/low are kept current from observed prices and by a
+    periodic refresh that fetches only today's bar for the loaded symbols.
+    """
+
+    def __init__(self, fetch_bars: BarFetcher, lookback_days: int):
+        self._fetch_bars = fetch_bars
+        self.lookback_days = lookback_days
+        self._session: date | None = None
+        self._refs: dict[str, SessionReference] = {}
+        self._no_bars: set[str] = set()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def _roll_session(self):
+        today = current_session_date()
+        if today != self._session:
+            if self._session is not None:
+                logger.info(f"Reference data: new session {today}, dropping {len(self._refs)} symbols")
+            self._session = today
+            self._refs.clear()
+            self._no_bars.clear()
+
+    async def get(self, symbol: str) -> SessionReference | None:
+        return (await self.get_many([symbol])).get(symbol)
+
+    async def get_many(self, symbols: list[str]) -> dict[str, SessionReference]:
+        self._roll_session()
+        symbols = list(dict.fromkeys(s.upper() for s in symbols))
+        missing = [s for s in symbols if s not in self._refs and s not in self._no_bars and s not in self._inflight]
+        if missing:
+            task = asyncio.ensure_future(self._load(missing, self._session))
+            for symbol in missing:
+                self._inflight[symbol] = task
+
+        waiting = {self._inflight[s] for s in symbols if s in self._inflight}
+        if waiting:
+            await asyncio.gather(*(asyncio.shield(t) for t in waiting), return_exceptions=True)
+        return {s: self._refs[s] for s in symbols if s in self._refs}
+
+    async def _load(self, symbols: list[str], session: date):
+        try:
+            bars = await self._fetch_bars(symbols, session - timedelta(days=self.lookback_days))
+            if session != self._session:
+                return  # the session rolled over while we were fetching
+            for symbol in symbols:
+                ref = reference_from_bars(bars.get(symbol, []), session)
+                if ref is not None:
+                    self._refs[symbol] = ref
+                else:
+                    self._no_bars.add(symbol)
+        except Exception as e:
+            logger.error(f"Error loading reference data for {len(symbols)} symbols: {e}")
+        finally:
+            for symbol in symbols:
+                self._inflight.pop(symbol, None)
+
+    def observe(self, symbol: str, price: Decimal):
+        """Fold a live price into today's open/high/low."""
+        ref = self._refs.get(symbol)
+        if ref is None or ref.session_date != self._session:
+            return
+        if ref.open is None:
+            ref.open = price
+        ref.high = price if ref.high is None else max(ref.high, price)
+        ref.low = price if ref.low is None else min(ref.low, price)
+
+    async def refresh_today(self):
+        """Incremental refresh: re-read only today's bar for the symbols already loaded."""
+        self._roll_session()
+        session = self._session
+        symbols = [*self._refs, *self._no_bars]
+        if not symbols:
+            return
+        bars = await self._fetch_bars(symbols, session)
+        if session != self._session:
+            return
+        for symbol, rows in bars.items():
+            ref = self._refs.get(symbol)
+            today = next((b for b in rows if _bar_date(b) == session), None)
+            if today is None:
+                continue
+            if ref is None:
+                # First bar for a symbol that had none when loaded
+                if symbol in self._no_bars:
+                    self._refs[symbol] = reference_from_bars([today], session)
+                    self._no_bars.discard(symbol)
+                continue
+            if ref.open is None:
+                ref.open = _price(today["o"])
+            ref.high = max(filter(None, (ref.high, _price(today["h"]))))
+            ref.low = min(filter(None, (ref.low, _price(today["l"]))))
+
+    async def run(self, universe: Callable[[], Awaitable[list[str]]]):
+        """Background task: preload the active symbol universe, then refresh incrementally."""
+        while True:
+            try:
+                await self.get_many(await universe())
+                await self.refresh_today()
+            except Exception as e:
+                logger.error(f"Error refreshing reference data: {e}")
+            await asyncio.sleep(REFERENCE_REFRESH_INTERVAL)
+
+
+reference_store = ReferenceDataStore(get_daily_bars_async, lookback_days=REFERENCE_LOOKBACK_DAYS)
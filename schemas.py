@@ -1,8 +1,11 @@
 # schemas.py - Pydantic schemas for request and response models in Clau Trading Backend.
 from pydantic import BaseModel, Field
-from typing import List, Literal
+from datetime import datetime
+from typing import List, Literal, Optional
 import re
 
+from config import TRADE_BATCH_MAX_LEGS
+
 class DepositRequest(BaseModel):
     amount: float = Field(gt=0, le=100000, description="Amount to deposit in USD")
 
@@ -21,14 +24,70 @@ class TradeRequest(BaseModel):
     amount: float = Field(gt=0, le=1000000, description="Dollar amount to invest")
     side: Literal["buy", "sell"]
 
+class BatchTradeRequest(BaseModel):
+    legs: List[TradeRequest] = Field(min_length=1, max_length=TRADE_BATCH_MAX_LEGS)
+
+class TradeLegResult(BaseModel):
+    symbol: str
+    side: str
+    amount: float
+    status: Literal["submitted", "rejected", "failed"]
+    qty: Optional[float] = None
+    price: Optional[float] = None
+    order_id: Optional[str] = None
+    order_status: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchTradeResponse(BaseModel):
+    balance: float
+    legs: List[TradeLegResult]
+
 class WalletResponse(BaseModel):
     balance: float
 
+class TradeSubmittedResponse(BaseModel):
+    balance: float
+    trade_id: int
+    order_id: Optional[str] = None
+    # Alpaca's status at submission; the fill is applied once the order completes
+    status: Optional[str] = None
+    qty: float
+    price: float  # the quote the order was sized on, until the fill price replaces it
+
 class PositionResponse(BaseModel):
     symbol: str
     quantity: float
     avg_price: float
+    # Filled only when the portfolio is requested with valuation=true
+    market_price: Optional[float] = None
+    market_value: Optional[float] = None
+    unrealized_pl: Optional[float] = None
+    unrealized_pl_percent: Optional[float] = None
 
 class PortfolioResponse(BaseModel):
     balance: float
     positions: List[PositionResponse]
+    # Totals over the positions that could be priced (valuation=true only)
+    market_value: Optional[float] = None
+    cost_basis: Optional[float] = None
+    unrealized_pl: Optional[float] = None
+    unrealized_pl_percent: Optional[float] = None
+
+class TradeResponse(BaseModel):
+    id: int
+    symbol: str
+    side: str
+    qty: float
+    price: float
+    status: Optional[str] = None
+    order_id: Optional[str] = None
+    created_at: datetime
+    settled: bool = True
+    filled_qty: Optional[float] = None
+    filled_at: Optional[datetime] = None
+    needs_review: bool = False
+
+class TradeHistoryResponse(BaseModel):
+    trades: List[TradeResponse]
+    # Pass back as ?cursor= for the next (older) page; null on the last page
+    next_cursor: Optional[str] = None
@@ -1,21 +1,25 @@
 # stripe_service.py - Stripe payment processing for Clau Trading Backend.
 import logging
 import stripe
-from config import STRIPE_SECRET_KEY
+import metrics
+from config import STRIPE_API_BASE, STRIPE_SECRET_KEY
 
 logger = logging.getLogger(__name__)
 stripe.api_key = STRIPE_SECRET_KEY
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
 
 def create_payment_intent(amount: float, currency: str = "usd") -> dict:
     """
     Create a Stripe payment intent.
     """
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=int(amount * 100),  # dollars -> cents
-            currency=currency,
-            payment_method_types=["card"],  # explicit
-        )
+        with metrics.track_upstream("stripe", "payment_intent.create"):
+            intent = stripe.PaymentIntent.create(
+                amount=int(amount * 100),  # dollars -> cents
+                currency=currency,
+                payment_method_types=["card"],  # explicit
+            )
         
         return {
             "client_secret": intent.client_secret,
@@ -34,10 +38,11 @@ def confirm_payment(payment_intent_id: str, payment_method_id: str) -> dict:
     The payment_method_id is obtained from Stripe.js / Stripe SDK on the client.
     """
     try:
-        intent = stripe.PaymentIntent.confirm(
-            payment_intent_id,
-            payment_method=payment_method_id,
-        )
+        with metrics.track_upstream("stripe", "payment_intent.confirm"):
+            intent = stripe.PaymentIntent.confirm(
+                payment_intent_id,
+                payment_method=payment_method_id,
+            )
         return {
             "status": intent.status,
             "amount": intent.amount / 100,
@@ -54,15 +59,16 @@ def create_connected_account(email: str) -> dict:
     Create a Stripe connected account for a user (TEST MODE).
     """
     try:
-        account = stripe.Account.create(
-            type="express",
-            country="US",
-            email=email,
-            capabilities={
-                "transfers": {"requested": True},
-            },
-            business_type="individual",
-        )
+        with metrics.track_upstream("stripe", "account.create"):
+            account = stripe.Account.create(
+                type="express",
+                country="US",
+                email=email,
+                capabilities={
+                    "transfers": {"requested": True},
+                },
+                business_type="individual",
+            )
 
         return {
             "account_id": account.id,
@@ -82,22 +88,24 @@ def attach_test_bank_account(stripe_account_id: str) -> dict:
     """
     try:
         # Create a test bank token
-        bank_token = stripe.Token.create(
-            bank_account={
-                "country": "US",
-                "currency": "usd",
-                "account_holder_name": "Test User",
-                "account_holder_type": "individual",
-                "routing_number": "110000000",
-                "account_number": "000123456789",
-            }
-        )
+        with metrics.track_upstream("stripe", "token.create"):
+            bank_token = stripe.Token.create(
+                bank_account={
+                    "country": "US",
+                    "currency": "usd",
+                    "account_holder_name": "Test User",
+                    "account_holder_type": "individual",
+                    "routing_number": "110000000",
+                    "account_number": "000123456789",
+                }
+            )
 
         # Attach token as external account to connected account
-        external = stripe.Account.create_external_account(
-            stripe_account_id,
-            external_account=bank_token.id,
-        )
+        with metrics.track_upstream("stripe", "account.create_external_account"):
+            external = stripe.Account.create_external_account(
+                stripe_account_id,
+                external_account=bank_token.id,
+            )
 
         return {
             "external_account_id": external.id,
@@ -115,10 +123,11 @@ def fund_test_account(stripe_account_id: str, amount: float) -> dict:
     """
     try:
         logger.info("Funding connected account: %s", stripe_account_id)
-        stripe.TestHelpers.Fund.create(
-            destination_account=stripe_account_id,
-            amount=int(amount * 100),  # dollars -> cents
-        )
+        with metrics.track_upstream("stripe", "test_helpers.fund.create"):
+            stripe.TestHelpers.Fund.create(
+                destination_account=stripe_account_id,
+                amount=int(amount * 100),  # dollars -> cents
+            )
         
         return {
             "status": "funded",
@@ -136,12 +145,13 @@ def create_payout_to_user(stripe_account_id: str, amount: float, currency: str =
     Create a payout from the user's connected account to their bank.
     """
     try:
-        payout = stripe.Payout.create(
-            amount=int(amount * 100),  # dollars -> cents
-            currency=currency,
-            method="standard",
-            stripe_account=stripe_account_id,
-        )
+        with metrics.track_upstream("stripe", "payout.create"):
+            payout = stripe.Payout.create(
+                amount=int(amount * 100),  # dollars -> cents
+                currency=currency,
+                method="standard",
+                stripe_account=stripe_account_id,
+            )
 
         return {
             "payout_id": payout.id,
@@ -166,7 +176,8 @@ def create_refund(payment_intent_id: str, amount: float = None) -> dict:
         if amount:
             refund_data["amount"] = int(amount * 100)
         
-        refund = stripe.Refund.create(**refund_data)
+        with metrics.track_upstream("stripe", "refund.create"):
+            refund = stripe.Refund.create(**refund_data)
         return {
             "refund_id": refund.id,
             "status": refund.status,
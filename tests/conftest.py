@@ -0,0 +1,51 @@
+# conftest.py - Shared test setup for Clau Trading Backend: throwaway settings and a fresh SQLite database per test.
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+from cryptography.fernet import Fernet
+
+# config.py validates these at import, so they are set before any app module loads
+_workdir = tempfile.mkdtemp(prefix="clau-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_workdir}/test.db",
+    "ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{_workdir}/test.db",
+    "JWT_SECRET_KEY": "test",
+    "TOKEN_ENCRYPTION_KEY": Fernet.generate_key().decode(),
+    "ALPACA_API_KEY": "test",
+    "ALPACA_SECRET_KEY": "test",
+    "STRIPE_SECRET_KEY": "sk_test",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import auth_models  # noqa: E402,F401  (registers users for the foreign keys)
+from auth_models import User  # noqa: E402
+from database import AsyncSessionLocal, Base, async_engine  # noqa: E402
+from models import Wallet  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        yield session
+    await async_engine.dispose()  # connections are bound to this test's event loop
+
+
+@pytest.fixture
+async def user_id(db) -> int:
+    user = User(username="trader", password_hash="x")
+    db.add(user)
+    await db.flush()
+    db.add(Wallet(user_id=user.id, balance=0))
+    await db.commit()
+    return user.id
@@ -0,0 +1,60 @@
+# test_execute_trade.py - Order submission: no DB connection is held while the order is out at Alpaca.
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+import tradin_service
+from models import Position, Wallet
+from tradin_service import execute_trade
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def alpaca(monkeypatch, db):
+    calls = []
+
+    async def token(session, user_id):
+        return "token"
+
+    async def quote(symbol, allow_stale=True):
+        return Decimal("100")
+
+    async def place(symbol, qty, side, access_token):
+        calls.append({"symbol": symbol, "side": side, "in_transaction": db.in_transaction()})
+        return {"id": f"order-{len(calls)}", "status": "accepted"}
+
+    monkeypatch.setattr(tradin_service.alpaca_tokens, "aget", token)
+    monkeypatch.setattr(tradin_service, "get_quote_async", quote)
+    monkeypatch.setattr(tradin_service, "place_market_order_async", place)
+    return calls
+
+
+async def test_buy_reserves_cash_then_submits_outside_a_transaction(db, user_id, alpaca):
+    wallet = await db.scalar(select(Wallet).where(Wallet.user_id == user_id))
+    wallet.balance = Decimal("500")
+    await db.commit()
+
+    balance, trade = await execute_trade(db, user_id, "aapl", 200, "buy")
+    assert balance == Decimal("300")
+    assert trade.settled is False and trade.reserved_amount == Decimal("200")
+    assert alpaca == [{"symbol": "AAPL", "side": "buy", "in_transaction": False}]
+
+
+async def test_sell_validates_then_submits_outside_a_transaction(db, user_id, alpaca):
+    db.add(Position(user_id=user_id, symbol="AAPL", quantity=Decimal("5"), avg_price=Decimal("90")))
+    await db.commit()
+
+    _, trade = await execute_trade(db, user_id, "AAPL", 200, "sell")
+    assert trade.qty == Decimal("2") and trade.settled is False
+    assert alpaca == [{"symbol": "AAPL", "side": "sell", "in_transaction": False}]
+
+
+async def test_sell_beyond_the_position_is_rejected_before_submitting(db, user_id, alpaca):
+    db.add(Position(user_id=user_id, symbol="AAPL", quantity=Decimal("1"), avg_price=Decimal("90")))
+    await db.commit()
+
+    with pytest.raises(ValueError, match="Insufficient shares"):
+        await execute_trade(db, user_id, "AAPL", 200, "sell")
+    assert alpaca == []
@@ -0,0 +1,161 @@
+# test_fill_tracker.py - The fill tracker's work queue: fairness across passes, backoff, voiding of lost orders and holding of unseen ones.
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+import fill_tracker
+from auth_models import User
+from fill_tracker import FillTracker
+from models import Trade, Wallet
+from trading_guard import TradingAccessDenied, TradingUnavailable
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def alpaca(monkeypatch):
+    """Stand-in broker: `orders` by id, `tokens` by user, `refused` tokens; anything else is unknown."""
+    state = {"orders": {}, "tokens": {}, "refused": set(), "down": False}
+
+    async def token(db, user_id):
+        return state["tokens"].get(user_id)
+
+    async def list_orders(access_token, after, symbols):
+        return None  # force per-order lookups
+
+    async def get_order(order_id, access_token):
+        if state["down"]:
+            raise TradingUnavailable("Alpaca order lookup failed with 503")
+        if access_token in state["refused"]:
+            raise TradingAccessDenied("Alpaca refused the token (401)")
+        return state["orders"].get(order_id)
+
+    monkeypatch.setattr(fill_tracker.alpaca_tokens, "aget", token)
+    monkeypatch.setattr(fill_tracker, "list_orders_async", list_orders)
+    monkeypatch.setattr(fill_tracker, "get_order_async", get_order)
+    return state
+
+
+async def _buy(db, user_id: int, order_id: str) -> int:
+    trade = Trade(user_id=user_id, symbol="AAPL", side="buy", qty=Decimal("1"), price=Decimal("100"),
+                  order_id=order_id, status="accepted", settled=False, reserved_amount=Decimal("100"))
+    db.add(trade)
+    await db.commit()
+    return trade.id
+
+
+async def _trade(db, trade_id: int) -> Trade:
+    return await db.scalar(select(Trade).where(Trade.id == trade_id).execution_options(populate_existing=True))
+
+
+def _tracker(batch: int = 100, max_attempts: int = 3) -> FillTracker:
+    # interval 0: deferred trades are due again on the next pass
+    return FillTracker(interval=0, concurrency=4, batch=batch, max_attempts=max_attempts, max_backoff=0)
+
+
+async def test_lost_order_is_retried_then_voided_with_its_reservation_released(db, user_id, alpaca):
+    alpaca["tokens"][user_id] = "token"
+    trade_id = await _buy(db, user_id, "unknown-order")
+    tracker = _tracker(max_attempts=3)
+
+    for attempt in (1, 2):
+        await tracker.poll_once()
+        trade = await _trade(db, trade_id)
+        assert not trade.settled and trade.check_attempts == attempt
+
+    await tracker.poll_once()
+    trade = await _trade(db, trade_id)
+    assert trade.settled and trade.status == "voided"
+    assert await db.scalar(select(Wallet.balance).where(Wallet.user_id == user_id)) == Decimal("100")
+    assert tracker.stats()["voided"] == 1
+
+
+async def _assert_held(db, user_id: int, trade_id: int):
+    trade = await _trade(db, trade_id)
+    assert trade.needs_review and not trade.settled and trade.status == "accepted"
+    assert await db.scalar(select(Wallet.balance).where(Wallet.user_id == user_id)) == Decimal("0")
+
+
+async def test_trades_of_a_user_whose_token_is_gone_are_held_not_voided(db, user_id, alpaca):
+    trade_id = await _buy(db, user_id, "order-1")
+    tracker = _tracker(max_attempts=1)
+    await tracker.poll_once()
+    await _assert_held(db, user_id, trade_id)
+    assert tracker.stats()["held"] == 1 and tracker.stats()["voided"] == 0
+
+    # Held trades are left for manual reconciliation, not polled again
+    alpaca["tokens"][user_id] = "token"
+    await tracker.poll_once()
+    assert tracker.open == 0
+
+
+async def test_refused_token_holds_the_trade(db, user_id, alpaca):
+    alpaca["tokens"][user_id] = "revoked"
+    alpaca["refused"].add("revoked")
+    trade_id = await _buy(db, user_id, "order-1")
+    await _tracker(max_attempts=1).poll_once()
+    await _assert_held(db, user_id, trade_id)
+
+
+async def test_unknown_order_that_had_partly_filled_is_held(db, user_id, alpaca):
+    alpaca["tokens"][user_id] = "token"
+    trade_id = await _buy(db, user_id, "unknown-order")
+    trade = await _trade(db, trade_id)
+    trade.filled_qty = Decimal("0.5")
+    await db.commit()
+    await _tracker(max_attempts=1).poll_once()
+    await _assert_held(db, user_id, trade_id)
+
+
+async def test_outage_is_not_counted_against_the_trade(db, user_id, alpaca):
+    alpaca["tokens"][user_id] = "token"
+    alpaca["down"] = True
+    trade_id = await _buy(db, user_id, "order-1")
+    tracker = _tracker()
+    await tracker.poll_once()
+    assert (await _trade(db, trade_id)).check_attempts == 0
+    assert tracker.errors == 1
+
+
+async def test_deferred_trade_is_skipped_until_due(db, user_id, alpaca):
+    alpaca["tokens"][user_id] = "token"
+    trade_id = await _buy(db, user_id, "unknown-order")
+    tracker = FillTracker(interval=60, concurrency=4, batch=100, max_attempts=3, max_backoff=3600)
+    await tracker.poll_once()
+    await tracker.poll_once()
+    assert (await _trade(db, trade_id)).check_attempts == 1
+
+
+async def test_passes_move_past_orders_that_stay_open(db, user_id, alpaca):
+    other = User(username="other", password_hash="x")
+    db.add(other)
+    await db.flush()
+    db.add(Wallet(user_id=other.id, balance=0))
+    await db.commit()
+    alpaca["tokens"].update({user_id: "a", other.id: "b"})
+
+    # The first user's order stays open; the second user's has filled
+    open_id = await _buy(db, user_id, "open-order")
+    filled_id = await _buy(db, other.id, "filled-order")
+    alpaca["orders"]["open-order"] = {"id": "open-order", "status": "accepted", "filled_qty": "0"}
+    alpaca["orders"]["filled-order"] = {"id": "filled-order", "status": "filled", "filled_qty": "1",
+                                        "filled_avg_price": "100", "filled_at": "2026-10-17T14:30:00Z"}
+
+    tracker = _tracker(batch=1)
+    await tracker.poll_once()
+    await tracker.poll_once()
+    assert (await _trade(db, filled_id)).settled
+    assert not (await _trade(db, open_id)).settled
+
+
+async def test_disconnect_is_refused_while_trades_are_settling(db, user_id):
+    from fastapi import HTTPException
+
+    import main
+    from database import SessionLocal
+
+    await _buy(db, user_id, "order-1")
+    with SessionLocal() as sync_db, pytest.raises(HTTPException) as refused:
+        main.alpaca_disconnect(user_id=user_id, db=sync_db)
+    assert refused.value.status_code == 400
@@ -0,0 +1,18 @@
+# tests/test_quote_cache.py - QuoteCache batch loading
+from concurrent.futures import Future
+
+from quote_cache import QuoteCache
+
+
+def _dead_batch_loader(symbols):
+    raise RuntimeError("pool loop is closed")
+
+
+def test_batch_loader_that_cannot_start_fails_its_waiters():
+    cache = QuoteCache(
+        loader=lambda symbol: Future(), ttl=5, stale_ttl=60, max_size=100,
+        wait_timeout=5, batch_loader=_dead_batch_loader,
+    )
+    assert cache.get_many(["AAPL", "MSFT"]) == {}
+    # Nothing left in flight: the next lookup starts a fresh load instead of waiting out the timeout
+    assert cache._inflight == {}
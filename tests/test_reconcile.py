@@ -0,0 +1,72 @@
+# test_reconcile.py - Diffing local positions against the broker's, and applying the corrections.
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from models import Position, Trade
+from reconcile import apply_corrections, diff_user
+
+TOLERANCE = Decimal("0.000001")
+
+
+def _broker(symbol: str, qty: str, asset_class: str = "us_equity") -> dict:
+    return {"symbol": symbol, "qty": qty, "avg_entry_price": "100", "asset_class": asset_class}
+
+
+def test_crypto_missing_locally_is_reported_under_the_app_symbol():
+    found = diff_user(1, {}, [_broker("BTCUSD", "0.5", "crypto"), _broker("ETHUSDT", "2", "crypto")], set(), TOLERANCE)
+    assert sorted((d["symbol"], d["kind"]) for d in found) == [("BTC/USD", "missing_local"), ("ETH/USDT", "missing_local")]
+
+
+def test_crypto_held_locally_matches_the_slashless_broker_symbol():
+    local = {"BTCUSD": ("BTC/USD", Decimal("0.5"))}
+    assert diff_user(1, local, [_broker("BTCUSD", "0.5", "crypto")], set(), TOLERANCE) == []
+
+
+def test_equity_symbols_are_left_alone():
+    found = diff_user(1, {}, [_broker("AAPL", "3")], set(), TOLERANCE)
+    assert [(d["symbol"], d["kind"], d["broker_qty"]) for d in found] == [("AAPL", "missing_local", "3")]
+
+
+def test_symbols_with_unsettled_trades_are_skipped():
+    assert diff_user(1, {}, [_broker("AAPL", "3")], {(1, "AAPL")}, TOLERANCE) == []
+
+
+def _correction(user_id: int, kind: str, local_qty: str, broker_qty: str) -> dict:
+    return {"user_id": user_id, "symbol": "AAPL", "kind": kind, "local_qty": local_qty,
+            "broker_qty": broker_qty, "broker_avg_price": "100"}
+
+
+async def _quantity(db, user_id: int):
+    return await db.scalar(
+        select(Position.quantity).where(Position.user_id == user_id).execution_options(populate_existing=True)
+    )
+
+
+@pytest.mark.anyio
+async def test_correction_applies_to_the_quantity_it_was_diffed_against(db, user_id):
+    db.add(Position(user_id=user_id, symbol="AAPL", quantity=Decimal("2"), avg_price=Decimal("90")))
+    await db.commit()
+    assert await apply_corrections([_correction(user_id, "quantity", "2", "3")]) == 1
+    assert await _quantity(db, user_id) == Decimal("3")
+
+
+@pytest.mark.anyio
+async def test_correction_skips_a_position_that_changed_since_the_diff(db, user_id):
+    db.add(Position(user_id=user_id, symbol="AAPL", quantity=Decimal("5"), avg_price=Decimal("90")))
+    await db.commit()
+    found = [_correction(user_id, "quantity", "2", "3"), _correction(user_id, "missing_broker", "2", "0"),
+             _correction(user_id, "missing_local", "0", "3")]
+    assert await apply_corrections(found) == 0
+    assert await _quantity(db, user_id) == Decimal("5")
+
+
+@pytest.mark.anyio
+async def test_correction_skips_a_symbol_that_has_since_gained_an_unsettled_trade(db, user_id):
+    db.add(Position(user_id=user_id, symbol="AAPL", quantity=Decimal("2"), avg_price=Decimal("90")))
+    db.add(Trade(user_id=user_id, symbol="AAPL", side="buy", qty=Decimal("1"), price=Decimal("100"),
+                 order_id="order-1", status="accepted", settled=False))
+    await db.commit()
+    assert await apply_corrections([_correction(user_id, "quantity", "2", "3")]) == 0
+    assert await _quantity(db, user_id) == Decimal("2")
@@ -0,0 +1,36 @@
+# tests/test_reference_data.py - ReferenceDataStore loading
+import httpx
+import pytest
+
+import alpaca_client
+from alpaca_client import get_daily_bars_async
+from reference_data import ReferenceDataStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def bars_status(monkeypatch):
+    """Serve the bars endpoint with a fixed status code."""
+    status = {"code": 503}
+
+    async def request(method, url, **kwargs):
+        return httpx.Response(status["code"], json={"bars": {}}, request=httpx.Request(method, url))
+
+    monkeypatch.setattr(alpaca_client.http_pool, "request", request)
+    return status
+
+
+async def test_failed_bars_fetch_is_not_remembered_as_no_bars(bars_status):
+    store = ReferenceDataStore(get_daily_bars_async, lookback_days=5)
+    for code in (429, 503, 401):
+        bars_status["code"] = code
+        assert await store.get("AAPL") is None
+        assert store._no_bars == set()
+
+
+async def test_empty_bars_are_remembered_for_the_session(bars_status):
+    bars_status["code"] = 200
+    store = ReferenceDataStore(get_daily_bars_async, lookback_days=5)
+    assert await store.get("BTCUSD") is None
+    assert store._no_bars == {"BTCUSD"}
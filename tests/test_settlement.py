@@ -0,0 +1,89 @@
+# test_settlement.py - Applying Alpaca fills to unsettled trades: positions, wallet and the claim on the trade row.
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from models import Position, Trade, Wallet
+from tradin_service import settle_trade
+
+pytestmark = pytest.mark.anyio
+
+
+async def _trade(db, user_id: int, side: str = "buy", qty: str = "2", reserved: str | None = "200") -> Trade:
+    trade = Trade(
+        user_id=user_id, symbol="AAPL", side=side, qty=Decimal(qty), price=Decimal("100"),
+        order_id="order-1", status="accepted", settled=False,
+        reserved_amount=Decimal(reserved) if reserved else None,
+    )
+    db.add(trade)
+    await db.commit()
+    return trade
+
+
+async def _balance(db, user_id: int) -> Decimal:
+    return await db.scalar(select(Wallet.balance).where(Wallet.user_id == user_id).execution_options(populate_existing=True))
+
+
+async def _position(db, user_id: int):
+    return await db.scalar(select(Position).where(Position.user_id == user_id).execution_options(populate_existing=True))
+
+
+def _order(status: str, filled_qty: str = "0", price: str | None = None) -> dict:
+    return {"id": "order-1", "status": status, "filled_qty": filled_qty, "filled_avg_price": price,
+            "filled_at": "2026-10-17T14:30:00Z" if price else None}
+
+
+async def test_full_fill_adds_shares_and_returns_unused_reservation(db, user_id):
+    trade = await _trade(db, user_id)
+    assert await settle_trade(db, trade, _order("filled", "2", "99.50"))
+
+    position = await _position(db, user_id)
+    assert (position.quantity, position.avg_price) == (Decimal("2"), Decimal("99.50"))
+    assert await _balance(db, user_id) == Decimal("1.00")  # 200 reserved, 199 spent
+    assert trade.status == "filled"
+
+
+async def test_partial_fill_is_mirrored_until_the_order_ends(db, user_id):
+    trade = await _trade(db, user_id)
+    assert await settle_trade(db, trade, _order("partially_filled", "0.5", "100"))
+    assert trade.filled_qty == Decimal("0.5")
+    assert await _position(db, user_id) is None  # nothing applied while the order is open
+    assert await _balance(db, user_id) == Decimal("0")
+
+    # Same report again: nothing to do
+    assert not await settle_trade(db, trade, _order("partially_filled", "0.5", "100"))
+
+    # Canceled with part filled: those shares land, the rest of the reservation comes back
+    assert await settle_trade(db, trade, _order("canceled", "0.5", "100"))
+    assert (await _position(db, user_id)).quantity == Decimal("0.5")
+    assert await _balance(db, user_id) == Decimal("150")
+    row = await db.scalar(select(Trade).where(Trade.id == trade.id).execution_options(populate_existing=True))
+    assert row.settled and row.status == "canceled" and row.filled_qty == Decimal("0.5")
+
+
+async def test_cancel_without_a_fill_releases_the_whole_reservation(db, user_id):
+    trade = await _trade(db, user_id)
+    assert await settle_trade(db, trade, _order("canceled"))
+    assert await _position(db, user_id) is None
+    assert await _balance(db, user_id) == Decimal("200")
+
+
+async def test_sell_fill_reduces_the_position_and_credits_proceeds(db, user_id):
+    db.add(Position(user_id=user_id, symbol="AAPL", quantity=Decimal("5"), avg_price=Decimal("90")))
+    trade = await _trade(db, user_id, side="sell", reserved=None)
+    assert await settle_trade(db, trade, _order("filled", "2", "110"))
+    assert (await _position(db, user_id)).quantity == Decimal("3")
+    assert await _balance(db, user_id) == Decimal("220")
+
+
+async def test_a_fill_is_applied_once_when_two_trackers_claim_it(db, user_id):
+    trade = await _trade(db, user_id)
+    # A second tracker holding the same (now stale) version of the row
+    stale = Trade(**{c.name: getattr(trade, c.name) for c in Trade.__table__.columns})
+
+    assert await settle_trade(db, trade, _order("filled", "2", "100"))
+    assert not await settle_trade(db, stale, _order("filled", "2", "100"))
+
+    assert (await _position(db, user_id)).quantity == Decimal("2")
+    assert await _balance(db, user_id) == Decimal("0")
@@ -0,0 +1,42 @@
+# test_token_cache.py - The verified-token cache under concurrent use, and the Connect-token cache's bound.
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from auth_utils import VerifiedTokenCache
+from tradin_service import AlpacaTokenCache
+
+
+def test_concurrent_gets_and_puts_keep_the_lru_consistent():
+    cache = VerifiedTokenCache(max_size=50)
+    exp = time.time() + 60
+
+    def hammer(worker: int):
+        for i in range(2000):
+            token = f"token-{(worker * 7 + i) % 200}"
+            if cache.get(token) is None:
+                cache.put(token, i, exp)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(hammer, range(8)))  # re-raises anything a worker hit
+
+    assert len(cache._entries) <= 50
+    assert cache.hits + cache.misses == 8 * 2000
+
+
+def test_expired_entry_stops_matching():
+    cache = VerifiedTokenCache(max_size=10)
+    cache.put("t", 1, time.time() - 1)
+    assert cache.get("t") is None and cache.stats()["size"] == 0
+
+
+@pytest.mark.anyio
+async def test_alpaca_token_cache_evicts_least_recently_used(db):
+    cache = AlpacaTokenCache(ttl=60, max_size=2)
+    await cache.aget(db, 1)
+    await cache.aget(db, 2)
+    await cache.aget(db, 1)  # hit: user 1 is now the most recent
+    await cache.aget(db, 3)
+    assert list(cache._entries) == [1, 3]
+    assert cache.stats()["evicted"] == 1 and cache.stats()["size"] == 2
@@ -0,0 +1,50 @@
+# test_trade_history.py - Keyset pagination of the trade history.
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import insert
+
+from models import Trade
+from tradin_service import get_trade_history
+
+pytestmark = pytest.mark.anyio
+
+
+async def _add_trades(db, user_id: int, n: int, symbol: str = "AAPL"):
+    # One statement, so every row gets the same server-side created_at — as basket orders do
+    await db.execute(insert(Trade), [
+        {"user_id": user_id, "symbol": symbol, "side": "buy", "qty": Decimal("1"), "price": Decimal("100")}
+        for _ in range(n)
+    ])
+    await db.commit()
+
+
+async def _all_pages(db, user_id: int, limit: int, **filters) -> list[list[int]]:
+    pages, cursor = [], None
+    while True:
+        trades, cursor = await get_trade_history(db, user_id, limit, cursor=cursor, **filters)
+        pages.append([t.id for t in trades])
+        if cursor is None or len(pages) > 10:
+            return pages
+
+
+async def test_pages_through_trades_with_equal_timestamps(db, user_id):
+    await _add_trades(db, user_id, 5)
+    assert await _all_pages(db, user_id, limit=2) == [[5, 4], [3, 2], [1]]
+
+
+async def test_filters_apply_across_pages(db, user_id):
+    await _add_trades(db, user_id, 3, "AAPL")
+    await _add_trades(db, user_id, 3, "MSFT")
+    assert await _all_pages(db, user_id, limit=2, symbol="aapl") == [[3, 2], [1]]
+
+
+async def test_last_page_has_no_cursor(db, user_id):
+    await _add_trades(db, user_id, 2)
+    trades, cursor = await get_trade_history(db, user_id, 2)
+    assert [t.id for t in trades] == [2, 1] and cursor is None
+
+
+async def test_bad_cursor_is_rejected(db, user_id):
+    with pytest.raises(ValueError):
+        await get_trade_history(db, user_id, 2, cursor="not-a-cursor")
@@ -0,0 +1,69 @@
+# test_trading_guard.py - Circuit breaker recovery for the guarded Alpaca trading calls.
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import alpaca_client
+from trading_guard import CircuitBreaker, TradingUnavailable
+
+pytestmark = pytest.mark.anyio
+
+
+def _half_open(breaker: CircuitBreaker):
+    breaker.state = "open"
+    breaker.opened_at = time.monotonic() - breaker.cooldown
+    breaker.before()  # this call is the probe
+    assert breaker.state == "half_open"
+
+
+async def test_probe_ending_in_an_unexpected_error_reopens_the_breaker(monkeypatch):
+    breaker = alpaca_client.breakers["orders"]
+    monkeypatch.setattr(breaker, "state", "open")
+    monkeypatch.setattr(breaker, "opened_at", time.monotonic() - breaker.cooldown)
+
+    async def broken(*args, **kwargs):
+        raise httpx.DecodingError("garbled")
+
+    monkeypatch.setattr(alpaca_client.http_pool, "request", broken)
+    with pytest.raises(httpx.DecodingError):
+        await alpaca_client._trading_request("orders", "GET", "http://alpaca.test/v2/orders", "token")
+    assert breaker.state == "open"
+
+
+async def test_cancelled_probe_frees_the_slot_without_counting_a_failure(monkeypatch):
+    breaker = alpaca_client.breakers["orders"]
+    monkeypatch.setattr(breaker, "state", "open")
+    monkeypatch.setattr(breaker, "failures", 0)
+    monkeypatch.setattr(breaker, "opened_at", time.monotonic() - breaker.cooldown)
+    monkeypatch.setattr(breaker, "probe_started", 0.0)
+
+    async def cancelled(*args, **kwargs):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(alpaca_client.http_pool, "request", cancelled)
+    with pytest.raises(asyncio.CancelledError):
+        await alpaca_client._trading_request("orders", "GET", "http://alpaca.test/v2/orders", "token")
+    assert breaker.state == "half_open" and breaker.failures == 0
+    breaker.before()  # the next call probes straight away
+
+
+def test_lost_probe_is_replaced_after_a_cooldown():
+    breaker = CircuitBreaker("test", threshold=1, cooldown=0.05)
+    _half_open(breaker)
+    with pytest.raises(TradingUnavailable):
+        breaker.before()  # probe still in flight
+    time.sleep(0.06)
+    breaker.before()  # the first probe never reported back; this one probes instead
+    breaker.success()
+    assert breaker.state == "closed"
+
+
+def test_probe_failure_reopens():
+    breaker = CircuitBreaker("test", threshold=3, cooldown=60)
+    _half_open(breaker)
+    breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(TradingUnavailable):
+        breaker.before()
@@ -1,151 +1,442 @@
 # tradin_service.py
+import base64
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from models import Wallet, Position, Trade, AlpacaToken
-from alpaca_client import get_quote, place_market_order, cancel_all_orders
+from alpaca_client import get_quote_async, get_quotes, place_market_order_async, place_market_orders
+from trading_guard import TradingUnavailable
+from config import ALPACA_TOKEN_CACHE_MAX_SIZE, ALPACA_TOKEN_CACHE_TTL, TRADE_BATCH_CONCURRENCY
 from crypto_utils import decrypt_token
 
+logger = logging.getLogger(__name__)
+
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def get_or_create_wallet(db: Session, user_id: int) -> Wallet:
-    wallet = db.query(Wallet).filter(Wallet.user_id == user_id).first()
-    if not wallet:
-        wallet = Wallet(user_id=user_id, balance=0.0)
-        db.add(wallet)
-        db.commit()
-        db.refresh(wallet)
-    return wallet
+class AlpacaTokenCache:
+    """
+    Per-worker cache of decrypted Connect tokens (and of "not connected").
+
+    Within `ttl` of being loaded or checked, an entry is served with no query
+    and no decrypt. After that it is revalidated with a one-column SELECT of
+    the row's (id, version) stamp and only reloaded and decrypted if that
+    changed — so a connect or disconnect handled by another worker is seen
+    within `ttl`. The worker that handles it calls invalidate() and sees it
+    immediately. At most `max_size` users are kept, least recently used
+    evicted first. Shared by threadpool and event-loop callers, hence the lock.
+    """
+
+    _MISSING = (None, None)
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.loads = 0
+        self.evicted = 0
+        self._entries: OrderedDict[int, tuple[str | None, tuple, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp_query(user_id: int):
+        return select(AlpacaToken.id, AlpacaToken.version).where(AlpacaToken.user_id == user_id)
+
+    @staticmethod
+    def _row_query(user_id: int):
+        return select(AlpacaToken.access_token, AlpacaToken.id, AlpacaToken.version).where(AlpacaToken.user_id == user_id)
+
+    def _cached(self, user_id: int):
+        """(hit, entry): hit if fresh; entry (possibly stale) for revalidation."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[2] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return True, entry
+            return False, entry
+
+    def _confirm(self, user_id: int, entry, stamp) -> bool:
+        if entry is None or tuple(stamp or self._MISSING) != entry[1]:
+            return False
+        with self._lock:
+            self._put(user_id, (entry[0], entry[1], time.monotonic()))
+            self.revalidated += 1
+        return True
+
+    def _store(self, user_id: int, row) -> str | None:
+        token = decrypt_token(row[0]) if row else None
+        stamp = (row[1], row[2]) if row else self._MISSING
+        with self._lock:
+            self._put(user_id, (token, stamp, time.monotonic()))
+            self.loads += 1
+        return token
+
+    def _put(self, user_id: int, entry):
+        """Caller holds the lock."""
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def get(self, db: Session, user_id: int) -> str | None:
+        hit, entry = self._cached(user_id)
+        if hit:
+            return entry[0]
+        if entry is not None and self._confirm(user_id, entry, db.execute(self._stamp_query(user_id)).first()):
+            return entry[0]
+        return self._store(user_id, db.execute(self._row_query(user_id)).first())
+
+    async def aget(self, db: AsyncSession, user_id: int) -> str | None:
+        hit, entry = self._cached(user_id)
+        if hit:
+            return entry[0]
+        if entry is not None and self._confirm(user_id, entry, (await db.execute(self._stamp_query(user_id))).first()):
+            return entry[0]
+        return self._store(user_id, (await db.execute(self._row_query(user_id))).first())
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "revalidated": self.revalidated, "loads": self.loads, "evicted": self.evicted}
+
+
+alpaca_tokens = AlpacaTokenCache(ALPACA_TOKEN_CACHE_TTL, ALPACA_TOKEN_CACHE_MAX_SIZE)
 
 
 def get_alpaca_token(db: Session, user_id: int) -> str:
     """
-    Retrieve the stored Connect access token for this user.
+    Retrieve the Connect access token for this user (via the per-worker cache).
     Raises ValueError if the user hasn't linked their Alpaca account yet.
     """
-    record = db.query(AlpacaToken).filter(AlpacaToken.user_id == user_id).first()
-    if not record:
+    token = alpaca_tokens.get(db, user_id)
+    if token is None:
         raise ValueError("Alpaca account not connected. Please link your Alpaca account first.")
-    return decrypt_token(record.access_token)
+    return token
 
 
 # ---------------------------------------------------------------------------
 # Wallet
+#
+# Every balance change is a single statement that does the arithmetic in the
+# database and returns the new balance, so concurrent requests for the same
+# user can't lose an update and never need to be serialized. These don't
+# commit: callers commit, alone or together with the rest of their transaction.
 # ---------------------------------------------------------------------------
 
-def deposit(db: Session, user_id: int, amount: float) -> Wallet:
-    wallet = get_or_create_wallet(db, user_id)
-    wallet.balance += amount
+def _insert(db: Session | AsyncSession):
+    """Dialect-specific INSERT (for ON CONFLICT) — Postgres in production, SQLite locally."""
+    return sqlite.insert if db.get_bind().dialect.name == "sqlite" else postgresql.insert
+
+
+def _credit_stmt(db: Session | AsyncSession, user_id: int, amount: Decimal):
+    stmt = _insert(db)(Wallet).values(user_id=user_id, balance=amount)
+    return stmt.on_conflict_do_update(
+        index_elements=[Wallet.user_id],
+        set_={"balance": Wallet.balance + stmt.excluded.balance},
+    ).returning(Wallet.balance)
+
+
+def _debit_stmt(user_id: int, amount: Decimal):
+    return (
+        update(Wallet)
+        .where(Wallet.user_id == user_id, Wallet.balance >= amount)
+        .values(balance=Wallet.balance - amount)
+        .returning(Wallet.balance)
+    )
+
+
+def credit_wallet(db: Session, user_id: int, amount) -> Decimal:
+    """Add to a balance, creating the wallet if missing. Returns the new balance."""
+    return db.execute(_credit_stmt(db, user_id, Decimal(str(amount)))).scalar_one()
+
+
+def debit_wallet(db: Session, user_id: int, amount) -> Decimal | None:
+    """Subtract from a balance only if it covers `amount`. Returns the new balance, or None if it doesn't."""
+    return db.execute(_debit_stmt(user_id, Decimal(str(amount)))).scalar_one_or_none()
+
+
+async def credit_wallet_async(db: AsyncSession, user_id: int, amount) -> Decimal:
+    return (await db.execute(_credit_stmt(db, user_id, Decimal(str(amount))))).scalar_one()
+
+
+async def debit_wallet_async(db: AsyncSession, user_id: int, amount) -> Decimal | None:
+    return (await db.execute(_debit_stmt(user_id, Decimal(str(amount))))).scalar_one_or_none()
+
+
+def deposit(db: Session, user_id: int, amount: float) -> Decimal:
+    balance = credit_wallet(db, user_id, amount)
     db.commit()
-    db.refresh(wallet)
-    return wallet
+    return balance
 
 
-def withdraw(db: Session, user_id: int, amount: float) -> Wallet | None:
-    wallet = get_or_create_wallet(db, user_id)
-    if wallet.balance < amount:
+def withdraw(db: Session, user_id: int, amount: float) -> Decimal | None:
+    balance = debit_wallet(db, user_id, amount)
+    if balance is None:
+        db.rollback()
         return None
-    wallet.balance -= amount
     db.commit()
-    db.refresh(wallet)
-    return wallet
+    return balance
+
+
+# ---------------------------------------------------------------------------
+# Positions
+#
+# Fills are applied in SQL against the (user_id, symbol) unique index, without
+# reading the position first. Only settlement changes positions, and it runs
+# on the async session. Like the wallet helpers, these don't commit.
+# ---------------------------------------------------------------------------
+
+async def add_to_position(db: AsyncSession, user_id: int, symbol: str, qty: Decimal, price: Decimal):
+    """Buy fill: create the position or grow it, re-weighting avg_price in the same statement."""
+    stmt = _insert(db)(Position).values(user_id=user_id, symbol=symbol, quantity=qty, avg_price=price)
+    total = Position.quantity + stmt.excluded.quantity
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Position.user_id, Position.symbol],
+        set_={
+            "quantity": total,
+            "avg_price": (Position.quantity * Position.avg_price + stmt.excluded.quantity * stmt.excluded.avg_price) / total,
+        },
+    )
+    await db.execute(stmt)
+
+
+async def reduce_position(db: AsyncSession, user_id: int, symbol: str, qty: Decimal) -> Decimal:
+    """
+    Sell fill: shrink the position only if it holds `qty`, and drop it once
+    nothing is left. Returns the remaining quantity; raises ValueError if the
+    position no longer covers the sale.
+    """
+    remaining = (await db.execute(
+        update(Position)
+        .where(Position.user_id == user_id, Position.symbol == symbol, Position.quantity >= qty)
+        .values(quantity=Position.quantity - qty)
+        .returning(Position.quantity)
+    )).scalar_one_or_none()
+    if remaining is None:
+        raise ValueError(f"Position in {symbol} no longer covers {qty:.8f} shares")
+    if remaining <= 0:
+        await db.execute(delete(Position).where(Position.user_id == user_id, Position.symbol == symbol, Position.quantity <= 0))
+    return remaining
 
 
 # ---------------------------------------------------------------------------
 # Portfolio
 # ---------------------------------------------------------------------------
 
-def get_portfolio(db: Session, user_id: int):
-    wallet = get_or_create_wallet(db, user_id)
-    positions = db.query(Position).filter(Position.user_id == user_id).all()
+async def get_portfolio(db: AsyncSession, user_id: int):
+    """
+    Read-only on the async session: a user without a wallet row yet gets an
+    unsaved zero-balance Wallet rather than an INSERT on this hot read path.
+    """
+    wallet = await db.scalar(select(Wallet).where(Wallet.user_id == user_id))
+    if wallet is None:
+        wallet = Wallet(user_id=user_id, balance=Decimal("0"))
+    positions = (await db.scalars(select(Position).where(Position.user_id == user_id))).all()
     return wallet, positions
 
 
+def _pl_percent(pl: Decimal, cost: Decimal) -> Decimal | None:
+    return pl / cost * 100 if cost else None
+
+
+def value_positions(positions, prices: dict[str, Decimal]) -> tuple[list[dict], dict]:
+    """
+    Mark positions to market with one set of prices (from a single batched quote fetch).
+    Returns per-position rows and portfolio totals; positions without a price keep
+    only symbol/quantity/avg_price and are left out of the totals.
+    """
+    rows = []
+    total_cost = total_value = Decimal("0")
+    for p in positions:
+        row = {"symbol": p.symbol, "quantity": p.quantity, "avg_price": p.avg_price}
+        price = prices.get(p.symbol)
+        if price is not None:
+            cost = p.quantity * p.avg_price
+            value = p.quantity * price
+            pl = value - cost
+            row.update(
+                market_price=price,
+                market_value=value,
+                unrealized_pl=pl,
+                unrealized_pl_percent=_pl_percent(pl, cost),
+            )
+            total_cost += cost
+            total_value += value
+        rows.append(row)
+
+    total_pl = total_value - total_cost
+    totals = {
+        "market_value": total_value,
+        "cost_basis": total_cost,
+        "unrealized_pl": total_pl,
+        "unrealized_pl_percent": _pl_percent(total_pl, total_cost),
+    }
+    return rows, totals
+
+
+# ---------------------------------------------------------------------------
+# Trade history
+# ---------------------------------------------------------------------------
+
+def encode_trade_cursor(trade: Trade) -> str:
+    raw = json.dumps([trade.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_trade_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        # Cursors issued before paging moved to id alone were [created_at, id]
+        return int(json.loads(raw)[-1])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+async def get_trade_history(
+    db: AsyncSession,
+    user_id: int,
+    limit: int,
+    cursor: str | None = None,
+    symbol: str | None = None,
+    side: str | None = None,
+) -> tuple[list[Trade], str | None]:
+    """
+    One page of a user's trades, newest first, plus the cursor for the next page.
+
+    Keyset pagination: the cursor is the id of the last row served, and the next
+    page seeks past it on the (user_id[, symbol], id) index, so page 1000 costs
+    the same as page 1. Ids follow insertion order, so this is created_at order
+    without depending on how the backend stores timestamps (SQLite's now() text
+    never compares equal to a bound datetime). Raises ValueError on a bad cursor.
+    """
+    query = select(Trade).where(Trade.user_id == user_id)
+    if symbol:
+        query = query.where(Trade.symbol == symbol.upper())
+    if side:
+        query = query.where(Trade.side == side)
+    if cursor:
+        query = query.where(Trade.id < decode_trade_cursor(cursor))
+    query = query.order_by(Trade.id.desc()).limit(limit + 1)
+
+    trades = (await db.scalars(query)).all()
+    if len(trades) > limit:
+        trades = trades[:limit]
+        return trades, encode_trade_cursor(trades[-1])
+    return trades, None
+
+
 # ---------------------------------------------------------------------------
 # Trading
+#
+# Orders are submitted and recorded unsettled: the trade keeps the quote used
+# to size it and Alpaca's status at submission (usually "accepted"), and a buy
+# keeps its cash reserved. fill_tracker settles each trade once its order
+# reaches a terminal status — the position, the wallet and the trade's price
+# all come from the actual fill.
 # ---------------------------------------------------------------------------
 
-def execute_trade(db: Session, user_id: int, symbol: str, amount: float, side: str):
+TERMINAL_ORDER_STATUSES = {"filled", "canceled", "expired", "rejected", "replaced"}
+
+
+def _pending_sells_query(user_id: int, symbols):
+    """Shares already committed to sells that haven't settled, per symbol."""
+    return (
+        select(Trade.symbol, func.sum(Trade.qty))
+        .where(Trade.user_id == user_id, Trade.side == "sell", Trade.settled.is_(False), Trade.symbol.in_(symbols))
+        .group_by(Trade.symbol)
+    )
+
+
+def _available_query(user_id: int, symbols):
+    return select(Position.symbol, Position.quantity).where(Position.user_id == user_id, Position.symbol.in_(symbols))
+
+
+def _available(held: dict, pending: dict) -> dict[str, Decimal]:
+    return {symbol: qty - (pending.get(symbol) or Decimal("0")) for symbol, qty in held.items()}
+
+
+async def execute_trade(db: AsyncSession, user_id: int, symbol: str, amount: float, side: str) -> tuple[Decimal, Trade]:
     """
     1. Look up the user's Alpaca Connect access token
-    2. Get live price
-    3. Validate wallet balance (buy) or position (sell) — no DB changes yet
-    4. Place order via Alpaca using the user's own token
-    5. Atomically commit wallet + position + trade record in one transaction
+    2. Get live price, to size the order
+    3. Buy: reserve the cash with an atomic conditional debit (committed, so a
+       concurrent trade can't spend it too). Sell: validate the position, net
+       of shares already in unsettled sells
+    4. Place order via Alpaca using the user's own token — a failed buy
+       releases the reservation
+    5. Record the trade unsettled and return without waiting for the fill
+    Returns the new wallet balance and the recorded trade.
     """
-    access_token = get_alpaca_token(db, user_id)
+    access_token = await alpaca_tokens.aget(db, user_id)
+    if access_token is None:
+        raise ValueError("Alpaca account not connected. Please link your Alpaca account first.")
+    # Upstream calls follow, so end the token lookup's transaction and hand its connection back
+    await db.commit()
 
-    price = get_quote(symbol)
+    price = await get_quote_async(symbol, allow_stale=False)
     if price is None:
         raise ValueError("Failed to get live price")
 
     amount = Decimal(str(amount))
     qty = amount / price
     symbol = symbol.upper()
-    wallet = get_or_create_wallet(db, user_id)
 
-    # --- Validate only, no DB changes yet ---
     if side == "buy":
-        if wallet.balance < amount:
+        balance = await debit_wallet_async(db, user_id, amount)
+        if balance is None:
+            await db.rollback()
             raise ValueError("Insufficient wallet balance")
+        await db.commit()
 
     elif side == "sell":
-        position = db.query(Position).filter(
-            Position.user_id == user_id,
-            Position.symbol == symbol
-        ).first()
-        if not position:
+        held = dict((await db.execute(_available_query(user_id, [symbol]))).all())
+        if symbol not in held:
             raise ValueError("No position found to sell")
-        if position.quantity < qty:
+        pending = dict((await db.execute(_pending_sells_query(user_id, [symbol]))).all())
+        available = _available(held, pending)[symbol]
+        if available < qty:
             raise ValueError(
-                f"Insufficient shares. You have {position.quantity:.8f}, trying to sell {qty:.8f}"
+                f"Insufficient shares. You have {available:.8f} available, trying to sell {qty:.8f}"
             )
+        balance = await db.scalar(select(Wallet.balance).where(Wallet.user_id == user_id))
+        if balance is None:
+            balance = Decimal("0")
+        await db.commit()  # release the connection before the order goes out
     else:
         raise ValueError("Invalid side, must be 'buy' or 'sell'")
 
-    # --- Place Alpaca order before touching the DB ---
-    alpaca_order = place_market_order(symbol, qty, side, access_token)
-    if alpaca_order is None:
-        cancel_all_orders(access_token)
-        alpaca_order = place_market_order(symbol, qty, side, access_token)
+    # --- Place Alpaca order; the only DB change so far is a buy's reservation ---
+    try:
+        # Transient failures are already retried (idempotently) inside the client
+        alpaca_order = await place_market_order_async(symbol, qty, side, access_token)
         if alpaca_order is None:
             raise ValueError(
                 f"Alpaca order failed for {side} {qty} {symbol}. "
                 "Check if fractional trading is enabled or try again later."
             )
-
-    # --- Atomically apply all DB changes ---
-    try:
+    except Exception:
         if side == "buy":
-            wallet.balance -= amount
-            position = db.query(Position).filter(
-                Position.user_id == user_id,
-                Position.symbol == symbol
-            ).first()
-            if not position:
-                position = Position(
-                    user_id=user_id,
-                    symbol=symbol,
-                    quantity=qty,
-                    avg_price=price,
-                )
-                db.add(position)
-            else:
-                total_qty = position.quantity + qty
-                position.avg_price = (position.quantity * position.avg_price + qty * price) / total_qty
-                position.quantity = total_qty
-        else:  # sell
-            wallet.balance += amount
-            position = db.query(Position).filter(
-                Position.user_id == user_id,
-                Position.symbol == symbol
-            ).first()
-            position.quantity -= qty
-            if position.quantity <= 0:
-                db.delete(position)
+            await credit_wallet_async(db, user_id, amount)  # release the reservation
+            await db.commit()
+        raise
 
+    # --- Record it; position and proceeds wait for the fill ---
+    try:
         trade = Trade(
             user_id=user_id,
             symbol=symbol,
@@ -153,13 +444,14 @@ def execute_trade(db: Session, user_id: int, symbol: str, amount: float, side: s
             qty=qty,
             price=price,
             order_id=alpaca_order.get("id"),
-            status=alpaca_order.get("status", "filled"),
+            status=alpaca_order.get("status", "accepted"),
+            settled=False,
+            reserved_amount=amount if side == "buy" else None,
         )
         db.add(trade)
-        db.commit()
-        db.refresh(wallet)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         # The Alpaca order was placed but local DB update failed.
         # Log order_id for manual reconciliation.
         order_id = alpaca_order.get("id", "unknown")
@@ -168,4 +460,220 @@ def execute_trade(db: Session, user_id: int, symbol: str, amount: float, side: s
             "Please contact support with this order ID."
         )
 
-    return wallet
\ No newline at end of file
+    return balance, trade
+
+
+def execute_batch(db: Session, user_id: int, legs: list) -> tuple[Decimal, list[dict]]:
+    """
+    Execute a basket of TradeRequest legs with one token lookup, one batched
+    quote fetch and one commit for all the accepted orders:
+
+    1. Price every leg from a single get_quotes call; unpriced legs are rejected
+    2. Sell legs for the same symbol must fit together in the position, net of
+       shares already in unsettled sells
+    3. Reserve the total cost of the buy legs with one conditional debit — if the
+       wallet can't cover the whole basket, nothing is submitted
+    4. Submit the orders concurrently (TRADE_BATCH_CONCURRENCY in flight)
+    5. Record every accepted leg unsettled and release the reservation of failed
+       buys in one transaction; fills are applied by fill_tracker
+
+    Returns the new wallet balance and a result dict per leg, in request order.
+    """
+    access_token = get_alpaca_token(db, user_id)
+    db.commit()  # the quote fetch is upstream; don't hold a connection across it
+
+    results = [
+        {"symbol": leg.symbol.upper(), "side": leg.side, "amount": Decimal(str(leg.amount)), "status": "pending"}
+        for leg in legs
+    ]
+    prices = get_quotes([r["symbol"] for r in results], allow_stale=False)
+    for r in results:
+        price = prices.get(r["symbol"])
+        if price is None:
+            r.update(status="rejected", error="Failed to get live price")
+        else:
+            r.update(price=price, qty=r["amount"] / price)
+
+    # --- Validate sells against current positions, per symbol ---
+    sells = [r for r in results if r["side"] == "sell" and r["status"] == "pending"]
+    if sells:
+        symbols = {r["symbol"] for r in sells}
+        available = _available(
+            dict(db.execute(_available_query(user_id, symbols)).all()),
+            dict(db.execute(_pending_sells_query(user_id, symbols)).all()),
+        )
+        wanted: dict[str, Decimal] = {}
+        for r in sells:
+            wanted[r["symbol"]] = wanted.get(r["symbol"], Decimal("0")) + r["qty"]
+        for r in sells:
+            if wanted[r["symbol"]] > available.get(r["symbol"], Decimal("0")):
+                r.update(status="rejected", error=f"Insufficient shares of {r['symbol']} for the basket's sell legs")
+
+    # --- Reserve cash for all buys at once ---
+    buy_total = sum((r["amount"] for r in results if r["side"] == "buy" and r["status"] == "pending"), Decimal("0"))
+    if buy_total and debit_wallet(db, user_id, buy_total) is None:
+        db.rollback()
+        raise ValueError("Insufficient wallet balance for the basket's buy legs")
+    db.commit()  # also ends the sell validation's reads: no connection is held while orders are out
+
+    # --- Submit concurrently ---
+    pending = [r for r in results if r["status"] == "pending"]
+    orders = place_market_orders(
+        [(r["symbol"], r["qty"], r["side"]) for r in pending], access_token, TRADE_BATCH_CONCURRENCY
+    )
+    refund = Decimal("0")
+    for r, order in zip(pending, orders):
+        if isinstance(order, dict):
+            r.update(status="submitted", order_id=order.get("id"), order_status=order.get("status", "accepted"))
+            continue
+        r.update(status="failed", error=str(order) if isinstance(order, (ValueError, TradingUnavailable)) else "Alpaca order failed")
+        if r["side"] == "buy":
+            refund += r["amount"]
+
+    # --- One transaction for every accepted order ---
+    submitted = [r for r in pending if r["status"] == "submitted"]
+    try:
+        for r in submitted:
+            db.add(Trade(
+                user_id=user_id,
+                symbol=r["symbol"],
+                side=r["side"],
+                qty=r["qty"],
+                price=r["price"],
+                order_id=r["order_id"],
+                status=r["order_status"],
+                settled=False,
+                reserved_amount=r["amount"] if r["side"] == "buy" else None,
+            ))
+        if refund:
+            credit_wallet(db, user_id, refund)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if refund:
+            credit_wallet(db, user_id, refund)
+            db.commit()
+        order_ids = ", ".join(r["order_id"] or "unknown" for r in submitted)
+        raise ValueError(
+            f"Orders {order_ids} were placed in Alpaca but failed to record locally: {e}. "
+            "Please contact support with these order IDs."
+        )
+
+    balance = db.scalar(select(Wallet.balance).where(Wallet.user_id == user_id))
+    return balance if balance is not None else Decimal("0"), results
+
+
+def _order_time(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+async def settle_trade(db: AsyncSession, trade: Trade, order: dict) -> bool:
+    """
+    Apply what Alpaca reports for a trade's order. Until the order is terminal
+    only its status and filled quantity are mirrored. Once it is, in one
+    transaction: the trade takes the average fill price and is marked settled;
+    a buy adds the filled shares to the position and returns whatever of its
+    reservation the fill didn't use (all of it if nothing filled); a sell
+    removes the filled shares and credits the proceeds.
+
+    The trade row is claimed with a version check, so of two trackers seeing
+    the same fill only one applies it. Returns True if the trade changed.
+    """
+    status = order.get("status")
+    filled_qty = Decimal(str(order.get("filled_qty") or "0"))
+    fill_price = Decimal(str(order["filled_avg_price"])) if order.get("filled_avg_price") else None
+    terminal = status in TERMINAL_ORDER_STATUSES
+    if not terminal and status == trade.status and filled_qty == (trade.filled_qty or 0):
+        return False
+
+    values = {"status": status, "filled_qty": filled_qty, "version": Trade.version + 1}
+    if fill_price is not None:
+        values["price"] = fill_price
+    if terminal:
+        values.update(settled=True, filled_at=_order_time(order.get("filled_at")))
+
+    claimed = (await db.execute(
+        update(Trade)
+        .where(Trade.id == trade.id, Trade.version == trade.version, Trade.settled.is_(False))
+        .values(**values)
+        .returning(Trade.version)
+    )).scalar_one_or_none()
+    if claimed is None:
+        await db.rollback()
+        return False
+
+    if terminal:
+        proceeds = filled_qty * fill_price if filled_qty and fill_price is not None else Decimal("0")
+        if trade.side == "buy":
+            if proceeds:
+                await add_to_position(db, trade.user_id, trade.symbol, filled_qty, fill_price)
+            unused = (trade.reserved_amount or Decimal("0")) - proceeds
+            if unused:
+                # Negative when the fill cost more than the quote it was sized on
+                await credit_wallet_async(db, trade.user_id, unused)
+        elif proceeds:
+            try:
+                await reduce_position(db, trade.user_id, trade.symbol, filled_qty)
+            except ValueError as e:
+                logger.error(f"Trade {trade.id} (order {trade.order_id}) settled against a short position: {e}")
+            await credit_wallet_async(db, trade.user_id, proceeds)
+    await db.commit()
+    trade.version, trade.status, trade.filled_qty = claimed, status, filled_qty
+    return True
+
+
+async def defer_trade(db: AsyncSession, trade: Trade, delay: float):
+    """Count a poll that couldn't find the trade's order, and skip the trade for `delay` seconds."""
+    await db.execute(
+        update(Trade)
+        .where(Trade.id == trade.id, Trade.settled.is_(False))
+        .values(check_attempts=Trade.check_attempts + 1, next_check_at=datetime.now(timezone.utc) + timedelta(seconds=delay))
+    )
+    await db.commit()
+    trade.check_attempts += 1
+
+
+async def hold_trade(db: AsyncSession, trade: Trade, reason: str) -> bool:
+    """
+    Park a trade whose order we can no longer see (token gone or refused, or
+    a partly filled order Alpaca stopped returning) for manual reconciliation:
+    flagged needs_review and no longer polled, but left unsettled with a buy's
+    reservation held. Nothing is credited, since the order may have filled.
+    """
+    flagged = (await db.execute(
+        update(Trade)
+        .where(Trade.id == trade.id, Trade.settled.is_(False), Trade.needs_review.is_(False))
+        .values(needs_review=True)
+        .returning(Trade.id)
+    )).scalar_one_or_none()
+    await db.commit()
+    if flagged is None:
+        return False
+    logger.warning(f"Trade {trade.id} (order {trade.order_id}) held for review: {reason}")
+    trade.needs_review = True
+    return True
+
+
+async def void_trade(db: AsyncSession, trade: Trade) -> bool:
+    """
+    Give up on a trade whose order Alpaca says doesn't exist (it never reached
+    them, so nothing filled): mark it settled as "voided" and release a buy's
+    reservation. Claimed with the same version
+    check as settle_trade. Whatever may have filled at Alpaca is left for
+    reconciliation, which no longer skips the symbol once nothing is unsettled.
+    """
+    claimed = (await db.execute(
+        update(Trade)
+        .where(Trade.id == trade.id, Trade.version == trade.version, Trade.settled.is_(False))
+        .values(status="voided", settled=True, version=Trade.version + 1)
+        .returning(Trade.version)
+    )).scalar_one_or_none()
+    if claimed is None:
+        await db.rollback()
+        return False
+    if trade.side == "buy" and trade.reserved_amount:
+        await credit_wallet_async(db, trade.user_id, trade.reserved_amount)
+    await db.commit()
+    logger.warning(f"Trade {trade.id} (order {trade.order_id}) voided: Alpaca has no such order")
+    trade.version, trade.status, trade.settled = claimed, "voided", True
+    return True
@@ -0,0 +1,171 @@
+# trading_guard.py - Upstream protection for Clau Trading Backend's Alpaca trading calls: per-token rate budgets read from Alpaca's rate-limit headers, and per-endpoint circuit breakers.
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TradingUnavailable(Exception):
+    """Alpaca trading is being shed locally (budget exhausted or breaker open)."""
+
+
+class TradingAccessDenied(Exception):
+    """Alpaca refused the user's access token (401/403), so their orders can't be looked up with it."""
+
+
+class RateBudget:
+    """
+    What is left of one access token's Alpaca request allowance, from the
+    X-RateLimit-* headers of its latest response. Until a token's first
+    response nothing is known, so calls go straight through.
+    """
+
+    __slots__ = ("limit", "remaining", "reset_at", "throttled")
+
+    def __init__(self):
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset_at = 0.0
+        self.throttled = 0
+
+
+class RateBudgets:
+    """
+    Per-token budgets. acquire() spends one request: while the budget is empty
+    it waits for the window to reset if that is within `max_wait`, otherwise it
+    sheds the call with TradingUnavailable instead of letting it become a 429.
+    Tokens are keyed by digest and the table is LRU-bounded.
+    """
+
+    def __init__(self, max_wait: float, max_tokens: int = 10000):
+        self.max_wait = max_wait
+        self.max_tokens = max_tokens
+        self.shed = 0
+        self._budgets: "OrderedDict[bytes, RateBudget]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _budget(self, token: str) -> RateBudget:
+        key = self._key(token)
+        budget = self._budgets.get(key)
+        if budget is None:
+            budget = self._budgets[key] = RateBudget()
+            if len(self._budgets) > self.max_tokens:
+                self._budgets.popitem(last=False)
+        else:
+            self._budgets.move_to_end(key)
+        return budget
+
+    async def acquire(self, token: str):
+        while True:
+            with self._lock:
+                budget = self._budget(token)
+                now = time.time()
+                if budget.remaining is None or now >= budget.reset_at:
+                    budget.remaining = None  # new window: unknown until the next response
+                    return
+                if budget.remaining > 0:
+                    budget.remaining -= 1
+                    return
+                wait = budget.reset_at - now
+                if wait > self.max_wait:
+                    self.shed += 1
+                    raise TradingUnavailable(f"Alpaca rate limit reached, retry in {wait:.0f}s")
+            await asyncio.sleep(wait)
+
+    def update(self, token: str, headers, status_code: int):
+        """Record the allowance Alpaca reported; a 429 empties the budget until the reset."""
+        with self._lock:
+            budget = self._budget(token)
+            try:
+                if "x-ratelimit-limit" in headers:
+                    budget.limit = int(headers["x-ratelimit-limit"])
+                if "x-ratelimit-remaining" in headers:
+                    budget.remaining = int(headers["x-ratelimit-remaining"])
+                if "x-ratelimit-reset" in headers:
+                    budget.reset_at = float(headers["x-ratelimit-reset"])
+            except ValueError:
+                pass
+            if status_code == 429:
+                budget.throttled += 1
+                budget.remaining = 0
+                retry_after = headers.get("retry-after")
+                if retry_after and retry_after.isdigit():
+                    budget.reset_at = time.time() + int(retry_after)
+                elif budget.reset_at <= time.time():
+                    budget.reset_at = time.time() + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            live = [b for b in self._budgets.values() if b.remaining is not None and b.reset_at > now]
+            return {
+                "tokens": len(self._budgets),
+                "exhausted": sum(1 for b in live if b.remaining == 0),
+                "min_remaining": min((b.remaining for b in live), default=None),
+                "throttled": sum(b.throttled for b in self._budgets.values()),
+                "shed": self.shed,
+            }
+
+
+class CircuitBreaker:
+    """
+    Closed until `threshold` consecutive failures (5xx or transport errors),
+    then open: calls fail fast for `cooldown` seconds. After that one probe is
+    let through (half-open); its outcome closes or re-opens the breaker. A probe
+    that is abandoned, or reports nothing within another `cooldown`, is
+    replaced by the next call.
+    """
+
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    raise TradingUnavailable(f"Alpaca {self.name} endpoint unavailable, failing fast")
+                self.state = "half_open"
+                self.probe_started = time.monotonic()
+                return
+            if self.state == "half_open":
+                if time.monotonic() - self.probe_started >= self.cooldown:
+                    self.probe_started = time.monotonic()
+                    return
+                # A probe is already in flight
+                self.rejected += 1
+                raise TradingUnavailable(f"Alpaca {self.name} endpoint recovering, failing fast")
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """The call ended with no outcome (e.g. cancelled): free a half-open probe slot, record nothing."""
+        with self._lock:
+            if self.state == "half_open":
+                self.probe_started = 0.0
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
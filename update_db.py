@@ -9,6 +9,15 @@ import models       # Wallet, Position, Trade, Payment, AlpacaToken
 import auth_models  # User
 
 
+def get_live_indexes(conn) -> dict[str, set[str]]:
+    """Return {table_name: {index_name, ...}} for every table currently in the DB."""
+    inspector = inspect(conn)
+    return {
+        table: {ix["name"] for ix in inspector.get_indexes(table)}
+        for table in inspector.get_table_names()
+    }
+
+
 def get_live_schema(conn) -> dict[str, set[str]]:
     """Return {table_name: {col_name, ...}} for every table currently in the DB."""
     inspector = inspect(conn)
@@ -18,9 +27,49 @@ def get_live_schema(conn) -> dict[str, set[str]]:
     }
 
 
+def merge_duplicate_positions(conn):
+    """Fold duplicate (user_id, symbol) positions into the oldest row so the unique index can be built."""
+    conn.execute(text("""
+        WITH merged AS (
+            SELECT MIN(id) AS keep_id,
+                   SUM(quantity) AS quantity,
+                   SUM(quantity * avg_price) / NULLIF(SUM(quantity), 0) AS avg_price
+            FROM positions
+            GROUP BY user_id, symbol
+            HAVING COUNT(*) > 1
+        )
+        UPDATE positions
+        SET quantity = merged.quantity,
+            avg_price = COALESCE(merged.avg_price, positions.avg_price)
+        FROM merged
+        WHERE positions.id = merged.keep_id
+    """))
+    conn.execute(text("""
+        DELETE FROM positions
+        WHERE id NOT IN (SELECT MIN(id) FROM positions GROUP BY user_id, symbol)
+    """))
+
+
+# Data fixes that must run before an index can be created
+PRE_INDEX_FIXUPS = {
+    "uq_positions_user_symbol": merge_duplicate_positions,
+}
+
+# Indexes no longer in the models, mapped to the index that replaces each;
+# a retired index is dropped only once its replacement is live
+RETIRED_INDEXES = {
+    "trades": {
+        "ix_trades_user_created_id": "ix_trades_user_id_id",
+        "ix_trades_user_symbol_created_id": "ix_trades_user_symbol_id",
+    },
+}
+
+
 def pg_type(col) -> str:
     """Best-effort mapping from SQLAlchemy column type to a Postgres DDL type."""
     t = str(col.type).upper()
+    if t.startswith("NUMERIC"):
+        return t  # keep precision and scale, e.g. NUMERIC(18, 2)
     mapping = {
         "INTEGER":   "INTEGER",
         "FLOAT":     "DOUBLE PRECISION",
@@ -91,6 +140,44 @@ def run():
                         print(f"  ❌  {table_name}.{col.name}: {e}")
                         failed += 1
 
+            # ── Table exists → check for missing indexes ──────────────────────
+            live_indexes = get_live_indexes(conn).get(table_name, set())
+            for index in table.indexes:
+                if index.name in live_indexes:
+                    continue
+                try:
+                    fixup = PRE_INDEX_FIXUPS.get(index.name)
+                    if fixup:
+                        fixup(conn)
+                    index.create(bind=conn)
+                    conn.commit()
+                    print(f"  ✅  CREATE INDEX {index.name}")
+                    ok += 1
+                except Exception as e:
+                    conn.rollback()
+                    print(f"  ❌  CREATE INDEX {index.name}: {e}")
+                    failed += 1
+
+            retired = RETIRED_INDEXES.get(table_name, {})
+            if retired:
+                live_indexes = get_live_indexes(conn).get(table_name, set())
+            for name, replacement in retired.items():
+                if name not in live_indexes:
+                    continue
+                if replacement not in live_indexes:
+                    print(f"  ⏭️   DROP INDEX {name} (replacement {replacement} not live)")
+                    skipped += 1
+                    continue
+                try:
+                    conn.execute(text(f"DROP INDEX {name}"))
+                    conn.commit()
+                    print(f"  ✅  DROP INDEX {name}")
+                    ok += 1
+                except Exception as e:
+                    conn.rollback()
+                    print(f"  ❌  DROP INDEX {name}: {e}")
+                    failed += 1
+
     print(f"\n{ok} applied · {skipped} skipped · {failed} failed")
 
 
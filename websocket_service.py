@@ -1,41 +1,196 @@
 # websocket_service.py - WebSocket connection manager for Clau Trading Backend, handling client connections, symbol subscriptions, and real-time price updates using Alpaca API.
 import asyncio
 import json
-from typing import Dict, Set
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Set
 from fastapi import WebSocket
-from alpaca_client import get_quote
+from decimal import Decimal
+from alpaca_client import get_quotes_async, quote_cache
+from bar_aggregator import bar_aggregator
+from market_stream import MarketDataStream
+import metrics
+from config import (
+    ALPACA_API_KEY,
+    ALPACA_SECRET_KEY,
+    ALPACA_STREAM_URL,
+    MARKET_DATA_MODE,
+    PRICE_UPDATE_INTERVAL,
+    STREAM_MAX_RECONNECT_DELAY,
+    WS_BACKPRESSURE_POLICY,
+    WS_SEND_QUEUE_SIZE,
+    WS_SLOW_CLIENT_TIMEOUT,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+class ClientChannel:
+    """
+    Outbound side of one websocket: a bounded queue drained by its own writer task,
+    so a slow client only ever delays itself.
+
+    Price updates are enqueued under their symbol. With the "latest" policy a newer
+    update replaces a still-queued one for the same symbol (the client only needs
+    the current price); with "drop_oldest" every update is queued and the oldest
+    is discarded once the queue is full. A send that stays blocked longer than
+    `send_timeout` marks the client as stuck and the connection is closed.
+
+    Clients that opt in to batching (`batch` set at subscribe time) get their
+    price updates held in a separate queue, and the writer flushes everything that
+    has accumulated as one "price_batch" frame instead of one frame per symbol.
+
+    Clients that opt in to bars (`bars` set at subscribe time) also get a
+    "bar_update" frame for each completed bar of their symbols. Those are never
+    coalesced: each one is a distinct bar, not a newer version of the last.
+    """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager", max_queue: int, policy: str, send_timeout: float):
+        self.websocket = websocket
+        self.symbols: Set[str] = set()
+        self.batch = False
+        self.bars = False
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+
+        self._manager = manager
+        self._pending: "OrderedDict[object, str]" = OrderedDict()
+        self._batched: "OrderedDict[object, str]" = OrderedDict()
+        self._seq = 0
+        self._since = 0.0  # when the oldest unsent message was queued
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, message: str, key: object = None):
+        """Queue a standalone frame; `key` (a symbol) enables latest-value coalescing."""
+        if self.closed:
+            return
+        self._put(self._pending, message, key)
+        self._wake()
+
+    def enqueue_update(self, symbol: str, payload: str):
+        """Queue a pre-encoded price update, batched or standalone per the client's choice."""
+        if self.closed:
+            return
+        self._put(self._batched if self.batch else self._pending, payload, symbol)
+        self._wake()
+
+    def _wake(self):
+        if not self._ready.is_set():
+            self._since = time.perf_counter()
+            self._ready.set()
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending) + len(self._batched)
+
+    def _put(self, queue: "OrderedDict[object, str]", message: str, key: object):
+        if key is not None and self.policy == "latest" and key in queue:
+            queue[key] = message
+            self.coalesced += 1
+            return
+        if key is None or self.policy != "latest":
+            self._seq += 1
+            key = self._seq
+        queue[key] = message
+        if len(queue) > self.max_queue:
+            queue.popitem(last=False)
+            self.dropped += 1
+
+    async def _send(self, message: str):
+        await asyncio.wait_for(self.websocket.send_text(message), self.send_timeout)
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._ready.wait()
+                since = self._since
+                self._ready.clear()
+                while self._pending:
+                    _, message = self._pending.popitem(last=False)
+                    await self._send(message)
+                if self._batched:
+                    # Payloads are already-encoded JSON objects: splice, don't re-serialize
+                    updates = ",".join(self._batched.values())
+                    self._batched.clear()
+                    await self._send('{"type":"price_batch","updates":[' + updates + "]}")
+                metrics.send_lag.observe(time.perf_counter() - since)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"Disconnecting slow websocket client: send blocked > {self.send_timeout}s "
+                           f"({self.queued} queued, {self.dropped} dropped)")
+            await self._abort(code=1013)
+        except Exception as e:
+            logger.error(f"Error sending message: {e}")
+            await self._abort()
+
+    async def _abort(self, code: int = 1011):
+        self.closed = True
+        self._manager.disconnect(self.websocket)
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        self._pending.clear()
+        self._batched.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[WebSocket, Set[str]] = {}
+        self.active_connections: Dict[WebSocket, ClientChannel] = {}
         self.symbol_subscribers: Dict[str, Set[WebSocket]] = {}
+        # Notified with symbol_added/symbol_removed when a symbol gains its first
+        # subscriber or loses its last one (e.g. the upstream market data stream)
+        self.symbol_listeners = []
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[websocket] = set()
+        self.active_connections[websocket] = ClientChannel(
+            websocket,
+            self,
+            max_queue=WS_SEND_QUEUE_SIZE,
+            policy=WS_BACKPRESSURE_POLICY,
+            send_timeout=WS_SLOW_CLIENT_TIMEOUT,
+        )
         logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
+            channel = self.active_connections[websocket]
             # Remove from symbol subscriptions
-            subscribed_symbols = self.active_connections[websocket].copy()
+            subscribed_symbols = channel.symbols.copy()
             for symbol in subscribed_symbols:
                 self.unsubscribe_symbol(websocket, symbol)
             
             # Remove connection
+            channel.close()
             del self.active_connections[websocket]
             logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
-    def subscribe_symbol(self, websocket: WebSocket, symbol: str):
+    def subscribe_symbol(self, websocket: WebSocket, symbol: str, batch: bool = False, bars: bool = False):
         symbol = symbol.upper()
         if websocket in self.active_connections:
-            self.active_connections[websocket].add(symbol)
+            channel = self.active_connections[websocket]
+            channel.symbols.add(symbol)
+            if batch:
+                channel.batch = True
+            if bars:
+                channel.bars = True
             
             if symbol not in self.symbol_subscribers:
                 self.symbol_subscribers[symbol] = set()
+                for listener in self.symbol_listeners:
+                    listener.symbol_added(symbol)
             self.symbol_subscribers[symbol].add(websocket)
             
             logger.info(f"Subscribed to {symbol}. Subscribers: {len(self.symbol_subscribers[symbol])}")
@@ -43,64 +198,197 @@ class ConnectionManager:
     def unsubscribe_symbol(self, websocket: WebSocket, symbol: str):
         symbol = symbol.upper()
         if websocket in self.active_connections:
-            self.active_connections[websocket].discard(symbol)
+            self.active_connections[websocket].symbols.discard(symbol)
             
             if symbol in self.symbol_subscribers:
                 self.symbol_subscribers[symbol].discard(websocket)
                 if not self.symbol_subscribers[symbol]:
                     del self.symbol_subscribers[symbol]
+                    for listener in self.symbol_listeners:
+                        listener.symbol_removed(symbol)
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        try:
-            await websocket.send_text(message)
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-            self.disconnect(websocket)
+        channel = self.active_connections.get(websocket)
+        if channel is not None:
+            channel.enqueue(message)
 
     async def broadcast_to_symbol_subscribers(self, symbol: str, message: str):
-        symbol = symbol.upper()
-        if symbol in self.symbol_subscribers:
-            disconnected = []
-            for websocket in self.symbol_subscribers[symbol].copy():
-                try:
-                    await websocket.send_text(message)
-                except Exception as e:
-                    logger.error(f"Error broadcasting to {symbol}: {e}")
-                    disconnected.append(websocket)
-            
-            # Clean up disconnected websockets
-            for ws in disconnected:
-                self.disconnect(ws)
+        """Queue `message` for every subscriber of `symbol`; never waits on a client."""
+        self.publish_updates({symbol.upper(): message})
+
+    def publish_updates(self, updates: Dict[str, str]):
+        """
+        Fan out one tick of pre-encoded price updates ({symbol: payload}).
+        Each payload is encoded once by the caller and the same string is shared
+        by every subscriber; batching clients get all of theirs in one frame.
+        """
+        start = time.perf_counter()
+        for symbol, payload in updates.items():
+            for websocket in self.symbol_subscribers.get(symbol, ()):
+                self.active_connections[websocket].enqueue_update(symbol, payload)
+        metrics.broadcast.observe(time.perf_counter() - start)
+
+    def publish_bars(self, symbol: str, bars: list[tuple[str, dict]]):
+        """Send completed (timeframe, bar) pairs to the symbol's subscribers that asked for bars."""
+        channels = [
+            channel for channel in (self.active_connections[ws] for ws in self.symbol_subscribers.get(symbol, ()))
+            if channel.bars
+        ]
+        if not channels:
+            return
+        for timeframe, bar in bars:
+            message = json.dumps({"type": "bar_update", "symbol": symbol, "timeframe": timeframe, "bar": bar})
+            for channel in channels:
+                channel.enqueue(message)
+
+class SymbolDemand:
+    """
+    Reference-counted set of symbols wanted from upstream.
+
+    Consumers (this worker's ConnectionManager, and remote workers when this
+    process is the shared feed) report symbol_added/symbol_removed; listeners
+    such as the upstream stream only hear about a symbol when its first consumer
+    arrives or its last one leaves.
+    """
+
+    def __init__(self):
+        self._refs: Dict[str, int] = {}
+        self.listeners = []
+
+    def symbol_added(self, symbol: str):
+        count = self._refs.get(symbol, 0)
+        self._refs[symbol] = count + 1
+        if count == 0:
+            for listener in self.listeners:
+                listener.symbol_added(symbol)
+
+    def symbol_removed(self, symbol: str):
+        count = self._refs.get(symbol, 0)
+        if count > 1:
+            self._refs[symbol] = count - 1
+        elif count == 1:
+            del self._refs[symbol]
+            for listener in self.listeners:
+                listener.symbol_removed(symbol)
+
+    def symbols(self) -> list[str]:
+        return list(self._refs)
+
+
+Publisher = Callable[[Dict[str, str]], None]
 
 manager = ConnectionManager()
+market_stream: MarketDataStream | None = None
+
+metrics.registry.gauge("clau_ws_connections", "Open websocket connections", lambda: len(manager.active_connections))
+metrics.registry.gauge(
+    "clau_ws_subscriptions", "Symbol subscriptions across connections",
+    lambda: sum(len(c.symbols) for c in manager.active_connections.values()),
+)
+metrics.registry.gauge("clau_ws_symbols", "Distinct symbols with subscribers", lambda: len(manager.symbol_subscribers))
+metrics.registry.gauge(
+    "clau_ws_queued_messages", "Messages waiting in client send queues",
+    lambda: sum(c.queued for c in manager.active_connections.values()),
+)
+
+
+def encode_price_update(symbol: str, price: Decimal, timestamp: float, size: float | None = None) -> str:
+    update = {
+        "type": "price_update",
+        "symbol": symbol,
+        "price": float(price),
+        "timestamp": timestamp
+    }
+    if size is not None:
+        update["size"] = size
+    return json.dumps(update)
 
-async def price_updater():
-    """Background task to fetch and broadcast price updates"""
+
+def record_ticks(ticks: Dict[str, tuple[float, float]]):
+    """
+    Roll this worker's ticks ({symbol: (price, size)}) into the in-process bars
+    and push any bars they complete. Bars are stamped with wall-clock arrival
+    time so polled and streamed ticks land in the same buckets.
+    """
+    now = time.time()
+    for symbol, (price, size) in ticks.items():
+        closed = bar_aggregator.add_tick(symbol, price, size, now)
+        if closed:
+            manager.publish_bars(symbol, closed)
+
+
+async def market_data_feed(demand: SymbolDemand, publish: Publisher):
+    """
+    Run the configured market data ingestion mode for the symbols in `demand`,
+    handing each batch of encoded updates to `publish`.
+    In "stream" mode the REST poller still runs as a fallback, but it idles
+    while the upstream stream is connected.
+    """
+    global market_stream
+    if MARKET_DATA_MODE != "stream":
+        await price_updater(demand, publish)
+        return
+
+    async def on_trade(symbol: str, price: Decimal, trade: dict):
+        # Push each upstream trade to subscribers as it arrives
+        size = trade.get("s") or 0
+        quote_cache.put(symbol, price)
+        publish({symbol: encode_price_update(symbol, price, asyncio.get_event_loop().time(), size)})
+        record_ticks({symbol: (float(price), size)})
+
+    market_stream = MarketDataStream(
+        ALPACA_STREAM_URL,
+        ALPACA_API_KEY,
+        ALPACA_SECRET_KEY,
+        on_trade=on_trade,
+        max_reconnect_delay=STREAM_MAX_RECONNECT_DELAY,
+    )
+    demand.listeners.append(market_stream)
+    for symbol in demand.symbols():
+        market_stream.symbol_added(symbol)
+    try:
+        await asyncio.gather(market_stream.run(), price_updater(demand, publish))
+    finally:
+        demand.listeners.remove(market_stream)
+        market_stream = None
+
+async def price_updater(demand: SymbolDemand, publish: Publisher):
+    """
+    Background task to fetch and broadcast price updates.
+
+    All wanted symbols are priced together through get_quotes_async (chunked
+    multi-symbol requests on the shared HTTP pool), and ticks are scheduled on a
+    fixed clock so the period stays PRICE_UPDATE_INTERVAL however many symbols
+    are subscribed. If a pass overruns, missed ticks are skipped, not queued.
+    """
+    loop = asyncio.get_event_loop()
+    next_tick = loop.time()
     while True:
         try:
-            # Get all subscribed symbols
-            symbols_to_update = list(manager.symbol_subscribers.keys())
-            
-            for symbol in symbols_to_update:
-                try:
-                    price = get_quote(symbol)
-                    if price:
-                        message = json.dumps({
-                            "type": "price_update",
-                            "symbol": symbol,
-                            "price": price,
-                            "timestamp": asyncio.get_event_loop().time()
-                        })
-                        await manager.broadcast_to_symbol_subscribers(symbol, message)
-                except Exception as e:
-                    logger.error(f"Error updating price for {symbol}: {e}")
-            
-            # Wait 5 seconds before next update
-            await asyncio.sleep(5)
-            
+            # Get all wanted symbols — nothing to poll while the stream is live
+            if market_stream is not None and market_stream.connected:
+                symbols_to_update = []
+            else:
+                symbols_to_update = demand.symbols()
+
+            if symbols_to_update:
+                cycle_start = time.perf_counter()
+                prices = await get_quotes_async(symbols_to_update)
+                timestamp = loop.time()
+                publish({
+                    symbol: encode_price_update(symbol, price, timestamp)
+                    for symbol, price in prices.items()
+                })
+                # Polled prices carry no traded size, so these bars have zero volume
+                record_ticks({symbol: (float(price), 0) for symbol, price in prices.items()})
+                metrics.price_cycle.observe(time.perf_counter() - cycle_start)
+
         except Exception as e:
             logger.error(f"Error in price_updater: {e}")
-            await asyncio.sleep(10)
 
-# Start the background task
-asyncio.create_task(price_updater())
\ No newline at end of file
+        next_tick += PRICE_UPDATE_INTERVAL
+        now = loop.time()
+        if next_tick < now:
+            logger.warning(f"price_updater overran its {PRICE_UPDATE_INTERVAL}s tick; skipping ahead")
+            next_tick = now
+        await asyncio.sleep(next_tick - now)